@@ -0,0 +1,386 @@
+# --- START OF FILE bench.py (Offline Pipeline Benchmark) ---
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import threading
+import subprocess
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# -------------------- Isolated Environment --------------------
+# Everything the benchmark touches lives under BENCH_DIR, so it never mixes with real
+# state, downloads or outputs. Set before any pipeline module reads its settings.
+BENCH_DIR = os.path.abspath(os.getenv("BENCH_DIR", "bench_work"))
+os.environ["STATE_DB"] = os.path.join(BENCH_DIR, "bench_state.db")
+os.environ["TRACE_DIR"] = os.path.join(BENCH_DIR, "traces")
+os.environ["INPUT_VIDEO_DIR"] = os.path.join(BENCH_DIR, "downloaded")
+os.environ["OUTPUT_VIDEO_DIR"] = os.path.join(BENCH_DIR, "ready")
+os.environ["READY_MANIFEST"] = os.path.join(BENCH_DIR, "ready", "manifest.jsonl")
+
+BASELINE_FILE = "bench_baseline.json"
+BENCH_SUBREDDIT = "benchclips"
+BENCH_ACCOUNT = "bench"
+# A metric this much worse than the baseline counts as a regression.
+REGRESSION_TOLERANCE = 0.10
+
+# -------------------- Synthetic Clips --------------------
+# (name, width, height, seconds, audio codec): one per input class and audio edge case.
+CLIP_CASES = [
+    ("landscape_1080p_aac", 1920, 1080, 20, "aac"),      # full reformat graph
+    ("vertical_1080p_aac", 1080, 1920, 20, "aac"),       # compliant: remux only
+    ("vertical_4k_mp3", 2160, 3840, 12, "mp3"),          # scale only, audio re-encoded
+    ("square_720_silent", 720, 720, 20, None),           # reformat, no audio track
+    ("landscape_720p_opus_long", 1280, 720, 75, "opus"), # past SEGMENT_MIN_DURATION, but timed as one process_video call
+]
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "opus": "libopus"}
+
+def make_clip(path, width, height, seconds, audio):
+    cmd = ["ffmpeg", "-y", "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={seconds}"]
+    if audio:
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-c:a", AUDIO_ENCODERS[audio]]
+    cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-shortest",
+            "-movflags", "+faststart", "-loglevel", "error", path]
+    subprocess.run(cmd, check=True)
+
+def make_clips(clip_dir, quick=False):
+    """Renders every case once. Returns [(name, path, seconds)]."""
+    os.makedirs(clip_dir, exist_ok=True)
+    clips = []
+    for name, width, height, seconds, audio in CLIP_CASES:
+        seconds = max(4, seconds // 4) if quick else seconds
+        path = os.path.join(clip_dir, f"{name}.mp4")
+        if not os.path.exists(path):
+            make_clip(path, width, height, seconds, audio)
+        clips.append((name, path, seconds))
+    return clips
+
+# -------------------- Local Reddit / Instagram Stand-ins --------------------
+def make_handler(clips, base_url):
+    by_name = {os.path.basename(path): path for _, path, _ in clips}
+
+    def post_data(i, name, seconds):
+        post_id = f"bench{i:03d}"
+        return {
+            "id": post_id, "name": f"t3_{post_id}", "title": f"Bench clip {name}",
+            "subreddit": BENCH_SUBREDDIT, "author": "bench", "score": 1000 - i, "num_comments": 0,
+            "created_utc": time.time() - i * 60, "is_video": True, "over_18": False,
+            "media": {"reddit_video": {"duration": seconds, "height": 1080, "is_gif": False}},
+            "url": f"{base_url}/media/{name}.mp4",
+            "permalink": f"/r/{BENCH_SUBREDDIT}/comments/{post_id}/bench/",
+        }
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_media(self, head=False):
+            path = by_name.get(os.path.basename(self.path.split("?")[0]))
+            if not path:
+                return self.send_json({"error": "not found"}, 404)
+            size = os.path.getsize(path)
+            start = 0
+            range_header = self.headers.get("Range", "")
+            if range_header.startswith("bytes="):
+                start = int(range_header[6:].split("-")[0] or 0)
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(size - start))
+            if start:
+                self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+            self.end_headers()
+            if not head:
+                with open(path, "rb") as f:
+                    f.seek(start)
+                    shutil.copyfileobj(f, self.wfile)
+
+        def do_HEAD(self):
+            if self.path.startswith("/media/"):
+                return self.send_media(head=True)
+            self.send_response(200)
+            self.end_headers()
+
+        def do_GET(self):
+            # praw listing calls: /r/<subreddit>/<sort>?limit=...
+            if self.path.startswith(f"/r/{BENCH_SUBREDDIT}/"):
+                children = [{"kind": "t3", "data": post_data(i, name, seconds)} for i, (name, _, seconds) in enumerate(clips)]
+                return self.send_json({"kind": "Listing", "data": {"children": children, "after": None, "before": None}})
+            if self.path.startswith("/media/"):
+                return self.send_media()
+            self.send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            # Read the whole body so uploads cost a real transfer.
+            remaining = length
+            while remaining > 0:
+                remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+            if self.path.startswith("/api/v1/access_token"):
+                return self.send_json({"access_token": "bench", "token_type": "bearer", "expires_in": 3600, "scope": "*"})
+            if self.path.startswith("/rupload_igvideo/"):
+                return self.send_json({"status": "ok"})
+            if self.path.startswith("/media/configure_to_clips"):
+                return self.send_json({"status": "ok", "media": {"pk": int(time.time() * 1000)}})
+            if self.path.endswith("/comment/"):
+                return self.send_json({"status": "ok", "comment": {"pk": 1}})
+            self.send_json({"error": "not found"}, 404)
+
+    return Handler
+
+def start_server(clips):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), None)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.RequestHandlerClass = make_handler(clips, base_url)
+    threading.Thread(target=server.serve_forever, name="BenchServer", daemon=True).start()
+    return server, base_url
+
+class _Media:
+    def __init__(self, pk):
+        self.pk = pk
+
+class FakeInstagramClient:
+    """
+    Replaces the pooled instagrapi client object, not Instagram's endpoints: the two calls insta.py
+    makes are sent as plain POSTs to the local stand-in, so instagrapi's own request building,
+    chunked upload and retries are not part of the timing.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def _post(self, path, body=b""):
+        request = urllib.request.Request(self.base_url + path, data=body, method="POST")
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def clip_upload(self, path, caption, thumbnail=None):
+        with open(path, "rb") as f:
+            self._post(f"/rupload_igvideo/{os.path.basename(path)}", f.read())
+        if thumbnail:
+            with open(thumbnail, "rb") as f:
+                self._post(f"/rupload_igphoto/{os.path.basename(str(thumbnail))}", f.read())
+        return _Media(self._post("/media/configure_to_clips/", caption.encode("utf-8"))["media"]["pk"])
+
+    def media_comment(self, media_id, text):
+        return self._post(f"/media/{media_id}/comment/", text.encode("utf-8"))["comment"]
+
+# -------------------- Measurements --------------------
+def summarize(latencies, wall_seconds, total_bytes=0, media_seconds=0.0):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+    return {
+        "items": len(latencies),
+        "wall_seconds": round(wall_seconds, 3),
+        "items_per_minute": round(len(latencies) * 60 / wall_seconds, 2) if wall_seconds else 0.0,
+        "mb_per_s": round(total_bytes / 1e6 / wall_seconds, 2) if wall_seconds and total_bytes else 0.0,
+        "realtime_factor": round(media_seconds / wall_seconds, 2) if wall_seconds and media_seconds else 0.0,
+        "p50_seconds": round(percentile(0.5), 3),
+        "p95_seconds": round(percentile(0.95), 3),
+    }
+
+def bench_listing(base_url):
+    import praw
+    import reddit
+    from queue import Queue
+
+    client = praw.Reddit(
+        client_id="bench", client_secret="bench", user_agent="reels-bench",
+        oauth_url=base_url, reddit_url=base_url, short_url=base_url, check_for_updates=False,
+    )
+    client_pool = Queue()
+    client_pool.put(client)
+    started = time.monotonic()
+    posts = reddit.fetch_listing(client_pool, {"name": BENCH_SUBREDDIT, "sort": "new", "time_filter": "all", "limit": 100})
+    wall = time.monotonic() - started
+    return posts, summarize([wall], wall)
+
+def bench_download(posts, workers):
+    import downloader
+    import state_db
+
+    download_dir = os.path.join(os.environ["INPUT_VIDEO_DIR"], BENCH_SUBREDDIT)
+    os.makedirs(download_dir, exist_ok=True)
+
+    def fetch(post):
+        state_db.add_discovered(post.id, BENCH_SUBREDDIT, post.title, post.url)
+        filename = os.path.join(download_dir, f"{post.id}.mp4")
+        started = time.monotonic()
+        stats = downloader.download(post.url, filename)
+        state_db.mark_downloaded(post.id, filename, stats["bytes"], stats["seconds"])
+        return post.id, filename, time.monotonic() - started, os.path.getsize(filename)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fetch, posts))
+    wall = time.monotonic() - started
+    return results, summarize([r[2] for r in results], wall, sum(r[3] for r in results))
+
+def bench_process_video(downloads, presets, worker_counts, profile):
+    """
+    Times enhance_cli.process_video per clip on a plain process pool. The work queue, the scheduler's
+    admission control and segments.py's split/join are left out, so long clips are encoded whole.
+    """
+    import probe
+    import profiles
+    import enhance_cli
+
+    infos = {path: probe.probe(path) for _, path, _, _ in downloads}
+    results, outputs = {}, {}
+    for preset in presets:
+        for workers in worker_counts:
+            out_dir = os.path.join(os.environ["OUTPUT_VIDEO_DIR"], f"{preset}-w{workers}")
+            os.makedirs(out_dir, exist_ok=True)
+            started = time.monotonic()
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {}
+                for post_id, path, _, _ in downloads:
+                    output_path = os.path.join(out_dir, f"{post_id}_vertical.mp4")
+                    futures[pool.submit(
+                        enhance_cli.process_video, path, output_path, preset, infos[path], None, profile,
+                        profiles.cover_path_for(output_path)
+                    )] = (post_id, output_path)
+                done = [(futures[f], f.result()) for f in futures]
+            wall = time.monotonic() - started
+            ok = [(key, result) for key, result in done if result]
+            results[f"process_video/{preset}/w{workers}"] = summarize(
+                [result[2]["wall_seconds"] for _, result in ok], wall,
+                media_seconds=sum(infos[result[0]]["duration"] for _, result in ok),
+            )
+            outputs = {post_id: output_path for (post_id, output_path), _ in ok}
+    return outputs, results
+
+def bench_upload(base_url, outputs):
+    import state_db
+    import profiles
+    import ig_accounts
+    import insta
+
+    ig_accounts.ACCOUNTS[BENCH_ACCOUNT] = "bench"
+    ig_accounts._clients[BENCH_ACCOUNT] = FakeInstagramClient(base_url)
+    latencies, comment_latencies, total_bytes = [], [], 0
+    started = time.monotonic()
+    for post_id, output_path in outputs.items():
+        cover_path = profiles.cover_path_for(output_path)
+        state_db.mark_formatted(post_id, output_path, cover_path=cover_path if os.path.exists(cover_path) else None)
+        item = state_db.get_item(post_id)
+        t0 = time.monotonic()
+        if insta.upload_video(item, BENCH_ACCOUNT):
+            latencies.append(time.monotonic() - t0)
+            total_bytes += os.path.getsize(output_path)
+            t0 = time.monotonic()
+            if insta.post_hashtag_comment(state_db.get_item(post_id), BENCH_ACCOUNT):
+                comment_latencies.append(time.monotonic() - t0)
+    wall = time.monotonic() - started
+    return {"upload": summarize(latencies, wall, total_bytes),
+            "comment": summarize(comment_latencies, sum(comment_latencies))}
+
+# -------------------- Baseline Comparison --------------------
+# Metric -> True when higher is better.
+COMPARED_METRICS = {"items_per_minute": True, "mb_per_s": True, "realtime_factor": True,
+                    "p50_seconds": False, "p95_seconds": False}
+
+def compare(results, baseline):
+    """Prints each metric next to the baseline. Returns the list of regressions."""
+    regressions = []
+    print(f"\n{'benchmark':<32} {'metric':<18} {'baseline':>10} {'now':>10} {'change':>8}")
+    for key, metrics in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(metric) or 0, metrics.get(metric) or 0
+            if not old:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = " ⚠️" if worse > REGRESSION_TOLERANCE else ""
+            if flag:
+                regressions.append((key, metric, old, new))
+            print(f"{key:<32} {metric:<18} {old:>10.3f} {new:>10.3f} {change:>+7.1%}{flag}")
+    return regressions
+
+# -------------------- Main Function --------------------
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of download, formatting and upload on synthetic clips.")
+    parser.add_argument("--quick", action="store_true", help="Shorter clips, for a fast smoke run.")
+    parser.add_argument("--presets", default="quality,fast", help="Comma-separated filter presets to time (default: quality,fast).")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="Comma-separated process pool sizes (default: 1,<cores>).")
+    parser.add_argument("--profile", default=None, help="Encoding profile (default: ENCODE_PROFILE or 'balanced').")
+    parser.add_argument("--download-workers", type=int, default=5, help="Parallel downloads (default: 5, like reddit.py).")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help=f"Baseline file to compare against (default: {BASELINE_FILE}).")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run's results as the new baseline.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any metric regressed.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    # Clips are kept between runs so every run times the same inputs; everything else starts fresh.
+    for name in os.listdir(BENCH_DIR) if os.path.isdir(BENCH_DIR) else []:
+        if name != "clips":
+            path = os.path.join(BENCH_DIR, name)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    print("🎞️ Rendering synthetic clips...")
+    clips = make_clips(os.path.join(BENCH_DIR, "clips"), args.quick)
+    server, base_url = start_server(clips)
+    print(f"🛰️ Local Reddit/Instagram stand-in at {base_url}")
+
+    results = {}
+    try:
+        posts, results["listing"] = bench_listing(base_url)
+        print(f"📋 Listing: {len(posts)} posts.")
+        downloads, results["download"] = bench_download(posts, args.download_workers)
+        print(f"⬇️ Downloaded {len(downloads)} clips.")
+        presets = [p.strip() for p in args.presets.split(",") if p.strip()]
+        worker_counts = sorted({int(w) for w in args.workers.split(",") if w.strip()})
+        outputs, encode_results = bench_process_video(downloads, presets, worker_counts, args.profile)
+        results.update(encode_results)
+        print(f"🎬 Formatted with presets {presets} on {worker_counts} workers.")
+        results.update(bench_upload(base_url, outputs))
+        print(f"📤 Uploaded {results['upload']['items']} clips to the stand-in.")
+    finally:
+        server.shutdown()
+
+    print("\n📊 Results")
+    for key, metrics in results.items():
+        print(f"  {key:<32} " + "  ".join(f"{name}={value}" for name, value in metrics.items()))
+
+    run = {"created_at": time.time(), "machine": {"cpus": os.cpu_count(), "platform": platform.platform(),
+           "python": sys.version.split()[0]}, "quick": args.quick, "results": results}
+    with open(os.path.join(BENCH_DIR, f"results-{time.strftime('%Y%m%d-%H%M%S')}.json"), "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("quick") != args.quick:
+            print("\n⚠️ Baseline was recorded with a different --quick setting; the comparison is not like for like.")
+        regressions = compare(results, baseline.get("results", {}))
+        print(f"\n{'⚠️ ' + str(len(regressions)) + ' regressions' if regressions else '✅ No regressions'} against {args.baseline}.")
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(run, f, indent=2)
+        print(f"💾 Saved baseline to {args.baseline}.")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# --- START OF FILE dedup.py (Duplicate Clip Detection) ---
+
+import os
+import hashlib
+import logging
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import state_db
+import probe
+
+# -------------------- Settings --------------------
+# Frames sampled per clip for the perceptual hash; each frame gives a 64-bit dHash.
+PHASH_SAMPLES = int(os.getenv("PHASH_SAMPLES", "4"))
+# Maximum total differing bits (out of 64 * PHASH_SAMPLES) for two clips to count as the same video.
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "24"))
+# ...and for every single sampled frame, so one near-identical frame cannot carry three different ones.
+PHASH_MAX_FRAME_DISTANCE = int(os.getenv("PHASH_MAX_FRAME_DISTANCE", "10"))
+# Re-uploads keep their length; clips further apart than this (seconds, or fraction) are different videos.
+DURATION_TOLERANCE_SECONDS = 1.0
+DURATION_TOLERANCE_RATIO = 0.05
+# A 9x8 dHash is taken after squashing the frame, so it cannot tell a square clip from a 16:9 one.
+# Display aspect ratios (width / height) further apart than this fraction are different videos.
+ASPECT_TOLERANCE_RATIO = 0.1
+HASH_WORKERS = 4
+CONTENT_HASH_CHUNK = 1024 * 1024
+
+_index_lock = threading.Lock()
+_index = None
+
+# -------------------- Hashing --------------------
+def content_hash(path):
+    """Cheap exact-match hash: file size plus the first and last MiB."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(CONTENT_HASH_CHUNK))
+        if size > 2 * CONTENT_HASH_CHUNK:
+            f.seek(-CONTENT_HASH_CHUNK, os.SEEK_END)
+            digest.update(f.read(CONTENT_HASH_CHUNK))
+    return digest.hexdigest()
+
+def _sample_frame(path, timestamp):
+    """Decodes a single frame straight to a 9x8 grayscale buffer."""
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-ss", f"{timestamp:.3f}", "-i", path, "-frames:v", "1",
+         "-vf", "scale=9:8:flags=area,format=gray", "-f", "rawvideo", "-"],
+        capture_output=True, check=True
+    )
+    if len(result.stdout) < 72:
+        raise ValueError(f"short frame read at {timestamp:.1f}s")
+    return np.frombuffer(result.stdout[:72], dtype=np.uint8).reshape(8, 9)
+
+def perceptual_hash(path, duration):
+    """dHash of PHASH_SAMPLES frames spread evenly across the clip, as a uint64 array."""
+    hashes = np.zeros(PHASH_SAMPLES, dtype=np.uint64)
+    for i in range(PHASH_SAMPLES):
+        pixels = _sample_frame(path, duration * (i + 1) / (PHASH_SAMPLES + 1))
+        bits = pixels[:, 1:] > pixels[:, :-1]
+        hashes[i] = np.packbits(bits).view(">u8")[0]
+    return hashes
+
+def compute_hashes(path):
+    """Returns (content_hash, perceptual_hash, duration, aspect). The last three are None if decoding fails."""
+    exact = content_hash(path)
+    try:
+        info = probe.probe(path)
+        aspect = info["width"] / info["height"]
+        return exact, perceptual_hash(path, info["duration"]), info["duration"], aspect
+    except (subprocess.CalledProcessError, ValueError, KeyError, ZeroDivisionError) as e:
+        logging.warning(f"Perceptual hash failed for {os.path.basename(path)}: {e}")
+        return exact, None, None, None
+
+# -------------------- Hash Index --------------------
+def _load_index():
+    global _index
+    if _index is None:
+        post_ids, rows, durations, aspects = [], [], [], []
+        for row in state_db.all_perceptual_hashes():
+            hashes = np.frombuffer(row["phash"], dtype=np.uint64)
+            if len(hashes) == PHASH_SAMPLES:
+                post_ids.append(row["post_id"])
+                rows.append(hashes)
+                # Hashes stored before durations and aspect ratios were kept never match perceptually (NaN compares false).
+                durations.append(row["duration"] if row["duration"] is not None else np.nan)
+                aspects.append(row["aspect"] if row["aspect"] is not None else np.nan)
+        matrix = np.vstack(rows) if rows else np.zeros((0, PHASH_SAMPLES), dtype=np.uint64)
+        _index = {"post_ids": post_ids, "hashes": matrix, "durations": np.array(durations, dtype=np.float64),
+                  "aspects": np.array(aspects, dtype=np.float64)}
+    return _index
+
+def frame_distances(matrix, query):
+    """Hamming distance per sampled frame between `query` and every row of `matrix`, vectorized."""
+    xor = np.bitwise_xor(matrix, query)
+    bits = np.unpackbits(xor.view(np.uint8), axis=1)
+    return bits.reshape(len(matrix), PHASH_SAMPLES, 64).sum(axis=2)
+
+def perceptual_matches(index, phash, duration, aspect):
+    """Indexes of the rows that match: every frame close, the total close, about the same length and shape."""
+    per_frame = frame_distances(index["hashes"], phash)
+    totals = per_frame.sum(axis=1)
+    tolerance = max(DURATION_TOLERANCE_SECONDS, duration * DURATION_TOLERANCE_RATIO)
+    close = (
+        (per_frame.max(axis=1) <= PHASH_MAX_FRAME_DISTANCE)
+        & (totals <= PHASH_MAX_DISTANCE)
+        & (np.abs(index["durations"] - duration) <= tolerance)
+        & (np.abs(index["aspects"] - aspect) <= ASPECT_TOLERANCE_RATIO * aspect)
+    )
+    candidates = np.flatnonzero(close)
+    return candidates[np.argsort(totals[candidates])]
+
+def register(post_id, input_path, hashes=None):
+    """
+    Checks a downloaded clip against everything seen before and records its hashes.
+    Returns the post ID it duplicates, or None if the clip is new.
+    """
+    if state_db.has_media_hash(post_id):
+        return None  # Already checked and indexed on an earlier run.
+    exact, phash, duration, aspect = hashes or compute_hashes(input_path)
+    with _index_lock:
+        duplicate_of = state_db.find_content_hash(exact, exclude_post_id=post_id)
+        index = _load_index()
+        if duplicate_of is None and phash is not None and len(index["post_ids"]):
+            matches = perceptual_matches(index, phash, duration, aspect)
+            if len(matches):
+                duplicate_of = index["post_ids"][int(matches[0])]
+
+        if duplicate_of:
+            state_db.mark_duplicate(post_id, duplicate_of)
+            return duplicate_of
+
+        state_db.add_media_hash(post_id, exact, phash.tobytes() if phash is not None else None, duration, aspect)
+        if phash is not None:
+            index["post_ids"].append(post_id)
+            index["hashes"] = np.vstack([index["hashes"], phash])
+            index["durations"] = np.append(index["durations"], duration)
+            index["aspects"] = np.append(index["aspects"], aspect)
+        return None
+
+def drop_duplicates(tasks):
+    """
+    Filters (post_id, input_path, output_path, preset) tasks down to clips not seen before.
+    Hashing runs in parallel; the index checks run in task order so duplicates
+    inside the same batch are caught too.
+    """
+    unique = [task for task in tasks if state_db.has_media_hash(task[0])]
+    to_check = [task for task in tasks if not state_db.has_media_hash(task[0])]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        all_hashes = list(pool.map(lambda task: compute_hashes(task[1]), to_check))
+
+    for task, hashes in zip(to_check, all_hashes):
+        duplicate_of = register(task[0], task[1], hashes)
+        if duplicate_of:
+            logging.info(f"Dropped {os.path.basename(task[1])}: duplicate of post {duplicate_of}")
+        else:
+            unique.append(task)
+    return unique
@@ -0,0 +1,116 @@
+# --- START OF FILE downloader.py (Bandwidth-Aware yt_dlp Engine) ---
+
+import os
+import time
+import threading
+
+# -------------------- Settings --------------------
+# The reels canvas. A source only needs to fill one side of it, because
+# enhance_cli.py scales the foreground to fit inside 1080x1920.
+TARGET_WIDTH = 1080
+TARGET_HEIGHT = 1920
+# Lowest audio bitrate worth keeping; anything above it is wasted on a phone speaker.
+MIN_AUDIO_KBPS = int(os.getenv("MIN_AUDIO_KBPS", "96"))
+
+_local = threading.local()
+
+# -------------------- Format Selection --------------------
+def _size_key(f):
+    # Prefer the known file size, then the bitrate, then the pixel count.
+    return (f.get('filesize') or f.get('filesize_approx') or float('inf'),
+            f.get('tbr') or float('inf'),
+            (f.get('width') or 0) * (f.get('height') or 0))
+
+def meets_target(f):
+    return (f.get('width') or 0) >= TARGET_WIDTH or (f.get('height') or 0) >= TARGET_HEIGHT
+
+def pick_video(candidates):
+    """Smallest format that still fills the canvas, or the largest one if none does."""
+    big_enough = [f for f in candidates if meets_target(f)]
+    if big_enough:
+        # Among equal sizes, H.264 lets enhance_cli.py take its cheaper paths.
+        return min(big_enough, key=lambda f: (_size_key(f), not (f.get('vcodec') or '').startswith('avc')))
+    return max(candidates, key=lambda f: ((f.get('width') or 0) * (f.get('height') or 0), f.get('tbr') or 0))
+
+def pick_audio(candidates):
+    good_enough = [f for f in candidates if (f.get('abr') or f.get('tbr') or 0) >= MIN_AUDIO_KBPS]
+    if good_enough:
+        return min(good_enough, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+    return max(candidates, key=lambda f: f.get('abr') or f.get('tbr') or 0)
+
+def select_formats(ctx):
+    """yt_dlp format selector: the cheapest video/audio pair that still meets the 1080x1920 target."""
+    formats = ctx.get('formats') or []
+    video_only = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') == 'none']
+    audio_only = [f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
+    combined = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+
+    if not video_only:
+        if combined:
+            yield pick_video(combined)
+        return
+
+    video = pick_video(video_only)
+    if not audio_only:
+        yield video
+        return
+
+    audio = pick_audio(audio_only)
+    yield {
+        'format_id': f"{video['format_id']}+{audio['format_id']}",
+        'ext': 'mp4',
+        'requested_formats': [video, audio],
+        'protocol': f"{video['protocol']}+{audio['protocol']}",
+    }
+
+# -------------------- Per-Worker Engine --------------------
+def get_downloader():
+    """Returns this worker thread's (YoutubeDL, stats) pair, creating it on first use."""
+    if getattr(_local, 'ydl', None) is None:
+        import yt_dlp  # Heavy; only download workers pay for it.
+        stats = {'start_offsets': {}, 'transferred': {}}
+
+        def progress_hook(d):
+            if d.get('status') != 'downloading':
+                return
+            name = d.get('filename') or ''
+            done = d.get('downloaded_bytes') or 0
+            # The first report for a resumed .part file starts at the resume offset, not zero.
+            start = stats['start_offsets'].setdefault(name, done)
+            stats['transferred'][name] = max(0, done - start)
+
+        _local.ydl = yt_dlp.YoutubeDL({
+            'quiet': True,
+            'noplaylist': True,
+            'merge_output_format': 'mp4',
+            'format': select_formats,
+            # Keep .part files on a crash and pick them up again on the next run.
+            'continuedl': True,
+            'nopart': False,
+            'progress_hooks': [progress_hook],
+        })
+        _local.stats = stats
+    return _local.ydl, _local.stats
+
+def download(url, filename):
+    """
+    Downloads `url` to `filename` with this worker's engine.
+    Returns {'bytes', 'seconds', 'throughput'} where bytes are the ones actually
+    transferred this time (resumed partials are not counted twice).
+    """
+    ydl, stats = get_downloader()
+    # The output path is a template, so literal '%' must be escaped.
+    ydl.params['outtmpl']['default'] = filename.replace('%', '%%')
+    stats['start_offsets'].clear()
+    stats['transferred'].clear()
+
+    started = time.monotonic()
+    ydl.download([url])
+    seconds = time.monotonic() - started
+
+    transferred = sum(stats['transferred'].values())
+    return {
+        'bytes': transferred,
+        'seconds': seconds,
+        'throughput': transferred / seconds if seconds > 0 else 0.0,
+    }
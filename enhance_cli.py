@@ -1,13 +1,27 @@
 # --- START OF FILE enhance_cli.py (Assertive CPU Logic) ---
 
 import os
+import argparse
 import subprocess
 import logging
-import csv
+import signal
+import threading
+import state_db
+import dedup
+import probe
+import profiles
+import manifest
 from dotenv import load_dotenv
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import psutil
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import tempfile
+import scheduler
+import segments
+import watcher
+import storage
+import tracing
+import work_queue
+import ranking
+import outputs
 
 # -------------------- Load Environment Variables --------------------
 load_dotenv()
@@ -27,7 +41,12 @@ def log_console(msg, level='info'):
 # -------------------- Folders --------------------
 INPUT_DIR = os.getenv("INPUT_VIDEO_DIR", "downloaded_videos")
 OUTPUT_DIR = os.getenv("OUTPUT_VIDEO_DIR", "ready_to_post")
-FORMAT_LOG_FILE = "video_format_log.csv"
+PROBE_WORKERS = 4
+# An encode node leases this many times the clips it has free slots for, probes them, keeps the
+# longest and hands the rest straight back. Longest-first then works across a window of the queue
+# rather than the one or two clips a slot refill would lease; which clips enter the window is
+# still decided by ranking priority, and the rest are invisible to other nodes only while probed.
+FORMAT_LEASE_WINDOW = max(1, int(os.getenv("FORMAT_LEASE_WINDOW", "4")))
 
 # -------------------- Definitive 'Blurred Background' FFmpeg Filter --------------------
 FFMPEG_FILTERS = (
@@ -37,106 +56,484 @@ FFMPEG_FILTERS = (
     "[blurred_bg][fg]overlay=(W-w)/2:(H-h)/2"
 )
 
+# -------------------- Filter Presets --------------------
+FILTER_PRESETS = {
+    # Full-resolution blur, the original look.
+    "quality": FFMPEG_FILTERS,
+    # Blurs a 1/8-scale copy and upscales it. The blur radius is scaled down with it
+    # (4 px x 10 passes at 135x240 is about the same spread as 30 px x 15 passes at 1080x1920).
+    "fast": (
+        "[0:v]split=2[original][background];"
+        "[background]scale=135:240:force_original_aspect_ratio=increase,crop=135:240,boxblur=4:10,"
+        "scale=1080:1920:flags=bilinear[blurred_bg];"
+        "[original]scale=1080:1920:force_original_aspect_ratio=decrease[fg];"
+        "[blurred_bg][fg]overlay=(W-w)/2:(H-h)/2"
+    ),
+    # No background at all, just black bars.
+    "letterbox": (
+        "[0:v]scale=1080:1920:force_original_aspect_ratio=decrease,"
+        "pad=1080:1920:(ow-iw)/2:(oh-ih)/2:color=black"
+    ),
+}
+DEFAULT_PRESET = os.getenv("FILTER_PRESET", "quality")
+# Per-subreddit presets, e.g. FILTER_PRESET_OVERRIDES=valorant:fast,halo:letterbox
+PRESET_OVERRIDES = {
+    name.strip().lower(): preset.strip()
+    for name, _, preset in (entry.partition(":") for entry in os.getenv("FILTER_PRESET_OVERRIDES", "").split(","))
+    if name.strip() and preset.strip() in FILTER_PRESETS
+}
+
+def preset_for(subreddit_folder, run_preset=None):
+    """A subreddit override wins over the preset chosen for the run, which wins over FILTER_PRESET."""
+    preset = PRESET_OVERRIDES.get(subreddit_folder.lower()) or run_preset or DEFAULT_PRESET
+    return preset if preset in FILTER_PRESETS else "quality"
+
 # -------------------- Video Processing Function --------------------
-def process_video(input_path, output_path):
+# Vertical sources only need shrinking, never upscaling, and never a background.
+SCALE_ONLY_FILTER = (
+    "scale='min(1080,iw)':'min(1920,ih)':force_original_aspect_ratio=decrease:force_divisible_by=2,setsar=1"
+)
+
+def build_ffmpeg_command(input_path, output_path, preset, info, threads=None, profile=None, cover_path=None):
+    """
+    Picks the cheapest ffmpeg invocation that makes this input reels-ready.
+    With `cover_path`, the same invocation also writes the reel's cover JPEG as a second output.
+    """
+    input_class = probe.classify(info)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", input_path]
+    if input_class == probe.COMPLIANT:
+        if cover_path:
+            cmd += profiles.cover_seek_args(info, input_path)
+        cmd += ["-map", "0:v:0", "-map", "0:a:0?", "-c:v", "copy"]
+    else:
+        if input_class == probe.SCALE:
+            graph, extra = f"[0:v]{SCALE_ONLY_FILTER}", []
+        else:
+            graph, extra = FILTER_PRESETS[preset], ["-aspect", "9:16"]
+        if cover_path:
+            # Split the finished frames so the cover comes out of the same decode and filter pass.
+            graph += f"[formatted];[formatted]split=2[vout][cover_src];[cover_src]{profiles.cover_filter(info)}[cover]"
+        else:
+            graph += "[vout]"
+        cmd += ["-filter_complex", graph, "-map", "[vout]", "-map", "0:a:0?"] + extra + profiles.video_args(info, profile)
+    cmd += profiles.audio_args(info) + profiles.container_args()
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd.append(output_path)
+    if cover_path:
+        if input_class == probe.COMPLIANT:
+            cmd += ["-map", "1:v:0"] + profiles.cover_output_args(cover_path, seeked=True)
+        else:
+            cmd += ["-map", "[cover]"] + profiles.cover_output_args(cover_path)
+    return cmd
+
+def process_video(input_path, output_path, preset="quality", info=None, threads=None, profile=None, cover_path=None,
+                  check_duration=True):
+    """
+    Returns (input_path, output_path, stats) on success, where stats holds wall/CPU seconds and peak RSS.
+    ffmpeg writes temp files, which replace `output_path` and the cover only once they pass outputs.check().
+    """
+    temp_video = outputs.temp_path(output_path)
+    temp_cover = outputs.temp_path(cover_path) if cover_path else None
     try:
-        cmd = (
-            f'ffmpeg -y -i "{input_path}" -filter_complex "{FFMPEG_FILTERS}" -aspect 9:16 '
-            f'-c:v libx264 -preset faster -crf 23 -c:a copy -loglevel error "{output_path}"'
-        )
-        subprocess.run(cmd, shell=True, capture_output=True, text=True, check=True)
-        return (input_path, output_path)
+        info = info or probe.probe(input_path)
+        cmd = build_ffmpeg_command(input_path, temp_video, preset, info, threads, profile, temp_cover)
+        with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as stderr:
+            returncode, stats = scheduler.run_monitored(cmd, stdout=subprocess.DEVNULL, stderr=stderr, text=True)
+            if returncode != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+        if not outputs.commit(output_path, info, cover_path, check_duration):
+            return None
+        return (input_path, output_path, stats)
     except subprocess.CalledProcessError as e:
         logging.error(f"❌ FFmpeg failed on {os.path.basename(input_path)}.")
-        logging.error(f"   Command: {e.cmd}")
+        logging.error(f"   Command: {' '.join(e.cmd) if isinstance(e.cmd, list) else e.cmd}")
         logging.error(f"   Stderr: {e.stderr}")
         return None
     except Exception as e:
         logging.error(f"❌ An unexpected error occurred while processing {os.path.basename(input_path)}: {e}")
         raise
+    finally:
+        # Nothing is left behind by a failed encode; a committed one has already been renamed.
+        outputs.discard(temp_video, temp_cover)
+
+def submit_job(executor, job):
+    # Segments get no cover; their parent's is taken when the pieces are joined.
+    # Their length is only known roughly, so the joined video's duration is checked instead.
+    segment = "parent" in job
+    cover_path = None if segment else profiles.cover_path_for(job["output_path"])
+    return executor.submit(
+        process_video, job["input_path"], job["output_path"], job["preset"], job["info"], job["threads"],
+        job["profile"], cover_path, not segment
+    )
+
+def probe_inputs(tasks):
+    """Probes every task's input in parallel. Returns {input_path: info}, leaving out unreadable files."""
+    def safe_probe(task):
+        post_id, input_path = task[0], task[1]
+        with tracing.span("probe", post_id) as span:
+            try:
+                return probe.probe(input_path)
+            except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+                span["status"] = "error"
+                log_console(f"⚠️ Could not probe {os.path.basename(input_path)}, skipping it: {e}", 'warning')
+                return None
+
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+        infos = pool.map(safe_probe, tasks)
+    return {task[1]: info for task, info in zip(tasks, infos) if info}
 
 # -------------------- State Management --------------------
-def get_already_formatted_videos():
-    if not os.path.exists(FORMAT_LOG_FILE):
-        with open(FORMAT_LOG_FILE, "w", encoding="utf-8", newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(["Input Path", "Output Path"])
-        return set()
-    
-    formatted_videos = set()
+def record_formatted(post_id, output_path, preset=None, profile=None, info=None):
+    stats = profiles.output_stats(output_path, info) if info else {}
+    cover_path = profiles.cover_path_for(output_path)
+    cover_path = cover_path if os.path.exists(cover_path) else None
+    state_db.mark_formatted(
+        post_id, output_path, filter_preset=preset, encode_profile=profiles.resolve(profile),
+        output_bytes=stats.get("output_bytes"), output_kbps=stats.get("output_kbps"), cover_path=cover_path
+    )
+    # Published after the state change, so a reader of the manifest always finds the item formatted.
+    item = state_db.get_item(post_id)
+    manifest.publish(
+        post_id, item["subreddit"], item["title"], output_path,
+        duration=profiles.clip_duration(info) if info else None,
+        size=stats.get("output_bytes"), cover_path=cover_path
+    )
+
+def adopt_finished_output(post_id, input_path, output_path, preset=None, profile=None):
+    """
+    Records an output that is already in place instead of encoding it again: the last run stopped
+    after renaming it but before recording it. Files from before outputs were written atomically
+    may be truncated, so it is checked first and removed if bad. Returns True if it was recorded.
+    """
+    if not os.path.exists(output_path):
+        return False
     try:
-        with open(FORMAT_LOG_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)
-            for row in reader:
-                if row:
-                    formatted_videos.add(row[0])
-    except (IOError, StopIteration):
-        pass
-    return formatted_videos
+        info = probe.probe(input_path)
+    except (subprocess.CalledProcessError, ValueError, KeyError):
+        return False  # The unreadable input is dropped when the job is prepared.
+    problem = outputs.check(output_path, info)
+    if problem:
+        log_console(f"🗑️ Removing unfinished output {os.path.basename(output_path)} ({problem}); it is encoded again.", 'warning')
+        outputs.discard(output_path, profiles.cover_path_for(output_path))
+        return False
+    record_formatted(post_id, output_path, preset, profile, info)
+    log_console(f"♻️ Recorded {os.path.basename(output_path)}, finished before the last run stopped.")
+    return True
 
-# -------------------- Main Function --------------------
-def main():
-    if not os.path.exists(INPUT_DIR):
-        log_console(f"❗ Input directory '{INPUT_DIR}' not found. Please run reddit.py first.", 'error')
-        return
+def clean_interrupted():
+    """Startup: drops temp files of encodes that a crash cut short. Their clips are still queued and are encoded again."""
+    removed = outputs.clean_orphans()
+    if removed:
+        log_console(f"🧹 Removed {removed} temp outputs left by an interrupted run.")
 
-    already_formatted = get_already_formatted_videos()
-    tasks_to_run = []
+def republish_formatted(item):
+    """
+    A format task still open for a formatted item means the last run stopped between recording
+    the output and settling the task, possibly before the manifest entry was written. Publishing
+    again is harmless: planning skips posts that already have a slot.
+    """
+    if item["state"] == "formatted":
+        manifest.publish(
+            item["post_id"], item["subreddit"], item["title"], item["output_path"],
+            size=item["output_bytes"], cover_path=item["cover_path"]
+        )
+
+def output_path_for(input_path):
+    """Maps downloaded_videos/<sub>/<name>.mp4 to ready_to_post/<sub>/<name>_vertical.mp4."""
+    subreddit_folder = os.path.basename(os.path.dirname(input_path))
+    output_subdir = os.path.join(OUTPUT_DIR, subreddit_folder)
+    os.makedirs(output_subdir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_subdir, f"{base_name}_vertical.mp4")
 
-    log_console(f"🔍 Scanning for new videos in '{INPUT_DIR}' to format...")
-    
-    for subreddit_folder in os.listdir(INPUT_DIR):
-        subreddit_path = os.path.join(INPUT_DIR, subreddit_folder)
-        if not os.path.isdir(subreddit_path):
+def collect_format_tasks(run_preset=None):
+    """Returns (post_id, input_path, output_path, preset) for every downloaded video not yet formatted."""
+    tasks_to_run = []
+    for item in state_db.items_in_state("downloaded"):
+        input_path = item["raw_path"]
+        if not input_path or not os.path.exists(input_path):
+            log_console(f"⚠️ Raw file for post {item['post_id']} is missing: {input_path}", 'warning')
             continue
+        preset = preset_for(os.path.basename(os.path.dirname(input_path)), run_preset)
+        tasks_to_run.append((item["post_id"], input_path, output_path_for(input_path), preset))
+    return tasks_to_run
 
-        output_subdir = os.path.join(OUTPUT_DIR, subreddit_folder)
-        os.makedirs(output_subdir, exist_ok=True)
+def enqueue_downloaded():
+    """
+    Queues a format task for every downloaded clip that has none yet, e.g. downloads recorded
+    before the work queue existed. Returns how many were added.
+    """
+    return sum(
+        work_queue.enqueue(work_queue.FORMAT, post_id, {"raw_path": input_path}, status=ranking.admission_status())
+        for post_id, input_path, _, _ in collect_format_tasks()
+    )
 
-        for file in os.listdir(subreddit_path):
-            if file.lower().endswith(".mp4"):
-                input_path = os.path.join(subreddit_path, file)
-                if input_path in already_formatted:
-                    continue
+def lease_format_jobs(limit, run_preset=None, profile=None):
+    """
+    Leases up to `limit` format tasks from the work queue, the longest of a window of
+    FORMAT_LEASE_WINDOW times as many. Returns (jobs, leased): the scheduler jobs, each carrying
+    its task, and how many tasks were kept. Tasks that turn out to need no encode are settled
+    right away, so `leased` can be non-zero while `jobs` is empty.
+    """
+    leased, format_tasks = {}, []
+    tasks = work_queue.lease(work_queue.FORMAT, limit * FORMAT_LEASE_WINDOW)
+    for task in tasks:
+        post_id, input_path = task["post_id"], task["payload"]["raw_path"]
+        item = state_db.get_item(post_id)
+        if item is None or item["state"] != "downloaded":
+            # Already formatted (or dropped) by another node or an earlier run.
+            if item is not None:
+                republish_formatted(item)
+            work_queue.complete(task)
+            continue
+        if not os.path.exists(input_path):
+            log_console(f"⚠️ Raw file for post {post_id} is missing: {input_path}", 'warning')
+            work_queue.fail(task, "raw file missing", retry=False)
+            continue
+        preset = preset_for(os.path.basename(os.path.dirname(input_path)), run_preset)
+        output_path = output_path_for(input_path)
+        if adopt_finished_output(post_id, input_path, output_path, preset, profile):
+            work_queue.complete(task)
+            continue
+        leased[post_id] = task
+        format_tasks.append((post_id, input_path, output_path, preset))
 
-                base_name = os.path.splitext(file)[0]
-                output_path = os.path.join(output_subdir, f"{base_name}_vertical.mp4")
-                tasks_to_run.append((input_path, output_path))
+    jobs = prepare_jobs(format_tasks, profile)
+    for job in jobs:
+        job["task"] = leased.pop(job["post_id"])
+    # What prepare_jobs dropped was either a duplicate or unreadable.
+    for post_id, task in leased.items():
+        if state_db.get_item(post_id)["state"] == state_db.DUPLICATE:
+            work_queue.complete(task)
+        else:
+            work_queue.fail(task, "could not be probed", retry=False)
+    # Jobs come longest first; the shorter ones go back to the queue for the next free slot.
+    for job in jobs[limit:]:
+        work_queue.release(job["task"])
+    return jobs[:limit], len(tasks) - len(jobs[limit:])
 
+def clips_in_flight(pending, running):
+    return {job["post_id"] for job in pending} | {job["post_id"] for job in running.values()}
+
+# -------------------- Job Loop --------------------
+def prepare_jobs(tasks_to_run, profile=None):
+    """Drops duplicates and unreadable inputs, then turns the rest into scheduler jobs, longest first."""
+    if tasks_to_run:
+        log_console(f"🧬 Checking {len(tasks_to_run)} downloads for duplicate clips...")
+        unique_tasks = dedup.drop_duplicates(tasks_to_run)
+        if len(unique_tasks) < len(tasks_to_run):
+            log_console(f"♻️ Dropped {len(tasks_to_run) - len(unique_tasks)} duplicate clips before encoding.")
+        tasks_to_run = unique_tasks
     if not tasks_to_run:
-        log_console("✅ All videos have already been formatted. Nothing to do.")
-        return
+        return []
 
-    log_console(f"Found {len(tasks_to_run)} new videos to format.")
+    infos = probe_inputs(tasks_to_run)
+    tasks_to_run = [task for task in tasks_to_run if task[1] in infos]
+    class_counts = {}
+    for info in infos.values():
+        input_class = probe.classify(info)
+        class_counts[input_class] = class_counts.get(input_class, 0) + 1
+    log_console(f"🔬 Input classes: {class_counts or 'none'} (compliant = remux only, scale = no blur).")
 
-    # --- THIS IS THE CRITICAL CHANGE ---
-    # This logic now ignores the current CPU load and just uses a fixed percentage of total cores.
-    cpu_count = os.cpu_count() or 4 # Get total cores, default to 4 if undetectable
-    # Use 75% of the total cores, with a minimum of 1 and a max of 12 (to prevent overkill on servers)
-    max_workers = min(12, max(1, int(cpu_count * 0.75)))
-    log_console(f"🧠 Using an assertive strategy with up to {max_workers} worker processes.")
-    # ------------------------------------
+    return scheduler.order_longest_first([
+        scheduler.make_job(post_id, input_path, output_path, preset, infos[input_path], profiles.resolve(profile))
+        for post_id, input_path, output_path, preset in tasks_to_run
+    ])
 
+def pump(executor, pending, running):
+    """
+    One turn of the job loop: starts as many pending jobs as the scheduler allows, waits up to
+    a second for running ones and returns [(job, output_path or None)] for every finished video.
+    """
+    # Start as many jobs as the CPU, memory and thread budget allow right now.
+    while pending and scheduler.try_acquire(pending[0]):
+        job = pending.pop(0)
+        running[submit_job(executor, job)] = job
+
+    finished = []
+    done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED) if running else (set(), set())
+    for future in done:
+        job = running.pop(future)
+        result = None
+        try:
+            result = future.result()
+        except Exception as e:
+            log_console(f"❌ A task for {os.path.basename(job['input_path'])} generated an exception: {e}", 'error')
+        scheduler.release(job, result[2] if result else None)
+
+        if "parent" in job:
+            # A segment: the video is only done once its last piece is in and joined.
+            job = segments.segment_done(job, bool(result))
+            if job is None:
+                continue
+            output_path = segments.finish(job)
+        else:
+            output_path = result[1] if result else None
+
+        if output_path:
+            record_formatted(job["post_id"], output_path, job["preset"], job["profile"], job["info"])
+            work_queue.complete(job["task"])
+        else:
+            work_queue.fail(job["task"], "encode failed")
+        finished.append((job, output_path))
+    return finished
+
+def make_pool():
+    # Workers get their own process group, so Ctrl+C reaches only this process and
+    # running encodes are drained instead of killed along with it.
+    initializer = os.setpgrp if hasattr(os, "setpgrp") else None
+    return ProcessPoolExecutor(max_workers=scheduler.MAX_PARALLEL_JOBS, initializer=initializer)
+
+# -------------------- Watch Mode --------------------
+def watch(args):
+    """
+    Keeps one warm process pool and formats downloads from the work queue as soon as they are
+    queued, woken by inotify (debounced) or, without it, by polling the queue. This is how an
+    encode node runs. SIGINT/SIGTERM stop new work; encodes already running are finished and
+    recorded, and clips not started yet go back to the queue.
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    os.makedirs(INPUT_DIR, exist_ok=True)
+    folder_watch = watcher.open_watch(INPUT_DIR)
+    trigger = watcher.make_trigger()
+    if folder_watch:
+        log_console(f"👀 Watching '{INPUT_DIR}' with inotify (debounce {watcher.WATCH_DEBOUNCE_SECONDS:g}s).")
+    else:
+        log_console(f"👀 Polling for new downloads every {watcher.WATCH_POLL_SECONDS:g}s (inotify not available).")
+    clean_interrupted()
+
+    added = enqueue_downloaded()
+    if added:
+        log_console(f"📥 Queued {added} earlier downloads for formatting.")
+    log_console(f"🛰️ Encode node {work_queue.NODE_ID} takes up to {scheduler.MAX_PARALLEL_JOBS} clips at a time from the work queue.")
+
+    pending, running = [], {}
     processed_count = 0
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_path = {executor.submit(process_video, task[0], task[1]): task[0] for task in tasks_to_run}
-        
-        pbar = tqdm(as_completed(future_to_path), total=len(tasks_to_run), desc="Formatting Videos", unit="video")
+    backlog = True
+    with make_pool() as executor:
+        while True:
+            in_flight = clips_in_flight(pending, running)
+            if stop.is_set():
+                # Pieces of clips that were already split are finished too; whole clips go back to the queue.
+                for job in pending:
+                    if "parent" not in job:
+                        work_queue.release(job["task"])
+                pending[:] = [job for job in pending if "parent" in job]
+                if not pending and not running:
+                    break
+            elif len(in_flight) < scheduler.MAX_PARALLEL_JOBS and (backlog or watcher.scan_due(trigger)):
+                watcher.scanned(trigger)
+                storage.maybe_enforce("format")
+                # New downloads are scored, and only the best per subreddit are let in. A pass triggered by
+                # a new download runs right away; refills after a finished encode reuse a recent one.
+                ranking.rank_and_gate(force=not backlog)
+                # Only as many clips as this node can run, so the rest stay free for other encode nodes.
+                jobs, leased = lease_format_jobs(scheduler.MAX_PARALLEL_JOBS - len(in_flight), args.preset, args.profile)
+                # Tasks settled without an encode still mean the queue may hold more.
+                backlog = bool(leased)
+                pending.extend(segments.expand(jobs))
+                if jobs:
+                    log_console(f"📥 Took {len(jobs)} downloads from the queue for formatting.")
 
-        for future in pbar:
-            path = future_to_path[future]
-            try:
-                result = future.result()
-                if result:
-                    with open(FORMAT_LOG_FILE, "a", encoding="utf-8", newline='') as log_file:
-                        writer = csv.writer(log_file)
-                        writer.writerow(result)
+            for job, output_path in pump(executor, pending, running):
+                # A slot is free again: look for more work right away.
+                backlog = True
+                if output_path:
+                    processed_count += 1
+                    log_console(f"✅ Formatted {os.path.basename(output_path)}")
+
+            if stop.is_set():
+                continue
+            # Busy: just take in new events. Idle: wait for one, waking every second to notice a stop request.
+            timeout = 0 if (pending or running) else 1.0
+            if folder_watch:
+                if watcher.wait_for_downloads(folder_watch, timeout):
+                    watcher.note_event(trigger)
+            elif timeout:
+                stop.wait(timeout)
+
+    watcher.close_watch(folder_watch)
+    log_console(f"\n🏁 Watch mode stopped. Formatted {processed_count} videos.")
+
+# -------------------- Main Function --------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Formats downloaded clips as vertical reels.")
+    parser.add_argument(
+        "--preset", choices=sorted(FILTER_PRESETS),
+        help="Filter preset for this run (default: FILTER_PRESET or 'quality'). FILTER_PRESET_OVERRIDES still apply per subreddit."
+    )
+    parser.add_argument(
+        "--profile", choices=sorted(profiles.ENCODE_PROFILES),
+        help="Size-targeted encoding profile (default: ENCODE_PROFILE or 'balanced')."
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="Keep running and format queued downloads as soon as they land, until Ctrl+C or SIGTERM (encode node mode)."
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.watch:
+        watch(args)
+        return
+    if not os.path.exists(INPUT_DIR):
+        log_console(f"❗ Input directory '{INPUT_DIR}' not found. Please run reddit.py first.", 'error')
+        return
+
+    storage.enforce_budgets("format")
+    clean_interrupted()
+    log_console("🔍 Looking up downloaded videos that still need formatting...")
+    added = enqueue_downloaded()
+    if added:
+        log_console(f"📥 Queued {added} earlier downloads for formatting.")
+    log_console("🏅 Ranking waiting clips by Reddit engagement, motion, black/frozen frames and loudness...")
+    _, deferred = ranking.rank_and_gate(force=True)
+    if deferred:
+        log_console(f"🏅 Formatting the best {ranking.RANK_TOP_N} per subreddit; {deferred} clips wait for a later run.")
+    waiting = work_queue.outstanding(work_queue.FORMAT)
+    if not waiting:
+        log_console("✅ All videos have already been formatted. Nothing to do.")
+        return
+
+    log_console(f"Found {waiting} videos waiting to be formatted (shared with any other encode nodes).")
+    log_console(f"🧠 Adaptive scheduling on {scheduler.CPU_COUNT} cores, up to {scheduler.MAX_PARALLEL_JOBS} jobs, longest clips first.")
+
+    processed_count = finished_count = 0
+    pending, running = [], {}
+    backlog = True
+    from tqdm import tqdm
+    with make_pool() as executor:
+        pbar = tqdm(total=waiting, desc="Formatting Videos", unit="video")
+        while True:
+            in_flight = clips_in_flight(pending, running)
+            if backlog and len(in_flight) < scheduler.MAX_PARALLEL_JOBS:
+                # Leases only what this node can run, so other encode nodes get the rest.
+                jobs, leased = lease_format_jobs(scheduler.MAX_PARALLEL_JOBS - len(in_flight), args.preset, args.profile)
+                # Tasks settled without an encode still mean the queue may hold more.
+                backlog = bool(leased)
+                pbar.update(leased - len(jobs))
+                # Long clips are cut into pieces here so they spread over the whole pool.
+                pieces = segments.expand(jobs)
+                if len(pieces) > len(jobs):
+                    log_console(f"✂️ Split long clips into segments: {len(pieces)} encode jobs for {len(jobs)} videos.")
+                pending.extend(pieces)
+            if not pending and not running and not backlog:
+                break
+            for job, output_path in pump(executor, pending, running):
+                backlog = True
+                finished_count += 1
+                if output_path:
                     processed_count += 1
-            except Exception as e:
-                log_console(f"❌ A task for {os.path.basename(path)} generated an exception: {e}", 'error')
+                pbar.update(1)
+        pbar.close()
 
-    log_console(f"\n🏁 Formatting complete. Successfully formatted {processed_count}/{len(tasks_to_run)} new videos.")
+    log_console(f"\n🏁 Formatting complete. Successfully formatted {processed_count}/{finished_count} new videos.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,104 @@
+# --- START OF FILE ig_accounts.py (Instagram Client Pool) ---
+
+import os
+import re
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Read here too: the account settings are needed at import time, before the importing script loads .env.
+load_dotenv()
+
+# -------------------- Settings --------------------
+DEFAULT_ACCOUNT = os.getenv("INSTAGRAM_USERNAME")
+# Session cookies per account, reused across runs without logging in again.
+SESSION_DIR = os.getenv("IG_SESSION_DIR", "ig_sessions")
+# Where the single-account uploader kept its session; still used for INSTAGRAM_USERNAME if present.
+LEGACY_SESSION_FILE = "ig_session.json"
+
+def env_key(account):
+    return re.sub(r"[^A-Za-z0-9]", "_", account).upper()
+
+def load_accounts():
+    """
+    {username: password} for INSTAGRAM_USERNAME plus every name listed in INSTAGRAM_ACCOUNTS,
+    whose passwords come from INSTAGRAM_PASSWORD_<NAME> (upper case, other characters as '_').
+    """
+    accounts = {}
+    if DEFAULT_ACCOUNT:
+        accounts[DEFAULT_ACCOUNT] = os.getenv("INSTAGRAM_PASSWORD")
+    for name in os.getenv("INSTAGRAM_ACCOUNTS", "").split(","):
+        if name.strip():
+            accounts.setdefault(name.strip(), os.getenv(f"INSTAGRAM_PASSWORD_{env_key(name.strip())}"))
+    return accounts
+
+def load_routes(accounts):
+    """ACCOUNT_ROUTES=apexlegends:apexclips,valorant:fpsdaily,default:mainaccount -> {subreddit key: account}"""
+    routes = {}
+    for entry in os.getenv("ACCOUNT_ROUTES", "").split(","):
+        key, _, account = entry.partition(":")
+        if not key.strip():
+            continue
+        if account.strip() not in accounts:
+            logging.warning(f"ACCOUNT_ROUTES entry '{entry}' names an unknown account; ignoring it.")
+            continue
+        routes[key.strip().lower()] = account.strip()
+    return routes
+
+ACCOUNTS = load_accounts()
+ROUTES = load_routes(ACCOUNTS)
+
+_clients = {}
+_pool_lock = threading.Lock()
+
+# -------------------- Sessions --------------------
+def session_file(account):
+    if account == DEFAULT_ACCOUNT and os.path.exists(LEGACY_SESSION_FILE):
+        return LEGACY_SESSION_FILE
+    return os.path.join(SESSION_DIR, f"{account}.json")
+
+def _login(account):
+    from instagrapi import Client  # Pulls in pydantic; only paid for once an account is used.
+    cl = Client()
+    cl.login(account, ACCOUNTS[account])
+    path = session_file(account)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cl.dump_settings(path)
+    logging.info(f"Logged in to Instagram as {account} and saved the session to {path}.")
+    return cl
+
+def get_client(account):
+    """
+    The pooled client for `account`. A saved session is loaded from disk without any
+    network round trip; it is only replaced by a fresh login once a request fails with LoginRequired.
+    """
+    with _pool_lock:
+        if account not in _clients:
+            path = session_file(account)
+            if os.path.exists(path):
+                from instagrapi import Client
+                cl = Client()
+                cl.load_settings(path)
+                _clients[account] = cl
+            else:
+                _clients[account] = _login(account)
+        return _clients[account]
+
+def ready_accounts():
+    """Accounts whose client has been loaded, in configuration order."""
+    with _pool_lock:
+        return [account for account in ACCOUNTS if account in _clients]
+
+def relogin(account):
+    with _pool_lock:
+        _clients[account] = _login(account)
+        return _clients[account]
+
+def call(account, request):
+    """Runs request(client) for the account, logging in again and retrying once if the session has expired."""
+    from instagrapi.exceptions import LoginRequired
+    try:
+        return request(get_client(account))
+    except LoginRequired:
+        logging.warning(f"Session for {account} has expired; logging in again.")
+        return request(relogin(account))
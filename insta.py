@@ -4,11 +4,17 @@ import os
 import time
 import random
 import logging
-import csv
+import argparse
+import threading
+from pathlib import Path
+import state_db
+import manifest
+import ig_accounts
+import upload_schedule
+import storage
+import tracing
+import retry_policy
 from dotenv import load_dotenv
-from instagrapi import Client
-from instagrapi.exceptions import LoginRequired
-from slugify import slugify
 
 # --- Setup ---
 load_dotenv()
@@ -22,18 +28,8 @@ def log_console(msg, level='info'):
     print(msg)
     getattr(logging, level)(msg)
 
-IG_USERNAME = os.getenv("INSTAGRAM_USERNAME")
-IG_PASSWORD = os.getenv("INSTAGRAM_PASSWORD")
-SESSION_FILE = "ig_session.json"
-INPUT_VIDEO_DIR = os.getenv("OUTPUT_VIDEO_DIR", "ready_to_post")
-DOWNLOAD_LOG = "video_log.csv"
-UPLOAD_LOG = "upload_log.csv"
-MAX_UPLOADS_PER_RUN = 3
-
-# --- ADJUSTED TIMING (Average 3 mins, High Risk) ---
-MIN_DELAY_MINUTES = 10
-MAX_DELAY_MINUTES = 15
-# ----------------------------------------------------
+# Accounts, their sessions and the subreddit routing live in ig_accounts.py;
+# pacing between posts and before each hashtag comment lives in upload_schedule.py.
 
 # --- Game-Specific Content ---
 GAME_SPECIFIC_DATA = {
@@ -50,29 +46,54 @@ GAME_SPECIFIC_DATA = {
     'default': {'captions': ["Wait for it... 😂", "You can't make this up.", "This is reel-y good."], 'hashtags': ['reels', 'viral', 'explorepage', 'trending']}
 }
 
-cl = Client()
-
 def login_to_instagram():
-    if not all([IG_USERNAME, IG_PASSWORD]):
+    """
+    Checks every configured account and loads its pooled client. Saved sessions are reused
+    as they are; only accounts without one log in over the network.
+    """
+    if not ig_accounts.DEFAULT_ACCOUNT or not ig_accounts.ACCOUNTS[ig_accounts.DEFAULT_ACCOUNT]:
         log_console("❗ Missing INSTAGRAM_USERNAME or INSTAGRAM_PASSWORD in .env file.", 'error')
         exit(1)
-    if os.path.exists(SESSION_FILE):
+    for key in ig_accounts.ROUTES:
+        if key not in GAME_SPECIFIC_DATA:
+            log_console(f"⚠️ ACCOUNT_ROUTES key '{key}' is not a known subreddit in GAME_SPECIFIC_DATA.", 'warning')
+
+    ready = 0
+    for account, password in ig_accounts.ACCOUNTS.items():
+        if not password:
+            log_console(f"⚠️ No password set for account {account} (INSTAGRAM_PASSWORD_{ig_accounts.env_key(account)}); skipping it.", 'warning')
+            continue
         try:
-            cl.load_settings(SESSION_FILE)
-            cl.login(IG_USERNAME, IG_PASSWORD)
-            cl.get_timeline_feed()
-            log_console("✅ Logged in successfully using session file.")
-            return True
+            ig_accounts.get_client(account)
+            ready += 1
         except Exception as e:
-            log_console(f"Could not reuse session: {e}. Re-logging in.", 'warning')
-    try:
-        cl.login(IG_USERNAME, IG_PASSWORD)
-        cl.dump_settings(SESSION_FILE)
-        log_console("✅ Logged in successfully and created new session file.")
-        return True
-    except Exception as e:
-        log_console(f"❌ Failed to log in to Instagram: {e}", 'error')
+            log_console(f"❌ Failed to log in to Instagram as {account}: {e}", 'error')
+    if not ready:
         return False
+    log_console(f"✅ {ready} Instagram account(s) ready.")
+    return True
+
+# Routed accounts already warned about falling back, so each is reported once per process.
+_rerouted = set()
+
+def account_for(subreddit):
+    """
+    The account that posts clips from this subreddit. ACCOUNT_ROUTES is keyed like GAME_SPECIFIC_DATA,
+    so subreddits without their own entry follow the 'default' route, then INSTAGRAM_USERNAME.
+    A routed account that is not logged in (no password, or its login failed) never gets an upload
+    worker, so its clips go to INSTAGRAM_USERNAME instead; None if that one is not ready either.
+    """
+    key = subreddit.lower() if subreddit.lower() in GAME_SPECIFIC_DATA else 'default'
+    account = ig_accounts.ROUTES.get(key) or ig_accounts.ROUTES.get('default') or ig_accounts.DEFAULT_ACCOUNT
+    ready = ig_accounts.ready_accounts()
+    if account in ready:
+        return account
+    fallback = ig_accounts.DEFAULT_ACCOUNT if ig_accounts.DEFAULT_ACCOUNT in ready else None
+    if account not in _rerouted:
+        _rerouted.add(account)
+        target = f"posting as {fallback} instead" if fallback else "its clips will not be planned"
+        log_console(f"⚠️ Account {account} (routed from r/{subreddit}) is not logged in; {target}.", 'warning')
+    return fallback
 
 def generate_caption(title, subreddit):
     subreddit_key = subreddit.lower()
@@ -90,124 +111,242 @@ def generate_hashtags(subreddit):
     final_hashtags = set(game_data['hashtags'] + GAME_SPECIFIC_DATA['default']['hashtags'])
     return " ".join(f"#{tag}" for tag in final_hashtags)
 
-def get_uploaded_videos():
-    if not os.path.exists(UPLOAD_LOG): return set()
-    uploaded = set()
+def find_videos_to_upload():
+    """Returns the state rows of formatted videos that are still waiting to be posted."""
+    videos_to_upload = []
+    for item in state_db.items_in_state("formatted"):
+        if item["output_path"] and os.path.exists(item["output_path"]):
+            videos_to_upload.append(item)
+        else:
+            log_console(f"⚠️ Formatted file for post {item['post_id']} is missing: {item['output_path']}", "warning")
+    return videos_to_upload
+
+# Name of insta.py's read position in the ready-to-post manifest.
+MANIFEST_CONSUMER = "insta"
+
+def collect_new_outputs():
+    """
+    Returns (items, offset): the formatted items published to the manifest since the last
+    call's offset was committed with manifest.advance(). Without a cursor yet (first run after
+    upgrading) it falls back once to the full formatted backlog from the state store.
+    """
+    read = manifest.read_new(MANIFEST_CONSUMER)
+    if read is None:
+        offset = manifest.end_offset()  # Taken first, so nothing published meanwhile is skipped.
+        return find_videos_to_upload(), offset
+    entries, offset = read
+    items = []
+    for entry in entries:
+        item = state_db.get_item(entry["post_id"])
+        # Anything uploaded since, or deleted, is not ours to plan any more.
+        if item and item["state"] == "formatted" and os.path.exists(item["output_path"]):
+            items.append(item)
+    return items, offset
+
+def plan_new_outputs():
+    """Gives every newly published output a posting slot, then moves the manifest cursor past them."""
+    items, offset = collect_new_outputs()
+    items.sort(key=lambda item: item["rank_score"] or 0.0, reverse=True)
+    planned = schedule_uploads(items)
+    manifest.advance(MANIFEST_CONSUMER, offset)
+    return planned
+
+def upload_video(item, account=None):
+    """Uploads one state row as a reel. Returns the media pk, or None on failure."""
+    video_path, title, subreddit = item["output_path"], item["title"], item["subreddit"]
+    account = account or account_for(subreddit)
+    log_console(f"\n🚀 Preparing to upload: {title} (from r/{subreddit}) as {account}")
+    
+    # --- THIS IS THE CRITICAL CHANGE ---
+    # 1. Generate the caption; the hashtags go in the first comment, posted as a follow-up job
+    caption_text = generate_caption(title, subreddit)
+    
     try:
-        with open(UPLOAD_LOG, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            next(reader)
-            for row in reader:
-                if row: uploaded.add(row[1])
-    except StopIteration: pass
-    return uploaded
-
-def load_video_metadata():
-    if not os.path.exists(DOWNLOAD_LOG):
-        log_console(f"❌ Download log '{DOWNLOAD_LOG}' not found. Please run reddit.py first.", "error")
+        log_console(f"📤 Uploading '{video_path}' to Instagram as a Reel...")
+        
+        # 2. Upload the clip with only the caption and get the media object back.
+        # The cover made by enhance_cli.py saves instagrapi from decoding the video again to build one.
+        cover_path = item["cover_path"]
+        thumbnail = Path(cover_path) if cover_path and os.path.exists(cover_path) else None
+        with tracing.span("upload", item["post_id"], subreddit, account=account) as span:
+            span["bytes"] = os.path.getsize(video_path)
+            media = ig_accounts.call(account, lambda cl: cl.clip_upload(
+                path=video_path,
+                caption=caption_text,
+                thumbnail=thumbnail
+            ))
+        
+        # Record the upload right away to prevent re-uploading
+        state_db.mark_uploaded(item["post_id"], media.pk)
+        retry_policy.record_success(retry_policy.upstream_for_account(account))
+        
+        log_console(f"✅ Successfully uploaded! ✨")
+        return media.pk
+
+    except Exception as e:
+        log_console(f"❌ Upload failed for {video_path}: {e}", "error")
+        # Throttling and outages open the account's breaker, which holds back its other jobs too.
+        retry_policy.record_failure(retry_policy.upstream_for_account(account), e)
         return None
-    metadata = {}
+
+def post_hashtag_comment(item, account=None):
+    """Posts the hashtags as the first comment on an uploaded reel. Returns True on success."""
+    account = account or account_for(item["subreddit"])
+    hashtags_text = generate_hashtags(item["subreddit"])
     try:
-        with open(DOWNLOAD_LOG, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            if "Subreddit" not in header:
-                log_console(f"❌ Corrupted '{DOWNLOAD_LOG}'. Missing 'Subreddit' column. Delete it and run reddit.py again.", "error")
-                return None
-            idx_subreddit, idx_title = header.index("Subreddit"), header.index("Title")
-            for row in reader:
-                if len(row) > max(idx_subreddit, idx_title):
-                    title = row[idx_title]
-                    slug = slugify(title, max_length=100)
-                    metadata[slug] = {"title": title, "subreddit": row[idx_subreddit]}
-    except StopIteration:
-        log_console(f"'{DOWNLOAD_LOG}' is empty.", "warning")
-    return metadata
-
-def main():
-    if not login_to_instagram(): return
+        # Latency is measured from the upload, so it includes the planned pause and any retries.
+        latency = time.time() - item["uploaded_at"] if item["uploaded_at"] else None
+        with tracing.span("comment", item["post_id"], item["subreddit"], account=account, latency_seconds=latency) as span:
+            comment = ig_accounts.call(account, lambda cl: cl.media_comment(media_id=item["media_id"], text=hashtags_text))
+            span["status"] = "ok" if comment else "error"
+        if comment:
+            log_console(f"✍️ Successfully posted hashtags in the first comment.")
+            state_db.mark_commented(item["post_id"])
+            retry_policy.record_success(retry_policy.upstream_for_account(account))
+            return True
+        log_console(f"⚠️ Failed to post hashtags as a comment.", "warning")
+    except Exception as e:
+        log_console(f"⚠️ Failed to post hashtags as a comment on post {item['post_id']}: {e}", "warning")
+        retry_policy.record_failure(retry_policy.upstream_for_account(account), e)
+    return False
 
-    video_metadata = load_video_metadata()
-    if video_metadata is None: return
+# -------------------- Scheduled Uploads --------------------
+def schedule_uploads(items):
+    """Plans a posting slot for every item that has none yet. Returns how many were planned."""
+    planned = 0
+    for item in items:
+        account = account_for(item["subreddit"])
+        if not account:
+            continue  # Stays formatted but unplanned; the warning above names the account to fix.
+        due_at = upload_schedule.plan_upload(item["post_id"], account)
+        if due_at:
+            planned += 1
+            log_console(f"🗓️ Post {item['post_id']} planned for {account} at {time.strftime('%Y-%m-%d %H:%M', time.localtime(due_at))}.")
+    return planned
 
-    uploaded_paths = get_uploaded_videos()
-    videos_to_upload = []
+def run_job(job):
+    """Runs one due schedule entry. Returns True if a reel was uploaded."""
+    # Posting order follows the ranking, whatever order the clips were planned in.
+    job = upload_schedule.best_for_slot(job)
+    item = state_db.get_item(job["post_id"])
+    if item is None:
+        upload_schedule.retry_or_fail(job, "unknown post")
+        return False
 
-    for subdir, _, files in os.walk(INPUT_VIDEO_DIR):
-        for file in files:
-            if file.lower().endswith("_vertical.mp4"):
-                full_path = os.path.join(subdir, file)
-                if full_path not in uploaded_paths: videos_to_upload.append(full_path)
-    
-    if not videos_to_upload:
-        log_console("✅ No new videos to upload. All synced!")
-        return
-    
-    log_console(f"Found {len(videos_to_upload)} new videos to post. Will upload up to {MAX_UPLOADS_PER_RUN}.")
-    
-    uploads_this_run = 0
-    random.shuffle(videos_to_upload)
+    # While the account is throttled or Instagram is failing, its jobs wait without using up attempts.
+    upstream = retry_policy.upstream_for_account(job["account"])
+    paused = retry_policy.breaker_wait(upstream)
+    if paused:
+        upload_schedule.postpone(job, paused)
+        return False
 
-    for video_path in videos_to_upload:
-        if uploads_this_run >= MAX_UPLOADS_PER_RUN:
-            log_console(f"Reached upload limit for this run ({MAX_UPLOADS_PER_RUN}).")
-            break
+    if job["kind"] == upload_schedule.COMMENT:
+        if item["state"] == "commented" or post_hashtag_comment(item, job["account"]):
+            upload_schedule.complete(job)
+        elif upload_schedule.retry_or_fail(job, retry_policy.last_error(upstream) or "comment failed", retry_policy.breaker_wait(upstream)):
+            log_console(f"🔁 Will retry the comment for post {item['post_id']} later.", "warning")
+        return False
 
-        video_slug = os.path.basename(video_path).replace("_vertical.mp4", "")
-        video_info = video_metadata.get(video_slug)
-        
-        if not video_info:
-            log_console(f"⚠️ Could not find metadata for slug '{video_slug}'. Skipping.", "warning")
+    if item["state"] in ("uploaded", "commented"):
+        # Uploaded before a restart; only the follow-up may still be missing.
+        upload_schedule.complete(job)
+        if item["state"] == "uploaded":
+            upload_schedule.plan_comment(item["post_id"], job["account"])
+        return False
+    if not item["output_path"] or not os.path.exists(item["output_path"]):
+        upload_schedule.retry_or_fail(job, f"missing file {item['output_path']}")
+        return False
+
+    wait = upload_schedule.take_token(job["account"])
+    if wait:
+        upload_schedule.postpone(job, wait)
+        return False
+
+    if upload_video(item, job["account"]):
+        upload_schedule.complete(job)
+        upload_schedule.plan_comment(item["post_id"], job["account"])
+        return True
+    if upload_schedule.retry_or_fail(job, retry_policy.last_error(upstream) or "upload failed", retry_policy.breaker_wait(upstream)):
+        log_console(f"🔁 Will retry post {item['post_id']} later.", "warning")
+    return False
+
+# How long a draining run waits for follow-up comments; a comment waiting on a retry is left for the next run.
+COMMENT_WAIT_SECONDS = 60
+# How often the daemon looks for newly formatted clips.
+RESCAN_MINUTES = 5
+
+def run_schedule(account, stop_event=None, daemon=False, rescan=None):
+    """
+    Works through one account's upload schedule, sleeping until its next slot is due instead
+    of blocking on fixed delays. Without `daemon` (or once `stop_event` is set) it finishes
+    whatever is due now plus any pending comments, then returns; later slots stay in
+    the schedule for the next run. `rescan` is called between waits to plan new clips.
+    Returns the number of reels uploaded.
+    """
+    uploaded = 0
+    while True:
+        for job in upload_schedule.due_jobs(account):
+            if run_job(job):
+                uploaded += 1
+        if daemon and not (stop_event is not None and stop_event.is_set()):
+            upload_schedule.wait_for_next(account, max_seconds=RESCAN_MINUTES * 60 if rescan else None)
+            if rescan:
+                rescan()
             continue
+        # Comments follow their uploads within seconds, so they are worth waiting for.
+        wait = upload_schedule.seconds_until_next(upload_schedule.COMMENT, account)
+        if wait is not None and wait <= COMMENT_WAIT_SECONDS:
+            upload_schedule.wait_for_next(account, max_seconds=wait)
+            continue
+        if upload_schedule.seconds_until_next(upload_schedule.UPLOAD, account) != 0:
+            return uploaded
 
-        title, subreddit = video_info['title'], video_info['subreddit']
-        log_console(f"\n🚀 Preparing to upload: {title} (from r/{subreddit})")
-        
-        # --- THIS IS THE CRITICAL CHANGE ---
-        # 1. Generate caption and hashtags separately
-        caption_text = generate_caption(title, subreddit)
-        hashtags_text = generate_hashtags(subreddit)
-        
-        try:
-            log_console(f"📤 Uploading '{video_path}' to Instagram as a Reel...")
-            
-            # 2. Upload the clip with only the caption and get the media object back
-            media = cl.clip_upload(
-                path=video_path,
-                caption=caption_text
-            )
-            
-            # Log successful upload to prevent re-uploading
-            with open(UPLOAD_LOG, "a", encoding="utf-8", newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), video_path])
-            
-            log_console(f"✅ Successfully uploaded! ✨")
-            
-            # 3. Add a short, human-like pause before commenting
-            comment_delay = random.randint(5, 15)
-            log_console(f"🕒 Pausing for {comment_delay} seconds before commenting...")
-            time.sleep(comment_delay)
-
-            # 4. Post the hashtags as the first comment
-            comment = cl.media_comment(media_id=media.pk, text=hashtags_text)
-            if comment:
-                log_console(f"✍️ Successfully posted hashtags in the first comment.")
-            else:
-                log_console(f"⚠️ Failed to post hashtags as a comment.", "warning")
-
-            uploads_this_run += 1
-
-            # Wait before the next UPLOAD
-            if uploads_this_run < MAX_UPLOADS_PER_RUN and len(videos_to_upload) > uploads_this_run:
-                delay = random.randint(MIN_DELAY_MINUTES * 60, MAX_DELAY_MINUTES * 60)
-                log_console(f"🕒 Waiting for {delay // 60} minutes and {delay % 60} seconds before next upload...")
-                time.sleep(delay)
+def run_all_accounts(stop_event=None, daemon=False, rescan=None):
+    """Runs every logged-in account's schedule on its own thread, so accounts post concurrently. Returns total uploads."""
+    accounts = ig_accounts.ready_accounts()
+    totals = {}
 
-        except Exception as e:
-            log_console(f"❌ Upload or comment failed for {video_path}: {e}", "error")
+    def worker(account, account_rescan):
+        totals[account] = run_schedule(account, stop_event, daemon, account_rescan)
+
+    # One account is enough to look for new clips; planning wakes the others.
+    threads = [
+        threading.Thread(target=worker, args=(account, rescan if i == 0 else None), name=f"Upload-{account}")
+        for i, account in enumerate(accounts)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(totals.values())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Uploads formatted clips to Instagram on a persistent schedule.")
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Keep running and post each clip when its slot comes up, instead of posting only what is due now."
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not login_to_instagram(): return
+    storage.enforce_budgets("upload")
+
+    planned = plan_new_outputs()
+    if planned:
+        log_console(f"Planned {planned} new videos for posting.")
+
+    next_slot = upload_schedule.seconds_until_next()
+    if next_slot is None and not args.daemon:
+        log_console("✅ No new videos to upload. All synced!")
+        return
 
-    log_console("\n🏁 Instagram upload run finished.")
+    uploaded = run_all_accounts(daemon=args.daemon, rescan=plan_new_outputs)
+    next_slot = upload_schedule.seconds_until_next(upload_schedule.UPLOAD)
+    if next_slot is not None:
+        log_console(f"🗓️ Next post is due in {int(next_slot // 60)} minutes; it stays scheduled for the next run.")
+    log_console(f"\n🏁 Instagram upload run finished. {uploaded} reels posted.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -4,22 +4,37 @@ import subprocess
 import sys
 import time
 import os
+import signal
+import socket
+import argparse
+import threading
+import socketserver
 import importlib.util
 
 # --- Dependency Check ---
-def check_dependencies():
-    """Checks if essential libraries are installed."""
+# What each one-shot --stage run needs, so it only checks its own libraries.
+STAGE_PACKAGES = {
+    "download": ("praw", "yt_dlp", "slugify"),
+    "format": ("psutil", "tqdm", "numpy"),
+    "upload": ("instagrapi",),
+}
+
+def check_dependencies(packages=None):
+    """Checks if essential libraries are installed (only `packages`, if given)."""
     print("Checking for required libraries...")
     required_packages = {
         "praw": "for reddit.py",
-        "yt_dlp": "for reddit.py",
+        "yt_dlp": "for downloader.py",
         "slugify": "for reddit.py",
-        "psutil": "for enhance_cli.py",
+        "psutil": "for scheduler.py",
         "tqdm": "for enhance_cli.py",
+        "numpy": "for dedup.py and ranking.py",
         "instagrapi": "for insta.py"
     }
     missing = []
     for package, reason in required_packages.items():
+        if packages is not None and package not in packages:
+            continue
         spec = importlib.util.find_spec(package)
         if spec is None:
             missing.append((package, reason))
@@ -78,17 +93,409 @@ def run_script_live(script_name):
         print(f"\n❌ An unexpected error occurred while trying to run '{script_name}': {e}")
         return False
 
+# -------------------- Streaming Pipeline --------------------
+# Each stage has its own concurrency limit and hands work to the next one through the
+# shared work queue. Downloads pause while this many clips wait for formatting, so a slow
+# stage applies backpressure instead of piling up work.
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "10"))
+
+def warm_up():
+    """
+    Logs in to Instagram and Reddit and starts the encode process pool: everything a pipeline
+    run can reuse. Returns {'reddit', 'executor'}, or None if no Instagram account is ready.
+    """
+    import reddit
+    import insta
+    import enhance_cli
+
+    if not insta.login_to_instagram():
+        return None
+    return {"reddit": reddit.get_reddit_client(), "executor": enhance_cli.make_pool()}
+
+def run_pipeline(warm=None):
+    """
+    Runs download, format and upload in-process with overlapping stages.
+    Every finished download goes straight to the formatting pool and every
+    formatted file goes straight to the uploader. `warm` (from warm_up()) is
+    reused as it is; without it the run logs in and starts its own pool.
+    Returns True on success, False on failure.
+    """
+    # Imported here so the classic step-by-step mode never pays for them.
+    import reddit
+    import enhance_cli
+    import insta
+    import dedup
+    import probe
+    import scheduler
+    import segments
+    import state_db
+    import profiles
+    import upload_schedule
+    import ig_accounts
+    import storage
+    import tracing
+    import work_queue
+    import ranking
+
+    own_warm = warm is None
+    warm = warm or warm_up()
+    if not warm:
+        return False
+    reddit_client, executor = warm["reddit"], warm["executor"]
+    tracing.start_run()
+    subreddits = reddit.load_subreddits()
+    reclaimed_before = storage.reclaimed_total()
+    storage.enforce_budgets("pipeline")
+    enhance_cli.clean_interrupted()
+
+    download_workers = reddit.MAX_THREADS
+    format_workers = scheduler.MAX_PARALLEL_JOBS
+    # One upload worker per account, each sleeping until its next scheduled slot, so pacing never blocks the other stages.
+    upload_workers = len(ig_accounts.ready_accounts())
+    print(f"🧵 Stage limits: {download_workers} download / {format_workers} format / {upload_workers} upload workers, queue size {PIPELINE_QUEUE_SIZE}.")
+
+    listing_done = threading.Event()
+    downloads_done = threading.Event()
+    stop_uploads = threading.Event()
+    counter_lock = threading.Lock()
+    counters = {"downloaded": 0, "formatted": 0, "uploaded": 0}
+
+    def on_downloaded(subreddit_name, post_id, path):
+        with counter_lock:
+            counters["downloaded"] += 1
+        item = state_db.get_item(post_id)
+        if item["state"] == "formatted":
+            # Streamed straight into the encoder (STREAM_MODE), so it skips the format stage.
+            with counter_lock:
+                counters["formatted"] += 1
+            insta.schedule_uploads([item])
+        # Raw downloads were queued for formatting by reddit.py itself.
+
+    def gate_worker():
+        # New downloads wait as 'deferred' until the ranking gate lets the best per subreddit in;
+        # one thread runs it on a timer, so format workers only lease.
+        while not downloads_done.wait(ranking.RANK_GATE_SECONDS):
+            ranking.rank_and_gate(force=True)
+
+    def format_worker(executor):
+        while True:
+            tasks = work_queue.lease(work_queue.FORMAT)
+            if not tasks:
+                if downloads_done.is_set():
+                    break
+                downloads_done.wait(1)
+                continue
+            task = tasks[0]
+            post_id, input_path = task["post_id"], task["payload"]["raw_path"]
+            preset = enhance_cli.preset_for(os.path.basename(os.path.dirname(input_path)))
+            try:
+                item = state_db.get_item(post_id)
+                if item["state"] != "downloaded":
+                    enhance_cli.republish_formatted(item)
+                    work_queue.complete(task)
+                    continue
+                duplicate_of = dedup.register(post_id, input_path)
+                if duplicate_of:
+                    print(f"♻️ Skipping {os.path.basename(input_path)}: duplicate of post {duplicate_of}.")
+                    work_queue.complete(task)
+                    continue
+                storage.maybe_enforce("format")
+                output_path = enhance_cli.output_path_for(input_path)
+                if enhance_cli.adopt_finished_output(post_id, input_path, output_path, preset):
+                    work_queue.complete(task)
+                    with counter_lock:
+                        counters["formatted"] += 1
+                    insta.schedule_uploads([state_db.get_item(post_id)])
+                    continue
+                with tracing.span("probe", post_id):
+                    info = probe.probe(input_path)
+                job = scheduler.make_job(post_id, input_path, output_path, preset, info, profiles.resolve())
+                pieces = segments.expand([job])
+                if len(pieces) > 1:
+                    # Long clip: its segments spread over the whole pool.
+                    result = segments.encode_segments(executor, pieces, enhance_cli.submit_job)
+                else:
+                    # Blocks until the machine has CPU and memory to spare for this clip.
+                    scheduler.acquire(job)
+                    result = None
+                    try:
+                        result = enhance_cli.submit_job(executor, job).result()
+                    finally:
+                        scheduler.release(job, result[2] if result else None)
+                if result:
+                    enhance_cli.record_formatted(post_id, output_path, preset, job["profile"], job["info"])
+                    work_queue.complete(task)
+                    with counter_lock:
+                        counters["formatted"] += 1
+                    insta.schedule_uploads([state_db.get_item(post_id)])
+                else:
+                    work_queue.fail(task, "encode failed")
+            except Exception as e:
+                print(f"❌ Formatting failed for {os.path.basename(input_path)}: {e}")
+                work_queue.fail(task, e)
+
+    def upload_worker():
+        counters["uploaded"] = insta.run_all_accounts(stop_uploads, daemon=True)
+
+    try:
+        upload_threads = [threading.Thread(target=upload_worker, name="Uploads")]
+        gate_thread = threading.Thread(target=gate_worker, name="RankGate")
+        format_threads = [threading.Thread(target=format_worker, args=(executor,), name=f"Format-{i+1}") for i in range(format_workers)]
+        download_threads = [
+            threading.Thread(
+                target=reddit.worker, args=(listing_done, on_downloaded, None, PIPELINE_QUEUE_SIZE), name=f"Worker-{i+1}"
+            )
+            for i in range(download_workers)
+        ]
+        for t in upload_threads + format_threads + download_threads + [gate_thread]:
+            t.start()
+
+        # Leftovers from earlier runs go through the same stages as fresh downloads.
+        # Downloads recorded before the work queue existed get their format task here;
+        # queued tasks of crashed runs or nodes come back by themselves once their lease expires.
+        enhance_cli.enqueue_downloaded()
+        insta.plan_new_outputs()
+        reddit.queue_subreddit_posts(reddit_client, subreddits)
+
+        # Shut the stages down in order so every item flows all the way through.
+        listing_done.set()
+        for t in download_threads:
+            t.join()
+        # A last pass lets in the final downloads before the format workers may leave.
+        ranking.rank_and_gate(force=True)
+        downloads_done.set()
+        gate_thread.join()
+        for t in format_threads:
+            t.join()
+        # Posts whose slot is still ahead stay in the schedule for the next run.
+        stop_uploads.set()
+        upload_schedule.wake()
+        for t in upload_threads:
+            t.join()
+    finally:
+        if own_warm:
+            executor.shutdown()
+
+    print(f"\n📊 Pipeline totals: {counters['downloaded']} downloaded, {counters['formatted']} formatted, {counters['uploaded']} uploaded.")
+    storage.enforce_budgets("pipeline")
+    print(f"🧹 Reclaimed {(storage.reclaimed_total() - reclaimed_before) / 1e6:.1f} MB of disk this run.")
+    return True
+
+# -------------------- One-Shot Stages --------------------
+STAGE_MODULES = {"download": "reddit", "format": "enhance_cli", "upload": "insta"}
+
+def run_stage(stage, argv):
+    """
+    Runs one step in this interpreter instead of a fresh one, importing only that step's
+    modules. `argv` goes to the step's own options (e.g. --preset fast). Returns True on success.
+    """
+    module = importlib.import_module(STAGE_MODULES[stage])
+    try:
+        module.main(argv)
+    except SystemExit as e:
+        # The steps exit(1) on missing credentials, and argparse exits on bad options.
+        return not e.code
+    return True
+
+# -------------------- Daemon --------------------
+# The daemon starts once and runs the streaming pipeline every DAEMON_INTERVAL_SECONDS
+# (0: only when asked), keeping its Reddit client, Instagram sessions and encode pool warm.
+DAEMON_INTERVAL_SECONDS = float(os.getenv("DAEMON_INTERVAL_SECONDS", "900"))
+# Local control socket for `python main.py --send run|status|stop`. Bound to localhost only.
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", "8765"))
+CONTROL_COMMANDS = ("run", "status", "stop")
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    # A restarted daemon must not trip over old connections in TIME_WAIT; on Windows
+    # the same flag would let a second daemon share the port, so it stays off there.
+    allow_reuse_address = os.name != "nt"
+    daemon_threads = True
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """One command per connection, answered with one line of text."""
+    def handle(self):
+        daemon = self.server.daemon_state
+        command = self.rfile.readline().decode("utf-8", "replace").strip().lower()
+        if command == "run":
+            daemon["wake"].set()
+            reply = "queued: a run starts after the current one" if daemon["status"] == "running" else "ok: starting a run"
+        elif command == "status":
+            reply = describe_daemon(daemon)
+        elif command == "stop":
+            daemon["stop"].set()
+            daemon["wake"].set()
+            reply = "ok: stopping after the current run" if daemon["status"] == "running" else "ok: stopping"
+        else:
+            reply = f"error: unknown command '{command}' (expected one of {', '.join(CONTROL_COMMANDS)})"
+        self.wfile.write((reply + "\n").encode("utf-8"))
+
+def describe_daemon(daemon):
+    parts = [f"{daemon['status']}, {daemon['runs']} runs"]
+    if daemon["last_finished_at"]:
+        finished = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(daemon["last_finished_at"]))
+        parts.append(f"last run {'ok' if daemon['last_ok'] else 'failed'} in {daemon['last_seconds']:.0f}s at {finished}")
+    if daemon["next_at"] and daemon["status"] != "running":
+        parts.append(f"next run in {max(0, daemon['next_at'] - time.time()):.0f}s")
+    return "; ".join(parts)
+
+def start_control_server(daemon):
+    """Serves the control socket from a background thread. Returns None if the port is taken (e.g. by another daemon)."""
+    try:
+        server = ControlServer((CONTROL_HOST, CONTROL_PORT), ControlHandler)
+    except OSError as e:
+        print(f"❌ Could not open the control socket on {CONTROL_HOST}:{CONTROL_PORT} ({e}). Is another daemon running?")
+        return None
+    server.daemon_state = daemon
+    threading.Thread(target=server.serve_forever, name="Control", daemon=True).start()
+    return server
+
+def ensure_pool(warm):
+    """An encoder process that died (e.g. to the OOM killer) breaks the whole pool; it is replaced before the next run."""
+    from concurrent.futures.process import BrokenProcessPool
+    import enhance_cli
+    try:
+        warm["executor"].submit(int).result()
+    except BrokenProcessPool:
+        print("♻️ The encode pool broke during the last run; starting a new one.")
+        warm["executor"].shutdown(wait=False)
+        warm["executor"] = enhance_cli.make_pool()
+
+def run_daemon(interval):
+    """
+    Warms up once, then runs the pipeline every `interval` seconds and whenever a 'run'
+    command arrives. 'stop', SIGINT or SIGTERM end it after the current run.
+    Returns True on a clean stop, False if it could not start.
+    """
+    daemon = {
+        "status": "starting", "runs": 0, "last_ok": None, "last_seconds": 0.0,
+        "last_finished_at": None, "next_at": time.time(),
+        "wake": threading.Event(), "stop": threading.Event(),
+    }
+    server = start_control_server(daemon)
+    if not server:
+        return False
+    warm = warm_up()
+    if not warm:
+        server.shutdown()
+        return False
+
+    def request_stop(*_):
+        daemon["stop"].set()
+        daemon["wake"].set()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, request_stop)
+
+    every = f"every {interval:g}s" if interval > 0 else "on demand"
+    print(f"🛰️ Daemon ready: running the pipeline {every}. Control it with `python main.py --send run|status|stop` ({CONTROL_HOST}:{CONTROL_PORT}).")
+    try:
+        while not daemon["stop"].is_set():
+            daemon["status"] = "idle"
+            wait = daemon["next_at"] - time.time() if daemon["next_at"] else None
+            if wait is None or wait > 0:
+                daemon["wake"].wait(wait)
+            # A 'run' that arrives during the run below wakes the next wait straight away.
+            daemon["wake"].clear()
+            if daemon["stop"].is_set():
+                break
+
+            daemon["status"] = "running"
+            print_header(f"Daemon Run {daemon['runs'] + 1}")
+            started = time.monotonic()
+            try:
+                ok = run_pipeline(warm)
+            except Exception as e:
+                print(f"❌ Pipeline run failed: {e}")
+                ok = False
+            daemon.update(
+                runs=daemon["runs"] + 1, last_ok=ok, last_seconds=time.monotonic() - started,
+                last_finished_at=time.time(), next_at=time.time() + interval if interval > 0 else None,
+            )
+            daemon["status"] = "idle"
+            print(f"{'🎉' if ok else '❌'} Daemon run {daemon['runs']} finished: {describe_daemon(daemon)}.")
+            ensure_pool(warm)
+    finally:
+        daemon["status"] = "stopping"
+        server.shutdown()
+        warm["executor"].shutdown()
+    print("👋 Daemon stopped.")
+    return True
+
+def send_command(command):
+    """Sends one command to a running daemon and prints its answer. Returns True if it accepted it."""
+    try:
+        with socket.create_connection((CONTROL_HOST, CONTROL_PORT), timeout=10) as conn:
+            conn.sendall((command + "\n").encode("utf-8"))
+            reply = conn.makefile("r", encoding="utf-8").readline().strip()
+    except OSError as e:
+        print(f"❌ No daemon answered on {CONTROL_HOST}:{CONTROL_PORT} ({e}).")
+        return False
+    print(f"🛰️ {reply}")
+    return bool(reply) and not reply.startswith("error")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reddit-to-Reels pipeline runner.")
+    parser.add_argument(
+        "--pipeline", action="store_true",
+        help="Run download, format and upload in-process as overlapping stages instead of one script after another."
+    )
+    parser.add_argument(
+        "--stage", choices=sorted(STAGE_MODULES),
+        help="Run only this step, in this process. Options after it go to the step's script, e.g. --stage format --preset fast."
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Stay running with warm Reddit/Instagram sessions and encode pool, and run the pipeline on an interval."
+    )
+    parser.add_argument(
+        "--interval", type=float, default=DAEMON_INTERVAL_SECONDS,
+        help=f"Seconds between daemon runs; 0 runs only on `--send run` (default: DAEMON_INTERVAL_SECONDS or {DAEMON_INTERVAL_SECONDS:g})."
+    )
+    parser.add_argument("--send", choices=CONTROL_COMMANDS, help="Send a command to a running daemon and exit.")
+    args, rest = parser.parse_known_args()
+    if rest and not args.stage:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    args.stage_args = rest
+    return args
+
 def main():
     """
     Main function to run the entire Reddit-to-Reels pipeline.
     """
+    args = parse_args()
     start_time = time.time()
-    
+
+    if args.send:
+        sys.exit(0 if send_command(args.send) else 1)
+
+    if args.stage:
+        # One step only: no banner, no check of the other steps' libraries, no extra interpreter.
+        if not check_dependencies(STAGE_PACKAGES[args.stage]):
+            sys.exit(1)
+        ok = run_stage(args.stage, args.stage_args)
+        print(f"\n{'✅' if ok else '❌'} Stage '{args.stage}' finished in {time.time() - start_time:.2f} seconds.")
+        sys.exit(0 if ok else 1)
+
     print_header("Initializing Pipeline")
 
     if not check_dependencies():
         return
 
+    if args.daemon:
+        print_header("Pipeline Daemon")
+        if not run_daemon(args.interval):
+            print("\nDaemon could not start.")
+        return
+
+    if args.pipeline:
+        print_header("Streaming Pipeline")
+        if not run_pipeline():
+            print("\nPipeline stopped due to an error.")
+            return
+        print_header("Pipeline Finished")
+        print(f"🎉 Streaming pipeline completed in {time.time() - start_time:.2f} seconds.")
+        return
+
     # --- Step 1: Download videos from Reddit ---
     print_header("Step 1: Downloading Videos from Reddit")
     if not run_script_live("reddit.py"):
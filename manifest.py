@@ -0,0 +1,60 @@
+# --- START OF FILE manifest.py (Ready-to-Post Manifest) ---
+
+import os
+import json
+import time
+import threading
+import state_db
+
+# -------------------- Settings --------------------
+# One JSON line per finished output, only ever appended to, next to the outputs themselves.
+MANIFEST_PATH = os.getenv(
+    "READY_MANIFEST", os.path.join(os.getenv("OUTPUT_VIDEO_DIR", "ready_to_post"), "manifest.jsonl")
+)
+
+_lock = threading.Lock()
+
+# -------------------- Publishing --------------------
+def publish(post_id, subreddit, title, output_path, duration=None, size=None, cover_path=None):
+    """Appends one finished output. Each entry is a single write of a whole line."""
+    line = json.dumps({
+        "post_id": post_id,
+        "subreddit": subreddit,
+        "title": title,
+        "output_path": output_path,
+        "cover_path": cover_path,
+        "duration": duration,
+        "size": size,
+        "published_at": time.time(),
+    }, ensure_ascii=False) + "\n"
+    with _lock:
+        os.makedirs(os.path.dirname(MANIFEST_PATH) or ".", exist_ok=True)
+        with open(MANIFEST_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+
+# -------------------- Consuming --------------------
+def end_offset():
+    return os.path.getsize(MANIFEST_PATH) if os.path.exists(MANIFEST_PATH) else 0
+
+def read_new(consumer):
+    """
+    Returns (entries, offset) for the lines appended since `consumer` last called advance(),
+    or None if the consumer has no cursor yet. Only complete lines are returned, so a line
+    still being written is picked up next time.
+    """
+    cursor = state_db.get_manifest_cursor(consumer)
+    if cursor is None:
+        return None
+    if not os.path.exists(MANIFEST_PATH):
+        return [], 0
+    if os.path.getsize(MANIFEST_PATH) < cursor:
+        cursor = 0  # The manifest was replaced; start over, planning is idempotent anyway.
+    with open(MANIFEST_PATH, "rb") as f:
+        f.seek(cursor)
+        data = f.read()
+    complete = data[:data.rfind(b"\n") + 1]
+    entries = [json.loads(line) for line in complete.decode("utf-8").splitlines() if line.strip()]
+    return entries, cursor + len(complete)
+
+def advance(consumer, offset):
+    state_db.set_manifest_cursor(consumer, offset)
@@ -0,0 +1,133 @@
+# --- START OF FILE outputs.py (Atomic Output Files) ---
+
+import os
+import time
+import shutil
+import logging
+import subprocess
+import probe
+import profiles
+
+# -------------------- Settings --------------------
+OUTPUT_DIR = os.getenv("OUTPUT_VIDEO_DIR", "ready_to_post")
+# Encodes write to `<name>.tmp.mp4` (cover: `<name>.tmp.jpg`) and are renamed to the real
+# name only once they check out, so a file under the real name is always a finished one.
+TEMP_MARK = ".tmp"
+# A finished video may be this far off its source's duration: whichever is larger.
+DURATION_TOLERANCE_SECONDS = 0.5
+DURATION_TOLERANCE_RATIO = 0.02
+# Temp files and segment folders untouched for this long belong to a run that died. A live
+# encode writes continuously, and a crashed node's task comes back to the queue after the same time.
+ORPHAN_AGE_SECONDS = float(os.getenv("ORPHAN_AGE_SECONDS", os.getenv("WORK_LEASE_SECONDS", "300")))
+
+# -------------------- Temp Paths --------------------
+def temp_path(path):
+    """foo_vertical.mp4 -> foo_vertical.tmp.mp4; the extension stays last so ffmpeg still picks the muxer."""
+    root, ext = os.path.splitext(path)
+    return root + TEMP_MARK + ext
+
+def is_temp(path):
+    return os.path.splitext(path)[0].endswith(TEMP_MARK)
+
+def discard(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+# -------------------- Validation --------------------
+def check(path, info, check_duration=True):
+    """
+    Returns why the video at `path` is not a usable encode of a source described by `info`
+    (probe.probe() format), or None if it is: it must have a video stream, keep the source's
+    audio, and (unless check_duration is False, e.g. for one segment) last as long as the source.
+    """
+    try:
+        # Not probe.probe(): temp files would only fill its cache with paths that are gone a moment later.
+        out = probe.run_ffprobe(path)
+    except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+        return f"unreadable ({e})"
+    if info.get("acodec") and not out["acodec"]:
+        return "audio stream missing"
+    expected = profiles.clip_duration(info) if info.get("duration") else None
+    if check_duration and expected:
+        tolerance = max(DURATION_TOLERANCE_SECONDS, expected * DURATION_TOLERANCE_RATIO)
+        if abs(out["duration"] - expected) > tolerance:
+            return f"lasts {out['duration']:.2f}s instead of {expected:.2f}s"
+    return None
+
+def commit(output_path, info, cover_path=None, check_duration=True):
+    """
+    Checks the temp video written for `output_path` and renames it (cover first) into place.
+    Returns True, or False after removing the temp files of a bad encode.
+    """
+    temp_video = temp_path(output_path)
+    temp_cover = temp_path(cover_path) if cover_path else None
+    problem = check(temp_video, info, check_duration) if os.path.exists(temp_video) else "not written"
+    if problem:
+        logging.error(f"❌ Output for {os.path.basename(output_path)} failed validation: {problem}.")
+        discard(temp_video, temp_cover)
+        return False
+    if temp_cover and os.path.exists(temp_cover):
+        os.replace(temp_cover, cover_path)
+    os.replace(temp_video, output_path)
+    return True
+
+# -------------------- Crash Recovery --------------------
+def _last_touched(path):
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    times = [os.path.getmtime(path)]
+    for dirpath, _, filenames in os.walk(path):
+        times += [os.path.getmtime(os.path.join(dirpath, name)) for name in filenames]
+    return max(times)
+
+def _leftovers(dirpath, dirnames, filenames):
+    """
+    [(age_path, paths)] under one folder: each temp video with its temp cover, judged by the
+    video, which a live encode keeps writing while the cover is written once near the start.
+    Covers without a video and segment folders are judged on their own.
+    """
+    groups = {}
+    for name in filenames:
+        if is_temp(name):
+            root, ext = os.path.splitext(name)
+            groups.setdefault(root, []).append(name)
+    leftovers = []
+    for names in groups.values():
+        videos = [name for name in names if name.endswith(".mp4")]
+        age_name = videos[0] if videos else names[0]
+        leftovers.append((os.path.join(dirpath, age_name), [os.path.join(dirpath, name) for name in names]))
+    for name in dirnames:
+        if name.endswith(".segments"):
+            path = os.path.join(dirpath, name)
+            leftovers.append((path, [path]))
+    return leftovers
+
+def clean_orphans(root=OUTPUT_DIR, max_age=None):
+    """
+    Removes temp outputs and segment folders left by runs that were killed mid-encode; the clips
+    themselves are still queued and get encoded again. Returns how many were removed.
+    """
+    max_age = ORPHAN_AGE_SECONDS if max_age is None else max_age
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        leftovers = _leftovers(dirpath, dirnames, filenames)
+        # Segment folders are handled as a whole, never walked into.
+        dirnames[:] = [name for name in dirnames if not name.endswith(".segments")]
+        for age_path, paths in leftovers:
+            try:
+                if _last_touched(age_path) > cutoff:
+                    continue  # Probably another node's encode in progress.
+                for path in paths:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+            except OSError:
+                continue
+            removed += len(paths)
+            logging.info(f"Removed {', '.join(paths)}, left over from an interrupted encode.")
+    return removed
@@ -0,0 +1,85 @@
+# --- START OF FILE probe.py (ffprobe Input Classification) ---
+
+import os
+import json
+import subprocess
+import state_db
+
+# -------------------- Settings --------------------
+TARGET_WIDTH = 1080
+TARGET_HEIGHT = 1920
+# How far (relative) a source may be from exactly 9:16 and still count as vertical.
+ASPECT_TOLERANCE = 0.01
+COPYABLE_VIDEO_CODECS = ("h264",)
+COPYABLE_PIX_FMTS = ("yuv420p", "yuvj420p")
+# Sources above this overall bitrate are re-encoded even when compliant, to keep upload sizes predictable.
+COPY_MAX_KBPS = int(os.getenv("COPY_MAX_KBPS", "6500"))
+
+# Input classes, cheapest first.
+COMPLIANT = "compliant"  # Already 9:16 H.264 at or below 1080x1920: remux only.
+SCALE = "scale"          # 9:16 but too big or the wrong codec: a plain scale + encode.
+REFORMAT = "reformat"    # Landscape, square or any other shape: the full blurred-background graph.
+
+# -------------------- Probing --------------------
+def _rotation(stream):
+    rotate = (stream.get("tags") or {}).get("rotate")
+    if rotate is None:
+        for side_data in stream.get("side_data_list") or []:
+            if "rotation" in side_data:
+                rotate = side_data["rotation"]
+                break
+    return abs(int(float(rotate or 0))) % 360
+
+def run_ffprobe(path):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        capture_output=True, text=True, check=True
+    )
+    data = json.loads(result.stdout)
+    streams = data.get("streams") or []
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    if video is None:
+        raise ValueError(f"No video stream in {os.path.basename(path)}")
+
+    width, height = int(video["width"]), int(video["height"])
+    rotation = _rotation(video)
+    if rotation in (90, 270):
+        # Phones store portrait clips as rotated landscape frames.
+        width, height = height, width
+
+    return {
+        "width": width,
+        "height": height,
+        "rotation": rotation,
+        "duration": float((data.get("format") or {}).get("duration") or video.get("duration") or 0),
+        "vcodec": video.get("codec_name"),
+        "pix_fmt": video.get("pix_fmt"),
+        "acodec": audio.get("codec_name") if audio else None,
+        "bit_rate": int((data.get("format") or {}).get("bit_rate") or 0),
+    }
+
+def probe(path):
+    """ffprobe summary of `path`, cached by (path, size, mtime) in the state store."""
+    stat = os.stat(path)
+    cached = state_db.get_probe(path, stat.st_size, stat.st_mtime)
+    if cached:
+        return json.loads(cached)
+    info = run_ffprobe(path)
+    state_db.put_probe(path, stat.st_size, stat.st_mtime, json.dumps(info))
+    return info
+
+# -------------------- Classification --------------------
+def is_vertical_9_16(info):
+    return abs(info["width"] * 16 - info["height"] * 9) <= ASPECT_TOLERANCE * info["height"] * 9
+
+def classify(info):
+    if not is_vertical_9_16(info):
+        return REFORMAT
+    if (info["width"] <= TARGET_WIDTH and info["height"] <= TARGET_HEIGHT
+            and info["vcodec"] in COPYABLE_VIDEO_CODECS
+            and info["pix_fmt"] in COPYABLE_PIX_FMTS
+            and info["rotation"] == 0
+            and info.get("bit_rate", 0) <= COPY_MAX_KBPS * 1000):
+        return COMPLIANT
+    return SCALE
@@ -0,0 +1,85 @@
+# --- START OF FILE profiles.py (Upload-Size-Targeted Encoding Profiles) ---
+
+import os
+
+# -------------------- Profiles --------------------
+# Each profile caps the video bitrate so a clip lands near `target_mb` whatever its length,
+# while `crf` still keeps easy footage smaller than the cap.
+ENCODE_PROFILES = {
+    "small":    {"target_mb": 20, "min_kbps": 1200, "max_kbps": 3500,  "crf": 25},
+    "balanced": {"target_mb": 40, "min_kbps": 2000, "max_kbps": 6000,  "crf": 23},
+    "quality":  {"target_mb": 80, "min_kbps": 3000, "max_kbps": 10000, "crf": 21},
+}
+DEFAULT_PROFILE = os.getenv("ENCODE_PROFILE", "balanced")
+# Every output gets the same audio, whatever the source had.
+AUDIO_BITRATE_KBPS = int(os.getenv("AUDIO_BITRATE_KBPS", "128"))
+AUDIO_SAMPLE_RATE = 44100
+
+def resolve(profile=None):
+    profile = profile or DEFAULT_PROFILE
+    return profile if profile in ENCODE_PROFILES else "balanced"
+
+def clip_duration(info):
+    # Segments carry the whole clip's length so their bitrate budget matches the full video.
+    return info.get("clip_duration") or info["duration"] or 1.0
+
+def video_kbps(info, profile=None):
+    """Video bitrate cap that makes the whole clip (audio included) fit the profile's size target."""
+    settings = ENCODE_PROFILES[resolve(profile)]
+    total_kbps = settings["target_mb"] * 8 * 1024 / clip_duration(info)
+    audio_kbps = AUDIO_BITRATE_KBPS if info.get("acodec") else 0
+    return int(min(settings["max_kbps"], max(settings["min_kbps"], total_kbps - audio_kbps)))
+
+# -------------------- ffmpeg Arguments --------------------
+def video_args(info, profile=None):
+    settings = ENCODE_PROFILES[resolve(profile)]
+    kbps = video_kbps(info, profile)
+    return [
+        "-c:v", "libx264", "-preset", "faster", "-crf", str(settings["crf"]),
+        "-maxrate", f"{kbps}k", "-bufsize", f"{kbps * 2}k", "-pix_fmt", "yuv420p",
+    ]
+
+def audio_args(info):
+    """Normalizes any audio to AAC at a fixed bitrate, and drops the track cleanly when there is none."""
+    if not info.get("acodec"):
+        return ["-an"]
+    return ["-c:a", "aac", "-b:a", f"{AUDIO_BITRATE_KBPS}k", "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "2"]
+
+def container_args():
+    # Moves the moov atom to the front so uploads and players can start without reading the whole file.
+    return ["-movflags", "+faststart"]
+
+def output_stats(output_path, info):
+    """Size and average bitrate of a finished output, as stored with the item."""
+    size = os.path.getsize(output_path)
+    return {"output_bytes": size, "output_kbps": size * 8 / 1024 / clip_duration(info)}
+
+# -------------------- Cover Thumbnails --------------------
+# Where the cover is looked for, as a fraction of the clip; early enough to skip intros, late enough to be in the action.
+COVER_AT_FRACTION = float(os.getenv("COVER_AT_FRACTION", "0.3"))
+# The most representative of this many frames from that point becomes the cover (ffmpeg's `thumbnail` filter).
+# Kept small because every frame in the window is buffered at full output resolution.
+COVER_WINDOW_FRAMES = int(os.getenv("COVER_WINDOW_FRAMES", "24"))
+
+def cover_path_for(output_path):
+    """ready_to_post/<sub>/<name>_vertical.mp4 -> ready_to_post/<sub>/<name>_vertical.jpg"""
+    return os.path.splitext(output_path)[0] + ".jpg"
+
+def cover_timestamp(info):
+    return round(clip_duration(info) * COVER_AT_FRACTION, 3)
+
+def cover_filter(info):
+    """Filter chain that picks the cover frame from an already formatted video stream."""
+    return f"trim=start={cover_timestamp(info)},thumbnail={COVER_WINDOW_FRAMES}"
+
+def cover_seek_args(info, source, fmt_args=()):
+    """
+    Extra input for outputs that are never decoded (stream copies, joined segments):
+    the same source opened again with a fast seek, so only a few frames get decoded.
+    """
+    return ["-ss", str(cover_timestamp(info)), *fmt_args, "-i", source]
+
+def cover_output_args(cover_path, seeked=False):
+    # A seeked input has no frame chosen yet; a split from the main graph already went through cover_filter().
+    vf = ["-vf", f"thumbnail={COVER_WINDOW_FRAMES}"] if seeked else []
+    return vf + ["-frames:v", "1", "-q:v", "3", "-update", "1", cover_path]
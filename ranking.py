@@ -0,0 +1,238 @@
+# --- START OF FILE ranking.py (Clip Ranking) ---
+
+import os
+import json
+import math
+import time
+import logging
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import state_db
+import probe
+
+# -------------------- Settings --------------------
+# At most this many clips per subreddit are formatted per RANK_WINDOW_HOURS, best first.
+# Off (0) unless set: everything downloaded is formatted, best first.
+RANK_TOP_N = int(os.getenv("RANK_TOP_N", "0"))
+RANK_WINDOW_HOURS = float(os.getenv("RANK_WINDOW_HOURS", "24"))
+# Reddit engagement counts half as much for every this many hours of post age.
+RANK_HALF_LIFE_HOURS = float(os.getenv("RANK_HALF_LIFE_HOURS", "48"))
+# Clips longer than this lose score in proportion; reels that drag lose viewers.
+RANK_IDEAL_MAX_SECONDS = float(os.getenv("RANK_IDEAL_MAX_SECONDS", "45"))
+# Downloads that stay below the cut this long are passed over for good, so their raw files can go.
+RANK_STALE_HOURS = float(os.getenv("RANK_STALE_HOURS", "72"))
+# Format workers call the gate before leasing; it does a full pass at most this often.
+RANK_GATE_SECONDS = float(os.getenv("RANK_GATE_SECONDS", "10"))
+# Queue priorities are only rewritten when a clip's score moved by more than this fraction.
+# Age decay shifts every score at the same rate, so it alone never reorders the queue.
+PRIORITY_MIN_CHANGE = 0.05
+ANALYSIS_WORKERS = 4
+
+# Analysis works on tiny grayscale frames and 8 kHz mono audio, so it costs a fraction of an encode.
+ANALYSIS_FPS = 4
+ANALYSIS_SIZE = 32
+AUDIO_RATE = 8000
+AUDIO_WINDOW_SECONDS = 0.5
+# Mean absolute luma change between sampled frames (0-1) at which a clip counts as fully lively.
+MOTION_TARGET = 0.04
+# Below this change two sampled frames count as frozen; below BLACK_LUMA mean brightness a frame counts as black.
+FROZEN_DIFF = 0.004
+BLACK_LUMA = 0.07
+SILENCE_DB = -50.0
+
+_gate_lock = threading.Lock()
+_last_gate = {"at": None, "result": (0, 0)}
+_stream_lock = threading.Lock()
+_streams = {}
+
+# -------------------- Reddit Signals --------------------
+def reddit_signal(item, now=None):
+    """Engagement from the listing (score, upvote ratio, comments), decayed by post age. 1.0 when unknown."""
+    if item["reddit_score"] is None:
+        return 1.0
+    engagement = math.log10(1 + max(item["reddit_score"], 0)) + 0.5 * math.log10(1 + (item["num_comments"] or 0))
+    age_hours = max(0.0, ((now or time.time()) - (item["created_utc"] or time.time())) / 3600)
+    return (1 + engagement) * (item["upvote_ratio"] or 1.0) * 0.5 ** (age_hours / RANK_HALF_LIFE_HOURS)
+
+# -------------------- Media Analysis --------------------
+def _gray_frames(path):
+    """ANALYSIS_FPS frames per second as an (n, ANALYSIS_SIZE, ANALYSIS_SIZE) float array in 0-1."""
+    # reddit.py only needs reddit_signal(), so numpy is left to the nodes that analyze clips.
+    import numpy as np
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-an",
+         "-vf", f"fps={ANALYSIS_FPS},scale={ANALYSIS_SIZE}:{ANALYSIS_SIZE}:flags=area,format=gray",
+         "-f", "rawvideo", "-"],
+        capture_output=True, check=True
+    )
+    frame_bytes = ANALYSIS_SIZE * ANALYSIS_SIZE
+    count = len(result.stdout) // frame_bytes
+    if count == 0:
+        raise ValueError("no frames decoded")
+    frames = np.frombuffer(result.stdout[:count * frame_bytes], dtype=np.uint8)
+    return frames.reshape(count, ANALYSIS_SIZE, ANALYSIS_SIZE).astype(np.float32) / 255
+
+def _audio_levels(path):
+    """Loudness in dBFS per AUDIO_WINDOW_SECONDS window of 8 kHz mono audio."""
+    import numpy as np
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-vn", "-ac", "1", "-ar", str(AUDIO_RATE), "-f", "s16le", "-"],
+        capture_output=True, check=True
+    )
+    samples = np.frombuffer(result.stdout[:len(result.stdout) // 2 * 2], dtype="<i2").astype(np.float32) / 32768
+    window = int(AUDIO_RATE * AUDIO_WINDOW_SECONDS)
+    if len(samples) < window:
+        return np.array([SILENCE_DB - 10])
+    windows = samples[:len(samples) // window * window].reshape(-1, window)
+    rms = np.sqrt(np.mean(windows ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-6))
+
+def analyze(path, info=None):
+    """Motion, frozen and black fractions, loudness and silence for one clip, as a dict of floats."""
+    import numpy as np
+    info = info or probe.probe(path)
+    frames = _gray_frames(path)
+    brightness = frames.mean(axis=(1, 2))
+    changes = np.abs(np.diff(frames, axis=0)).mean(axis=(1, 2)) if len(frames) > 1 else np.zeros(1)
+    features = {
+        "duration": float(info["duration"]),
+        "motion": float(changes.mean()),
+        "frozen": float((changes < FROZEN_DIFF).mean()),
+        "black": float((brightness < BLACK_LUMA).mean()),
+        "loudness_db": SILENCE_DB - 10,
+        "silent": 1.0,
+    }
+    if info.get("acodec"):
+        levels = _audio_levels(path)
+        features["loudness_db"] = float(np.percentile(levels, 90))
+        features["silent"] = float((levels < SILENCE_DB).mean())
+    return features
+
+def media_quality(features):
+    """0-1 multiplier: lively, bright, audible clips of reel length keep their Reddit score; the rest are cut down."""
+    liveliness = 0.3 + 0.7 * min(1.0, features["motion"] / MOTION_TARGET)
+    length = min(1.0, RANK_IDEAL_MAX_SECONDS / features["duration"]) if features["duration"] else 1.0
+    return (liveliness * (1 - features["black"]) * (1 - 0.8 * features["frozen"])
+            * (1 - 0.7 * features["silent"]) * length)
+
+def rank_item(item):
+    """Scores one downloaded clip and stores the score with its features. Returns the score."""
+    try:
+        features = analyze(item["raw_path"])
+    except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as e:
+        # OSError: the raw file went away after the gate saw it, e.g. evicted by storage.py.
+        logging.warning(f"Could not analyze {item['raw_path']} for ranking: {e}")
+        features = None
+    # An unreadable clip keeps half its Reddit score; the encoder will sort it out.
+    quality = media_quality(features) if features else 0.5
+    score = reddit_signal(item) * quality
+    state_db.set_rank(item["post_id"], score, json.dumps({"quality": quality, **(features or {})}))
+    return score
+
+def current_score(row):
+    """
+    The stored media quality times today's (age-decayed) Reddit signal. Clips not analyzed yet
+    (e.g. their raw file is on another node) get the unreadable-clip half quality, like rank_item().
+    """
+    if row["rank_features"] is None:
+        return reddit_signal(row) * 0.5
+    return reddit_signal(row) * json.loads(row["rank_features"])["quality"]
+
+# -------------------- Ranked Queue --------------------
+def admission_status():
+    """New format tasks wait as 'deferred' until rank_and_gate() lets them in, unless nothing is capped."""
+    return "deferred" if RANK_TOP_N > 0 else "queued"
+
+def _priority_changed(old, new):
+    return abs(new - old) > PRIORITY_MIN_CHANGE * max(abs(new), abs(old), 1e-9)
+
+def rank_and_gate(stage="format", force=False):
+    """
+    Scores every waiting clip not scored yet, orders the stage's queue by score and defers
+    everything below the top RANK_TOP_N per subreddit (less what was formatted in the last
+    RANK_WINDOW_HOURS). Deferred clips compete again on the next call; stale ones are passed over.
+    Without `force`, calls within RANK_GATE_SECONDS of the last pass return that pass's
+    (queued, deferred) counts without touching the database.
+    """
+    with _gate_lock:
+        if not force and _last_gate["at"] is not None and time.monotonic() - _last_gate["at"] < RANK_GATE_SECONDS:
+            return _last_gate["result"]
+        _last_gate["result"] = _gate(stage)
+        _last_gate["at"] = time.monotonic()
+        return _last_gate["result"]
+
+# -------------------- Streamed Clips --------------------
+def claim_stream_slot(subreddit):
+    """
+    Stream mode formats a clip without the format queue, so it takes its RANK_TOP_N slot here.
+    Counts clips formatted this window, admitted or running format tasks and this process's other
+    streams. Returns True and holds the slot until release_stream_slot(); False means the clip
+    should be downloaded and ranked like any other.
+    """
+    if RANK_TOP_N <= 0:
+        return True
+    with _stream_lock:
+        used = state_db.formatted_counts_since(time.time() - RANK_WINDOW_HOURS * 3600).get(subreddit, 0)
+        used += sum(1 for row in state_db.waiting_work("format")
+                    if row["subreddit"] == subreddit and row["status"] in ("queued", "leased"))
+        used += _streams.get(subreddit, 0)
+        if used >= RANK_TOP_N:
+            return False
+        _streams[subreddit] = _streams.get(subreddit, 0) + 1
+        return True
+
+def release_stream_slot(subreddit):
+    """Called once the stream is recorded as formatted (it then counts as formatted) or has fallen back."""
+    if RANK_TOP_N <= 0:
+        return
+    with _stream_lock:
+        _streams[subreddit] = max(0, _streams.get(subreddit, 0) - 1)
+
+def _gate(stage):
+    """One full pass of rank_and_gate(); the caller holds _gate_lock."""
+    waiting = state_db.waiting_work(stage)
+    unscored = [row for row in waiting if row["status"] != "leased" and row["rank_score"] is None
+                and row["raw_path"] and os.path.exists(row["raw_path"])]
+    if unscored:
+        with ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as pool:
+            list(pool.map(lambda row: rank_item(state_db.get_item(row["post_id"])), unscored))
+        waiting = state_db.waiting_work(stage)
+
+    # Clips some node is encoding right now already use up their subreddit's share.
+    in_progress = {}
+    for row in waiting:
+        if row["status"] == "leased":
+            in_progress[row["subreddit"]] = in_progress.get(row["subreddit"], 0) + 1
+    waiting = [row for row in waiting if row["status"] != "leased"]
+
+    by_subreddit, scores = {}, {}
+    for row in waiting:
+        scores[row["task_id"]] = current_score(row)
+        # The queue hands out the best clip first.
+        if _priority_changed(row["priority"], scores[row["task_id"]]):
+            state_db.set_work_priority(row["task_id"], scores[row["task_id"]])
+        by_subreddit.setdefault(row["subreddit"], []).append(row)
+
+    if RANK_TOP_N <= 0:
+        state_db.set_work_status([row["task_id"] for row in waiting if row["status"] == "deferred"], "queued")
+        return len(waiting), 0
+
+    recent = state_db.formatted_counts_since(time.time() - RANK_WINDOW_HOURS * 3600)
+    stale_before = time.time() - RANK_STALE_HOURS * 3600
+    keep, defer, stale = [], [], []
+    for subreddit, rows in by_subreddit.items():
+        rows.sort(key=lambda row: scores[row["task_id"]], reverse=True)
+        allowed = max(0, RANK_TOP_N - recent.get(subreddit, 0) - in_progress.get(subreddit, 0))
+        keep += rows[:allowed]
+        for row in rows[allowed:]:
+            (stale if (row["downloaded_at"] or 0) < stale_before else defer).append(row)
+
+    state_db.set_work_status([row["task_id"] for row in keep if row["status"] == "deferred"], "queued")
+    state_db.set_work_status([row["task_id"] for row in defer if row["status"] == "queued"], "deferred")
+    if stale:
+        state_db.set_work_status([row["task_id"] for row in stale], "done")
+        for row in stale:
+            state_db.mark_passed_over(row["post_id"])
+        logging.info(f"Passed over {len(stale)} clips that stayed below the ranking cut for {RANK_STALE_HOURS:g}h.")
+    return len(keep), len(defer)
@@ -1,13 +1,20 @@
 # --- START OF FILE reddit.py (Complete & Corrected Code) ---
 
 import os
-import praw
-import yt_dlp
+import time
+import signal
+import argparse
 import logging
 import threading
-import csv
-import prawcore  # <--- THIS IS THE FIX
+import state_db
+import downloader
+import storage
+import tracing
+import work_queue
+import retry_policy
+import ranking
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from slugify import slugify
 from dotenv import load_dotenv
 
@@ -27,126 +34,379 @@ def log_console(msg, level='info'):
     getattr(logging, level)(msg)
 
 # -------------------- Reddit API Setup --------------------
-client_id = os.getenv('REDDIT_CLIENT_ID')
-client_secret = os.getenv('REDDIT_CLIENT_SECRET')
-user_agent = os.getenv('REDDIT_USER_AGENT')
-
-if not all([client_id, client_secret, user_agent]):
-    log_console("❗ Missing Reddit API credentials in environment variables.", 'error')
-    exit(1)
-
-reddit = praw.Reddit(
-    client_id=client_id,
-    client_secret=client_secret,
-    user_agent=user_agent
-)
+def get_reddit_client():
+    import praw  # Download-only nodes (--worker) never list, so they never import it.
+    client_id = os.getenv('REDDIT_CLIENT_ID')
+    client_secret = os.getenv('REDDIT_CLIENT_SECRET')
+    user_agent = os.getenv('REDDIT_USER_AGENT')
+
+    if not all([client_id, client_secret, user_agent]):
+        log_console("❗ Missing Reddit API credentials in environment variables.", 'error')
+        exit(1)
+
+    return praw.Reddit(
+        client_id=client_id,
+        client_secret=client_secret,
+        user_agent=user_agent
+    )
 
 # -------------------- Read Subreddits --------------------
-try:
-    with open("subreddits", "r", encoding="utf-8") as f:
-        content = f.read()
-    subreddits = [s.strip() for s in content.split(',') if s.strip()]
-    if not subreddits:
-        log_console("❗ No valid subreddits found in subreddits file.", 'error')
+# Each entry in the `subreddits` file is `name` or `name:sort:time_filter:limit`,
+# e.g. `valorant:new::25`. Empty fields fall back to these defaults.
+LISTING_SORT = os.getenv("LISTING_SORT", "top")
+LISTING_TIME_FILTER = os.getenv("LISTING_TIME_FILTER", "month")
+LISTING_LIMIT = int(os.getenv("LISTING_LIMIT", "10"))
+LISTING_SORTS = ("top", "hot", "new", "rising", "controversial")
+
+def parse_subreddit_spec(entry):
+    name, sort, time_filter, limit = (entry.split(":") + ["", "", ""])[:4]
+    sort = sort.strip().lower() or LISTING_SORT
+    if sort not in LISTING_SORTS:
+        log_console(f"⚠️ Unknown sort '{sort}' for r/{name.strip()}, using '{LISTING_SORT}'.", 'warning')
+        sort = LISTING_SORT
+    return {
+        "name": name.strip(),
+        "sort": sort,
+        "time_filter": time_filter.strip() or LISTING_TIME_FILTER,
+        "limit": int(limit) if limit.strip().isdigit() else LISTING_LIMIT,
+    }
+
+def load_subreddits():
+    """Returns one listing spec dict (name, sort, time_filter, limit) per subreddit."""
+    try:
+        with open("subreddits", "r", encoding="utf-8") as f:
+            content = f.read()
+        subreddits = [parse_subreddit_spec(s.strip()) for s in content.split(',') if s.strip()]
+        if not subreddits:
+            log_console("❗ No valid subreddits found in subreddits file.", 'error')
+            exit(1)
+        else:
+            log_console(f"🔍 Found {len(subreddits)} subreddits: {[s['name'] for s in subreddits]}")
+        return subreddits
+    except FileNotFoundError:
+        log_console("❗ Error: `subreddits` file not found. Please create it.", 'error')
         exit(1)
-    else:
-        log_console(f"🔍 Found {len(subreddits)} subreddits: {subreddits}")
-except FileNotFoundError:
-    log_console("❗ Error: `subreddits` file not found. Please create it.", 'error')
-    exit(1)
 
+# -------------------- Listing Filters --------------------
+# Checked against listing metadata before anything reaches yt_dlp.
+MIN_CLIP_DURATION = int(os.getenv("MIN_CLIP_DURATION", "3"))
+MAX_CLIP_DURATION = int(os.getenv("MAX_CLIP_DURATION", "90"))
+MIN_CLIP_HEIGHT = int(os.getenv("MIN_CLIP_HEIGHT", "480"))
+SKIP_GIFS = os.getenv("SKIP_GIFS", "true").lower() == "true"
+
+def crosspost_parent_id(post):
+    parent = getattr(post, 'crosspost_parent', None)
+    return parent.split('_', 1)[-1] if parent else None
+
+def listing_rejection_reason(post):
+    """Returns why a post should not be downloaded, or None if it passes the filters."""
+    if not (post.is_video and getattr(post, 'media', None)):
+        return "not a Reddit video"
+    reddit_video = post.media.get('reddit_video') or {}
+    duration = reddit_video.get('duration')
+    height = reddit_video.get('height')
+    if SKIP_GIFS and reddit_video.get('is_gif'):
+        return "is a GIF"
+    if duration is not None and not (MIN_CLIP_DURATION <= duration <= MAX_CLIP_DURATION):
+        return f"duration {duration}s outside {MIN_CLIP_DURATION}-{MAX_CLIP_DURATION}s"
+    if height is not None and height < MIN_CLIP_HEIGHT:
+        return f"height {height}px below {MIN_CLIP_HEIGHT}px"
+    return None
 
-# -------------------- CSV Log Setup --------------------
-log_file = "video_log.csv"
-if not os.path.exists(log_file):
-    with open(log_file, "w", encoding="utf-8", newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Subreddit", "Title", "Reddit URL"])
+# -------------------- Streaming Mode --------------------
+# Encode straight from the media URL when the source is a single stream, so only the
+# vertical output is written. Sources that need a DASH audio/video merge still download first.
+STREAM_MODE = os.getenv("STREAM_MODE", "false").lower() == "true"
 
 # -------------------- Threading Setup --------------------
 MAX_THREADS = 5
-download_queue = Queue()
-log_lock = threading.Lock()
-
-def download_post_video(subreddit_name, post, output_dir, log_file):
-    if post.is_video and getattr(post, 'media', None):
-        title_slug = slugify(post.title)[:100]
-        filename = os.path.join(output_dir, f"{title_slug}.mp4")
-        reddit_url = f"https://reddit.com{post.permalink}"
-
-        if os.path.exists(filename):
-            log_console(f"🔁 Skipping (already exists): {title_slug}")
-            return
-
-        log_console(f"\n⬇️ Downloading from r/{subreddit_name}: {post.title}")
-        log_console(f"🔗 Source URL: {post.url}")
-
-        ydl_opts = {
-            'outtmpl': filename,
-            'quiet': True,
-            'noplaylist': True,
-            'merge_output_format': 'mp4',
-        }
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([post.url])
-        log_console(f"✅ Downloaded: {filename}")
-
-        with log_lock:
-            with open(log_file, "a", encoding="utf-8", newline='') as f:
-                writer = csv.writer(f, quoting=csv.QUOTE_ALL)
-                writer.writerow([subreddit_name, post.title, reddit_url])
-
-def worker():
-    while True:
-        item = download_queue.get()
-        if item is None:
-            break
+
+def download_task(subreddit_name, post, output_dir):
+    """What any download node needs to fetch a post, without the praw object."""
+    return {
+        "subreddit": subreddit_name,
+        "output_dir": output_dir,
+        "title": post.title,
+        "url": post.url,
+        "permalink": post.permalink,
+        "crosspost_parent": crosspost_parent_id(post),
+        # Listing signals for the ranking; the download itself does not need them.
+        "score": post.score,
+        "upvote_ratio": getattr(post, "upvote_ratio", None),
+        "num_comments": getattr(post, "num_comments", None),
+        "created_utc": post.created_utc,
+    }
+
+def download_post_video(post_id, task):
+    """
+    Downloads a single post from its queued download task. Returns the video path if a new
+    file was written, else None. In streaming mode that can be the finished vertical output;
+    the item's state says which. Raw downloads are queued for formatting.
+    """
+    subreddit_name, title = task["subreddit"], task["title"]
+    title_slug = slugify(title)[:100]
+    # The post ID keeps two titles with the same slug from overwriting each other.
+    filename = os.path.join(task["output_dir"], f"{title_slug}-{post_id}.mp4")
+    reddit_url = f"https://reddit.com{task['permalink']}"
+    os.makedirs(task["output_dir"], exist_ok=True)
+
+    state_db.add_discovered(post_id, subreddit_name, title, reddit_url)
+    if task.get("score") is not None:
+        state_db.set_listing_signals(post_id, task["score"], task["upvote_ratio"], task["num_comments"], task["created_utc"])
+    item = state_db.get_item(post_id)
+    if item["state"] != "discovered":
+        log_console(f"🔁 Skipping (already {item['state']}): {title_slug}")
+        return None
+    if os.path.exists(filename):
+        # Finished on a previous run (or node) that died before it could record the download.
+        log_console(f"🔁 Recovered existing download: {title_slug}")
+        state_db.mark_downloaded(post_id, filename)
+        state_db.mark_seen(post_id, task["crosspost_parent"])
+        work_queue.enqueue(work_queue.FORMAT, post_id, {"raw_path": filename}, status=ranking.admission_status())
+        return filename
+
+    # Downloads are leased best Reddit signal first, so the slots left this window go to the best
+    # posts. Posts with no slot left are downloaded and wait for the ranking gate like any other.
+    if STREAM_MODE and ranking.claim_stream_slot(subreddit_name):
+        import streaming  # Pulls in the encoder stack, so only when streaming is on.
+        log_console(f"\n📡 Streaming from r/{subreddit_name} into the encoder: {title}")
         try:
-            subreddit_name, post, output_dir, log_file = item
-            log_console(f"🔧 Worker processing: {post.title}")
-            download_post_video(subreddit_name, post, output_dir, log_file)
-        except Exception as e:
-            log_console(f"❌ Error in worker thread for item '{item[1].title}': {e}", 'error')
+            with tracing.span("stream", post_id, subreddit_name) as span:
+                output_path = streaming.stream_and_format(post_id, task["url"], filename)
+                span["status"] = "ok" if output_path else "fallback"
         finally:
-            download_queue.task_done()
+            ranking.release_stream_slot(subreddit_name)
+        if output_path:
+            log_console(f"✅ Formatted without a raw copy: {output_path}")
+            state_db.mark_seen(post_id, task["crosspost_parent"])
+            return output_path
+        log_console("↩️ Source needs a separate download (or streaming failed); downloading first.")
 
-# -------------------- Main Logic --------------------
-threads = []
-for i in range(MAX_THREADS):
-    t = threading.Thread(target=worker, name=f"Worker-{i+1}")
-    t.start()
-    threads.append(t)
+    log_console(f"\n⬇️ Downloading from r/{subreddit_name}: {title}")
+    log_console(f"🔗 Source URL: {task['url']}")
+
+    with tracing.span("download", post_id, subreddit_name) as span:
+        stats = downloader.download(task["url"], filename)
+        span.update(bytes=stats['bytes'], throughput=stats['throughput'])
+    log_console(f"✅ Downloaded: {filename} ({stats['bytes'] / 1e6:.1f} MB in {stats['seconds']:.1f}s, {stats['throughput'] / 1e6:.2f} MB/s)")
+
+    state_db.mark_downloaded(post_id, filename, stats['bytes'], stats['seconds'])
+    state_db.mark_seen(post_id, task["crosspost_parent"])
+    # Waits for the ranking gate, which lets in only the best clips per subreddit.
+    work_queue.enqueue(work_queue.FORMAT, post_id, {"raw_path": filename}, status=ranking.admission_status())
+    return filename
+
+def worker(drain, on_downloaded=None, stop=None, format_backlog=None):
+    """
+    Leases download tasks from the shared work queue. Once `drain` is set the worker exits as
+    soon as nothing is left to lease; `stop` ends it after the current task.
+    `on_downloaded(subreddit_name, post_id, path)` is called for every newly written file,
+    which is how main.py's pipeline mode counts downloads and schedules streamed clips.
+    With `format_backlog`, no new download starts while that many clips wait for formatting.
+    """
+    while not (stop and stop.is_set()):
+        # The media host is failing or rate limiting us: leave the queued posts alone until it recovers.
+        paused = retry_policy.breaker_wait(retry_policy.MEDIA)
+        if paused:
+            if drain.is_set() and paused > retry_policy.BREAKER_MAX_WAIT_SECONDS:
+                log_console(f"⏸️ Downloads paused for {paused:.0f}s after repeated failures; the rest stay queued for the next run.", 'warning')
+                break
+            time.sleep(min(paused, work_queue.WORK_POLL_SECONDS))
+            continue
+        # Only clips an encoder could take now count; ones backing off after a failure never drain by themselves.
+        if format_backlog and work_queue.ready(work_queue.FORMAT) >= format_backlog:
+            if drain.is_set() and not work_queue.ready(work_queue.DOWNLOAD):
+                break
+            time.sleep(1)
+            continue
+        tasks = work_queue.lease(work_queue.DOWNLOAD)
+        if not tasks:
+            if drain.is_set():
+                break
+            (stop or drain).wait(work_queue.WORK_POLL_SECONDS)
+            continue
+        task = tasks[0]
+        subreddit_name = task["payload"]["subreddit"]
+        try:
+            log_console(f"🔧 Worker processing: {task['payload']['title']}")
+            # Free space before writing, so yt_dlp never runs out of disk halfway through a file.
+            storage.maybe_enforce("download")
+            path = download_post_video(task["post_id"], task["payload"])
+            work_queue.complete(task)
+            retry_policy.record_success(retry_policy.MEDIA)
+        except Exception as e:
+            log_console(f"❌ Error in worker thread for item '{task['payload']['title']}': {e}", 'error')
+            retry_policy.record_failure(retry_policy.MEDIA, e)
+            work_queue.fail(task, e)
+            continue
+        if path and on_downloaded:
+            on_downloaded(subreddit_name, task["post_id"], path)
+
+# -------------------- Listing Fetch --------------------
+# Listings are fetched concurrently, each fetch borrowing its own praw client
+# because praw instances are not thread-safe.
+LISTING_WORKERS = int(os.getenv("LISTING_WORKERS", "4"))
+# Pause a fetch when fewer than this many requests are left in Reddit's rate-limit window.
+RATELIMIT_MIN_REMAINING = int(os.getenv("RATELIMIT_MIN_REMAINING", "10"))
+# Rankings like top/hot barely move within this window, so they are not re-fetched sooner.
+LISTING_REFRESH_MINUTES = int(os.getenv("LISTING_REFRESH_MINUTES", "60"))
+
+_listing_clients = []
 
-for subreddit_name in subreddits:
+def wait_for_ratelimit(client):
+    """Sleeps until the rate-limit window resets when the last response said we are nearly out."""
+    limits = client.auth.limits
+    remaining, reset_timestamp = limits.get("remaining"), limits.get("reset_timestamp")
+    if remaining is not None and reset_timestamp and remaining < RATELIMIT_MIN_REMAINING:
+        delay = max(0, reset_timestamp - time.time()) + 1
+        log_console(f"🕒 Reddit rate limit nearly used up ({remaining:.0f} left). Waiting {delay:.0f}s...", 'warning')
+        time.sleep(delay)
+
+def read_listing(client, spec, cursor):
+    """
+    Reads one listing. Only `new` is cut short, at the cursor's high-water mark. Ranked listings
+    (top/hot/rising/controversial) are ordered by score, not time, so neither Reddit's `before`
+    nor a seen post marks where the unseen ones end: the full `limit` is read again and
+    already-seen posts are dropped by the caller, before anything is downloaded.
+    """
+    name, sort = spec["name"], spec["sort"]
+    with tracing.span("listing", subreddit=name, sort=sort) as span:
+        wait_for_ratelimit(client)
+        subreddit = client.subreddit(name)
+        if sort in ("top", "controversial"):
+            listing = getattr(subreddit, sort)(time_filter=spec["time_filter"], limit=spec["limit"])
+        else:
+            listing = getattr(subreddit, sort)(limit=spec["limit"])
+
+        posts = []
+        for post in listing:
+            # `new` is newest-first, so everything past the high-water mark was seen last run.
+            if sort == "new" and cursor and cursor["last_created_utc"] and post.created_utc <= cursor["last_created_utc"]:
+                break
+            posts.append(post)
+        span["posts"] = len(posts)
+    return posts
+
+def fetch_listing(client_pool, spec):
+    """
+    Returns the posts of one subreddit listing, or [] if it is not due or has nothing new. For
+    ranked listings the cursor only spaces fetches LISTING_REFRESH_MINUTES apart.
+    """
+    name, sort = spec["name"], spec["sort"]
+    cursor = state_db.get_cursor(name, sort)
+    if cursor and sort != "new" and time.time() - cursor["fetched_at"] < LISTING_REFRESH_MINUTES * 60:
+        logging.info(f"r/{name} {sort} listing fetched {time.time() - cursor['fetched_at']:.0f}s ago, not due yet.")
+        return []
+
+    client = client_pool.get()
     try:
-        output_dir = os.path.join("downloaded_videos", slugify(subreddit_name))
-        if not os.path.exists(output_dir):
-            log_console(f"📁 Creating output directory for r/{subreddit_name}: {output_dir}")
-            os.makedirs(output_dir, exist_ok=True)
-
-        log_console(f"\n🏷️ Processing r/{subreddit_name} (top this week)")
-        subreddit = reddit.subreddit(subreddit_name)
-        posts = subreddit.top(time_filter="month", limit=10)
-        
-        for post in posts:
-            download_queue.put((subreddit_name, post, output_dir, log_file))
-
-    except prawcore.exceptions.Redirect as e:
-        log_console(f"❌ Could not find subreddit 'r/{subreddit_name}'. It may be misspelled, banned, or private. Skipping. Error: {e}", 'error')
-        continue
-    except Exception as e:
-        log_console(f"❌ An unexpected error occurred for r/{subreddit_name}: {e}", 'error')
-        continue
-
-log_console("\n⏳ Waiting for all downloads to complete...")
-download_queue.join()
-log_console("✅ All tasks completed.")
-
-log_console("🛑 Stopping worker threads...")
-for _ in range(MAX_THREADS):
-    download_queue.put(None)
-for t in threads:
-    t.join()
-
-log_console("\nAll done. Enjoy your downloaded reels! 🕹️🎬")
\ No newline at end of file
+        # Rate limits and Reddit outages are retried with backoff; the breaker pauses every listing fetch.
+        posts = retry_policy.call(retry_policy.REDDIT, lambda: read_listing(client, spec, cursor))
+    finally:
+        client_pool.put(client)
+
+    newest = max(posts, key=lambda p: p.created_utc, default=None)
+    state_db.update_cursor(name, sort, newest.fullname if newest else None, newest.created_utc if newest else None)
+    return posts
+
+def queue_subreddit_posts(reddit, subreddits):
+    """Fetches all subreddit listings concurrently and queues new, wanted posts for download."""
+    import prawcore
+    extra = min(LISTING_WORKERS, len(subreddits)) - 1
+    # The extra clients are kept, so a warm daemon (main.py --daemon) does not make new ones every run.
+    while len(_listing_clients) < extra:
+        _listing_clients.append(get_reddit_client())
+    client_pool = Queue()
+    client_pool.put(reddit)
+    for client in _listing_clients[:max(0, extra)]:
+        client_pool.put(client)
+
+    with ThreadPoolExecutor(max_workers=max(1, LISTING_WORKERS), thread_name_prefix="Listing") as pool:
+        future_to_spec = {pool.submit(fetch_listing, client_pool, spec): spec for spec in subreddits}
+        for future in as_completed(future_to_spec):
+            subreddit_name = future_to_spec[future]["name"]
+            try:
+                posts = future.result()
+            except prawcore.exceptions.Redirect as e:
+                log_console(f"❌ Could not find subreddit 'r/{subreddit_name}'. It may be misspelled, banned, or private. Skipping. Error: {e}", 'error')
+                continue
+            except retry_policy.BreakerOpen as e:
+                log_console(f"⏸️ Skipping r/{subreddit_name} this run: {e}", 'warning')
+                continue
+            except Exception as e:
+                log_console(f"❌ An unexpected error occurred for r/{subreddit_name}: {e}", 'error')
+                continue
+
+            output_dir = os.path.join("downloaded_videos", slugify(subreddit_name))
+            if not os.path.exists(output_dir):
+                log_console(f"📁 Creating output directory for r/{subreddit_name}: {output_dir}")
+                os.makedirs(output_dir, exist_ok=True)
+
+            queued = skipped = 0
+            for post in posts:
+                if state_db.is_seen(post.id, crosspost_parent_id(post)):
+                    skipped += 1
+                    continue
+                reason = listing_rejection_reason(post)
+                if reason:
+                    logging.info(f"Filtered out '{post.title}' ({post.id}): {reason}")
+                    skipped += 1
+                    continue
+                # Opens the clip's trace; the listing fetch itself is the subreddit's 'listing' span.
+                tracing.record("listed", post.id, subreddit=subreddit_name, score=post.score)
+                task = download_task(subreddit_name, post, output_dir)
+                # The most promising posts are downloaded first.
+                reddit_score = ranking.reddit_signal({"reddit_score": task["score"], "upvote_ratio": task["upvote_ratio"],
+                                                      "num_comments": task["num_comments"], "created_utc": task["created_utc"]})
+                if work_queue.enqueue(work_queue.DOWNLOAD, post.id, task, priority=reddit_score):
+                    queued += 1
+                else:
+                    skipped += 1
+            log_console(f"📋 r/{subreddit_name}: {len(posts)} new in listing, queued {queued}, skipped {skipped} seen or filtered.")
+
+# -------------------- Main Logic --------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Downloads new clips from the subreddits in the `subreddits` file.")
+    parser.add_argument(
+        "--worker", action="store_true",
+        help="Download node: skip the listings and keep downloading queued posts until Ctrl+C or SIGTERM."
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    storage.enforce_budgets("download")
+
+    drain, stop = threading.Event(), threading.Event()
+    if args.worker:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        log_console(f"🛰️ Download node {work_queue.NODE_ID} waiting for queued posts (Ctrl+C to stop).")
+
+    if not args.worker:
+        # Both exit(1) on missing credentials or subreddits, so they run before any worker starts.
+        reddit = get_reddit_client()
+        subreddits = load_subreddits()
+
+    threads = []
+    for i in range(MAX_THREADS):
+        t = threading.Thread(target=worker, args=(drain, None, stop if args.worker else None), name=f"Worker-{i+1}")
+        t.start()
+        threads.append(t)
+
+    if not args.worker:
+        try:
+            queue_subreddit_posts(reddit, subreddits)
+            log_console("\n⏳ Waiting for all downloads to complete...")
+        finally:
+            # Workers leave once the queue is empty; posts other nodes are still on stay theirs.
+            drain.set()
+
+    for t in threads:
+        t.join()
+    log_console("✅ All tasks completed.")
+
+    log_console("\nAll done. Enjoy your downloaded reels! 🕹️🎬")
+
+if __name__ == "__main__":
+    main()
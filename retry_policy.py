@@ -0,0 +1,229 @@
+# --- START OF FILE retry_policy.py (Retries, Circuit Breakers and Dead Letters) ---
+
+import os
+import re
+import time
+import random
+import logging
+import argparse
+import threading
+from email.utils import parsedate_to_datetime
+import state_db
+
+# -------------------- Settings --------------------
+# Retry delays grow from RETRY_BASE_SECONDS, doubling per attempt up to RETRY_MAX_SECONDS, with jitter.
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "3600"))
+# In-place retries for calls that cannot be put back on a queue (listing fetches).
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "4"))
+# Consecutive upstream failures (timeouts, 5xx, rate limits) that open an upstream's breaker.
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+# How long an open breaker pauses its stage; doubled each time it opens again without a success in between.
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "300"))
+# A run that is only draining its queue waits this long for a breaker to close, then leaves the rest for the next run.
+BREAKER_MAX_WAIT_SECONDS = float(os.getenv("BREAKER_MAX_WAIT_SECONDS", "120"))
+
+# Upstreams with their own breaker. Instagram has one per account: upstream_for_account().
+REDDIT = "reddit"
+MEDIA = "media"
+
+# Failure kinds
+RATE_LIMITED = "rate_limited"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+FAILED = "failed"
+
+# Matched by class name, so this module needs none of praw, yt_dlp or instagrapi to classify their errors.
+RATE_LIMIT_ERRORS = {"TooManyRequests", "PleaseWaitFewMinutes", "RateLimitError", "ClientThrottledError", "FeedbackRequired"}
+TRANSIENT_ERRORS = {
+    "ServerError", "RequestException", "ClientConnectionError", "ClientRequestTimeout",
+    "ConnectionError", "TimeoutError", "Timeout", "IncompleteRead", "TransportError",
+}
+PERMANENT_ERRORS = {"Redirect", "NotFound", "Forbidden", "UnavailableForLegalReasons", "MediaNotFound", "UnsupportedError"}
+# yt_dlp and urllib only put the status in the message.
+_HTTP_STATUS = re.compile(r"HTTP Error (\d{3})")
+
+_lock = threading.Lock()
+
+class BreakerOpen(Exception):
+    def __init__(self, upstream, seconds):
+        super().__init__(f"{upstream} is paused for another {seconds:.0f}s after repeated failures")
+        self.upstream = upstream
+        self.seconds = seconds
+
+def upstream_for_account(account):
+    return f"instagram:{account}"
+
+# -------------------- Classification --------------------
+def _related(error):
+    """The error plus what it wraps: yt_dlp keeps the original in exc_info, others chain it."""
+    exc_info = getattr(error, "exc_info", None)
+    wrapped = exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None
+    return [e for e in (error, wrapped, error.__cause__, error.__context__) if isinstance(e, BaseException)]
+
+def _retry_after(errors):
+    for error in errors:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+        value = headers.get("retry-after") if hasattr(headers, "get") else None
+        if not value:
+            continue
+        value = str(value).strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def _http_status(errors):
+    for error in errors:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(response, "status", None) or getattr(error, "code", None)
+        if isinstance(status, int):
+            return status
+        match = _HTTP_STATUS.search(str(error))
+        if match:
+            return int(match.group(1))
+    return None
+
+def classify(error):
+    """
+    Returns (kind, retry_after_seconds) for an exception: RATE_LIMITED (429s and throttling),
+    TRANSIENT (timeouts, connection errors, 5xx), PERMANENT (missing or forbidden, retrying
+    will not help) or FAILED (anything else, e.g. a failed encode). Plain strings are FAILED.
+    """
+    if not isinstance(error, BaseException):
+        return FAILED, None
+    errors = _related(error)
+    names = {cls.__name__ for e in errors for cls in type(e).__mro__}
+    status = _http_status(errors)
+    if names & RATE_LIMIT_ERRORS or status == 429:
+        return RATE_LIMITED, _retry_after(errors)
+    if names & PERMANENT_ERRORS or (status and 400 <= status < 500 and status != 408):
+        return PERMANENT, None
+    if names & TRANSIENT_ERRORS or (status and status >= 500):
+        return TRANSIENT, _retry_after(errors)
+    return FAILED, None
+
+def backoff_seconds(attempt, retry_after=None, base=None):
+    """
+    Delay before retry number `attempt` (1-based): exponential with equal jitter, so a burst of
+    failures does not come back all at once. A server's Retry-After is a floor, never shortened.
+    """
+    base = RETRY_BASE_SECONDS if base is None else base
+    ceiling = min(RETRY_MAX_SECONDS, base * 2 ** max(0, attempt - 1))
+    delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+    return max(delay, retry_after or 0)
+
+# -------------------- Circuit Breakers --------------------
+# Kept in the state store, so every node sharing it pauses together.
+def breaker_wait(upstream):
+    """Seconds until the upstream's breaker lets calls through again; 0 when it is closed."""
+    row = state_db.get_breaker(upstream)
+    return max(0.0, row["opened_until"] - time.time()) if row else 0.0
+
+def last_error(upstream):
+    row = state_db.get_breaker(upstream)
+    return row["last_error"] if row else None
+
+def record_success(upstream):
+    row = state_db.get_breaker(upstream)
+    if row and (row["failures"] or row["opened_until"]):
+        state_db.put_breaker(upstream, 0, 0, None)
+        logging.info(f"Breaker for {upstream} closed again.")
+
+def record_failure(upstream, error):
+    """
+    Counts a failed call against the upstream and opens its breaker when it is rate limited or
+    has failed BREAKER_THRESHOLD times in a row. Returns (kind, retry_after) like classify().
+    """
+    kind, retry_after = classify(error)
+    with _lock:
+        row = state_db.get_breaker(upstream)
+        failures = row["failures"] if row else 0
+        opened_until = row["opened_until"] if row else 0.0
+        if kind in (RATE_LIMITED, TRANSIENT):
+            failures += 1
+            now = time.time()
+            if kind == RATE_LIMITED:
+                pause = retry_after or backoff_seconds(failures)
+            elif failures >= BREAKER_THRESHOLD:
+                pause = min(RETRY_MAX_SECONDS, BREAKER_COOLDOWN_SECONDS * 2 ** (failures - BREAKER_THRESHOLD))
+            else:
+                pause = 0
+            if pause and now + pause > opened_until:
+                opened_until = now + pause
+                logging.warning(f"Breaker for {upstream} open for {pause:.0f}s after {failures} failures ({kind}): {error}")
+        state_db.put_breaker(upstream, failures, opened_until, str(error)[:500])
+    return kind, retry_after
+
+def call(upstream, request, attempts=None):
+    """
+    Runs request() with backoff retries on rate limits and transient errors, waiting out the
+    upstream's breaker first. Raises BreakerOpen if the breaker stays open longer than
+    BREAKER_MAX_WAIT_SECONDS, and the last error once the attempts are used up.
+    """
+    attempts = attempts or RETRY_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        wait = breaker_wait(upstream)
+        if wait > BREAKER_MAX_WAIT_SECONDS:
+            raise BreakerOpen(upstream, wait)
+        if wait:
+            time.sleep(wait)
+        try:
+            result = request()
+        except Exception as e:
+            kind, retry_after = record_failure(upstream, e)
+            if kind in (PERMANENT, FAILED) or attempt == attempts:
+                raise
+            delay = backoff_seconds(attempt, retry_after)
+            logging.warning(f"{upstream} call failed ({kind}), retry {attempt}/{attempts - 1} in {delay:.0f}s: {e}")
+            time.sleep(delay)
+            continue
+        record_success(upstream)
+        return result
+
+# -------------------- Dead Letters --------------------
+def dead_letter(post_id, stage, attempts, error):
+    """Parks an item that keeps failing, with its last error, until someone requeues it."""
+    state_db.add_dead_letter(post_id, stage, attempts, str(error)[:2000])
+    logging.error(f"Gave up on {stage} of post {post_id} after {attempts} attempts: {error}")
+
+def requeue(post_id, stage):
+    """Puts a dead-lettered item back on its queue with fresh attempts. Returns True if it was found."""
+    if stage in ("upload", "comment"):
+        found = state_db.requeue_upload_job(post_id, stage)
+    else:
+        found = state_db.requeue_work(stage, post_id)
+    state_db.remove_dead_letter(post_id, stage)
+    return found
+
+# -------------------- Main Function --------------------
+def parse_args():
+    parser = argparse.ArgumentParser(description="Lists the items that kept failing, and puts them back on their queues.")
+    parser.add_argument("--stage", help="Only this stage (download, format, upload or comment).")
+    parser.add_argument("--requeue", metavar="POST_ID", nargs="*", help="Requeue these posts, or every listed one if no IDs are given.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    letters = state_db.dead_letters(args.stage)
+    for row in state_db.open_breakers():
+        print(f"⏸️ {row['upstream']} paused for another {row['opened_until'] - time.time():.0f}s: {row['last_error']}")
+    if not letters:
+        print("✅ No dead letters.")
+        return
+    if args.requeue is not None:
+        chosen = [row for row in letters if not args.requeue or row["post_id"] in args.requeue]
+        for row in chosen:
+            requeue(row["post_id"], row["stage"])
+        print(f"🔁 Requeued {len(chosen)} items.")
+        return
+    for row in letters:
+        failed_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["failed_at"]))
+        print(f"💀 {row['post_id']} [{row['stage']}] {row['attempts']} attempts, last at {failed_at}: {row['last_error']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# --- START OF FILE scheduler.py (Adaptive ffmpeg Job Scheduler) ---
+
+import os
+import time
+import statistics
+import threading
+import psutil
+import probe
+import state_db
+import tracing
+
+# -------------------- Settings --------------------
+CPU_COUNT = os.cpu_count() or 4
+# Upper bound on ffmpeg jobs in flight; the live checks below usually stop well before it.
+MAX_PARALLEL_JOBS = int(os.getenv("MAX_PARALLEL_JOBS", str(CPU_COUNT)))
+# Fixed per-job thread count; 0 means pick one from the input resolution.
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", "0"))
+# Don't start another job while the machine is busier than this (unless nothing is running).
+CPU_BUSY_PERCENT = float(os.getenv("CPU_BUSY_PERCENT", "90"))
+# Memory always left free for the rest of the system.
+MEMORY_RESERVE_BYTES = int(os.getenv("MEMORY_RESERVE_MB", "512")) * 1024 * 1024
+# Jobs younger than this have not reached their peak RSS yet, so their estimate is still reserved.
+RAMP_UP_SECONDS = 5
+
+# Memory model: peak RSS = base + bytes_per_pixel * input pixels, refined from recorded jobs.
+BASE_RSS_BYTES = 150 * 1024 * 1024
+DEFAULT_BYTES_PER_PIXEL = 120.0
+LEARNING_WINDOW = 50
+
+_cond = threading.Condition()
+_running = {}
+_model = {"bytes_per_pixel": None, "jobs_seen": 0}
+
+# -------------------- Job Sizing --------------------
+def pixels(info):
+    return info["width"] * info["height"]
+
+def threads_for(info):
+    """Stream copies need one thread; encodes get more as the input resolution grows."""
+    if probe.classify(info) == probe.COMPLIANT:
+        return 1
+    if FFMPEG_THREADS:
+        return FFMPEG_THREADS
+    if pixels(info) <= 1280 * 720:
+        threads = 2
+    elif pixels(info) <= 1920 * 1080:
+        threads = 4
+    else:
+        threads = 6
+    return min(threads, CPU_COUNT)
+
+def bytes_per_pixel():
+    """Median of recent jobs' (peak RSS - base) / pixels, falling back to a conservative default."""
+    if _model["bytes_per_pixel"] is None:
+        samples = [
+            (row["peak_rss"] - BASE_RSS_BYTES) / row["pixels"]
+            for row in state_db.recent_encode_stats(LEARNING_WINDOW)
+            if row["pixels"] and row["peak_rss"] and row["input_class"] != probe.COMPLIANT
+        ]
+        _model["bytes_per_pixel"] = max(statistics.median(samples), 1.0) if samples else DEFAULT_BYTES_PER_PIXEL
+    return _model["bytes_per_pixel"]
+
+def estimate_rss(info):
+    if probe.classify(info) == probe.COMPLIANT:
+        return BASE_RSS_BYTES
+    return int(BASE_RSS_BYTES + bytes_per_pixel() * pixels(info))
+
+def make_job(post_id, input_path, output_path, preset, info, profile=None):
+    return {
+        "post_id": post_id,
+        "input_path": input_path,
+        "output_path": output_path,
+        "preset": preset,
+        "profile": profile,
+        "info": info,
+        "threads": threads_for(info),
+        "est_rss": estimate_rss(info),
+    }
+
+def order_longest_first(jobs):
+    """Longest clips start first so the batch does not end waiting on one big straggler."""
+    return sorted(jobs, key=lambda job: job["info"]["duration"], reverse=True)
+
+# -------------------- Admission Control --------------------
+def _fits(job):
+    if not _running:
+        return True  # Always let one job through, however big.
+    if len(_running) >= MAX_PARALLEL_JOBS:
+        return False
+    if sum(j["threads"] for j in _running.values()) + job["threads"] > CPU_COUNT:
+        return False
+    if psutil.cpu_percent(interval=None) > CPU_BUSY_PERCENT:
+        return False
+    now = time.monotonic()
+    ramping = sum(j["est_rss"] for j in _running.values() if now - j["started"] < RAMP_UP_SECONDS)
+    return job["est_rss"] <= psutil.virtual_memory().available - ramping - MEMORY_RESERVE_BYTES
+
+def try_acquire(job):
+    """Registers the job as running if the machine has room for it right now."""
+    with _cond:
+        if not _fits(job):
+            return False
+        job["started"] = time.monotonic()
+        _running[id(job)] = job
+        return True
+
+def acquire(job, poll_seconds=1.0):
+    """Blocks until the job fits, then registers it as running."""
+    with _cond:
+        while not _fits(job):
+            _cond.wait(timeout=poll_seconds)
+        job["started"] = time.monotonic()
+        _running[id(job)] = job
+
+def release(job, stats=None):
+    """Frees the job's slot and records what it actually cost (or that it failed)."""
+    with _cond:
+        _running.pop(id(job), None)
+        _cond.notify_all()
+    if stats:
+        record(job, stats)
+    elif "started" in job:
+        tracing.record("encode", job["post_id"], time.monotonic() - job["started"], status="error",
+                       input_class=probe.classify(job["info"]), preset=job["preset"], segment="parent" in job)
+
+def record(job, stats):
+    state_db.add_encode_stats(
+        job["post_id"], probe.classify(job["info"]), job["preset"], pixels(job["info"]),
+        job["info"]["duration"], job["threads"], stats["wall_seconds"], stats["cpu_seconds"], stats["peak_rss"]
+    )
+    tracing.record(
+        "encode", job["post_id"], stats["wall_seconds"],
+        media_seconds=job["info"]["duration"], cpu_seconds=stats["cpu_seconds"], peak_rss=stats["peak_rss"],
+        realtime_factor=round(job["info"]["duration"] / stats["wall_seconds"], 2) if stats["wall_seconds"] else None,
+        input_class=probe.classify(job["info"]), preset=job["preset"], threads=job["threads"], segment="parent" in job,
+    )
+    _model["jobs_seen"] += 1
+    if _model["jobs_seen"] % 10 == 0:
+        _model["bytes_per_pixel"] = None  # Re-learn from the newest jobs.
+
+# -------------------- Process Monitoring --------------------
+def run_monitored(cmd, poll_seconds=0.5, **popen_kwargs):
+    """
+    Runs a command to completion, sampling it with psutil.
+    Returns (returncode, {'wall_seconds', 'cpu_seconds', 'peak_rss'}).
+    """
+    started = time.monotonic()
+    proc = psutil.Popen(cmd, **popen_kwargs)
+    peak_rss = cpu_seconds = 0
+    while True:
+        try:
+            peak_rss = max(peak_rss, proc.memory_info().rss)
+            cpu_times = proc.cpu_times()
+            cpu_seconds = cpu_times.user + cpu_times.system
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+        try:
+            returncode = proc.wait(timeout=poll_seconds)
+            break
+        except psutil.TimeoutExpired:
+            continue
+    return returncode, {
+        "wall_seconds": time.monotonic() - started,
+        "cpu_seconds": cpu_seconds,
+        "peak_rss": peak_rss,
+    }
@@ -0,0 +1,154 @@
+# --- START OF FILE segments.py (Segment-Parallel Encoding) ---
+
+import os
+import glob
+import shutil
+import logging
+import subprocess
+from concurrent.futures import wait
+import probe
+import profiles
+import scheduler
+import outputs
+
+# -------------------- Settings --------------------
+# Clips longer than this are cut into segments that encode in parallel.
+SEGMENT_MIN_DURATION = float(os.getenv("SEGMENT_MIN_DURATION", "60"))
+# Target segment length; the actual cuts land on the next keyframe.
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "15"))
+
+# -------------------- Split / Concat --------------------
+def should_split(job):
+    # Stream copies are already cheap, so only real encodes are worth splitting.
+    return job["info"]["duration"] > SEGMENT_MIN_DURATION and probe.classify(job["info"]) != probe.COMPLIANT
+
+def segment_dir(job):
+    return job["output_path"] + ".segments"
+
+def split_into_segments(job):
+    """
+    Cuts the video stream at keyframes with a stream copy and returns one encode job per piece.
+    Audio is left out of the pieces and taken from the original when they are joined,
+    so it cannot drift at the cut points.
+    """
+    work_dir = segment_dir(job)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    subprocess.run(
+        ["ffmpeg", "-y", "-i", job["input_path"], "-map", "0:v:0", "-c", "copy",
+         "-f", "segment", "-segment_time", str(SEGMENT_SECONDS), "-reset_timestamps", "1",
+         "-loglevel", "error", os.path.join(work_dir, "src_%04d.mp4")],
+        capture_output=True, text=True, check=True
+    )
+    sources = sorted(glob.glob(os.path.join(work_dir, "src_*.mp4")))
+    segment_info = dict(
+        job["info"], acodec=None,
+        duration=job["info"]["duration"] / max(1, len(sources)),
+        clip_duration=profiles.clip_duration(job["info"]),
+    )
+
+    segment_jobs = []
+    for source in sources:
+        encoded = os.path.join(work_dir, "enc_" + os.path.basename(source)[len("src_"):])
+        segment_job = scheduler.make_job(job["post_id"], source, encoded, job["preset"], segment_info, job["profile"])
+        segment_job["parent"] = job
+        segment_jobs.append(segment_job)
+    job["segments"] = segment_jobs
+    job["remaining"] = len(segment_jobs)
+    job["failed"] = False
+    return segment_jobs
+
+def concat_segments(job):
+    """
+    Joins the encoded pieces losslessly, muxes the original audio back in and takes the cover from
+    the joined video. Returns the output path, or None if the joined file fails validation.
+    """
+    work_dir = segment_dir(job)
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for segment_job in job["segments"]:
+            path = os.path.abspath(segment_job["output_path"]).replace("'", "'\\''")
+            f.write(f"file '{path}'\n")
+
+    concat_input = ["-f", "concat", "-safe", "0", "-i", list_path]
+    cover_path = profiles.cover_path_for(job["output_path"])
+    cmd = (
+        ["ffmpeg", "-y", "-loglevel", "error"] + concat_input + ["-i", job["input_path"]]
+        + profiles.cover_seek_args(job["info"], list_path, concat_input[:-2])
+        + ["-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy"]
+        + profiles.audio_args(job["info"])
+        + profiles.container_args()
+        + [outputs.temp_path(job["output_path"])]
+        + ["-map", "2:v:0"] + profiles.cover_output_args(outputs.temp_path(cover_path), seeked=True)
+    )
+    try:
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError:
+        outputs.discard(outputs.temp_path(job["output_path"]), outputs.temp_path(cover_path))
+        raise
+    return job["output_path"] if outputs.commit(job["output_path"], job["info"], cover_path) else None
+
+def cleanup(job):
+    shutil.rmtree(segment_dir(job), ignore_errors=True)
+
+# -------------------- Batch Bookkeeping --------------------
+def expand(jobs):
+    """Replaces every long job with its segment jobs. A clip that cannot be split keeps the single-process path."""
+    expanded = []
+    for job in jobs:
+        if should_split(job):
+            try:
+                segment_jobs = split_into_segments(job)
+                if len(segment_jobs) > 1:
+                    expanded.extend(segment_jobs)
+                    continue
+                cleanup(job)
+            except subprocess.CalledProcessError as e:
+                logging.warning(f"Could not split {os.path.basename(job['input_path'])}, encoding it whole: {e.stderr}")
+                cleanup(job)
+            job.pop("segments", None)
+        expanded.append(job)
+    return expanded
+
+def segment_done(segment_job, ok):
+    """Marks one piece as finished. Returns the parent job once all of its pieces are done."""
+    parent = segment_job["parent"]
+    parent["remaining"] -= 1
+    parent["failed"] = parent["failed"] or not ok
+    return parent if parent["remaining"] == 0 else None
+
+def finish(parent):
+    """Joins a finished parent's pieces. Returns the output path, or None if any piece failed."""
+    try:
+        if parent["failed"]:
+            logging.error(f"❌ A segment of {os.path.basename(parent['input_path'])} failed to encode.")
+            return None
+        return concat_segments(parent)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"❌ Joining segments failed for {os.path.basename(parent['input_path'])}: {e.stderr}")
+        return None
+    finally:
+        cleanup(parent)
+
+# -------------------- Blocking Helper --------------------
+def encode_segments(executor, segment_jobs, submit_job):
+    """
+    Encodes the pieces from expand() on `executor`, each admitted by the scheduler, then joins them.
+    Used by the streaming pipeline, where each clip is handled by its own thread.
+    Returns the output path, or None on failure.
+    """
+    def on_done(future, segment_job):
+        result = None if future.exception() else future.result()
+        scheduler.release(segment_job, result[2] if result else None)
+
+    futures = []
+    for segment_job in segment_jobs:
+        scheduler.acquire(segment_job)
+        future = submit_job(executor, segment_job)
+        # Free each slot as soon as its piece is done so later pieces can start.
+        future.add_done_callback(lambda f, segment_job=segment_job: on_done(f, segment_job))
+        futures.append(future)
+    wait(futures)
+    parent = segment_jobs[0]["parent"]
+    parent["failed"] = any(future.exception() or not future.result() for future in futures)
+    return finish(parent)
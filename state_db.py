@@ -0,0 +1,720 @@
+# --- START OF FILE state_db.py (SQLite Pipeline State) ---
+
+import os
+import re
+import csv
+import time
+import uuid
+import sqlite3
+import threading
+
+# -------------------- Settings --------------------
+STATE_DB = os.getenv("STATE_DB", "pipeline_state.db")
+
+# Every item moves forward through these states, one stage at a time.
+STATES = ("discovered", "downloaded", "formatted", "uploaded", "commented")
+# Terminal state for clips dropped before formatting because another post has the same video.
+DUPLICATE = "duplicate"
+# Terminal state for clips that stayed below the ranking cut until they went stale.
+PASSED_OVER = "passed_over"
+
+# Legacy CSV logs, imported once when the database is first created.
+LEGACY_DOWNLOAD_LOG = "video_log.csv"
+LEGACY_FORMAT_LOG = "video_format_log.csv"
+LEGACY_UPLOAD_LOG = "upload_log.csv"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    post_id       TEXT PRIMARY KEY,
+    subreddit     TEXT NOT NULL,
+    title         TEXT NOT NULL,
+    reddit_url    TEXT,
+    state         TEXT NOT NULL DEFAULT 'discovered',
+    raw_path      TEXT,
+    output_path   TEXT,
+    media_id      TEXT,
+    discovered_at REAL,
+    downloaded_at REAL,
+    formatted_at  REAL,
+    uploaded_at   REAL,
+    commented_at  REAL,
+    duplicate_of  TEXT,
+    download_bytes   INTEGER,
+    download_seconds REAL,
+    filter_preset    TEXT,
+    encode_profile   TEXT,
+    output_bytes     INTEGER,
+    output_kbps      REAL
+);
+CREATE INDEX IF NOT EXISTS idx_items_state ON items (state, subreddit);
+CREATE INDEX IF NOT EXISTS idx_items_raw_path ON items (raw_path);
+CREATE INDEX IF NOT EXISTS idx_items_output_path ON items (output_path);
+
+CREATE TABLE IF NOT EXISTS seen_posts (
+    post_id   TEXT PRIMARY KEY,
+    source_id TEXT NOT NULL,
+    seen_at   REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS media_hashes (
+    post_id      TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    phash        BLOB,
+    created_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_media_hashes_content ON media_hashes (content_hash);
+
+CREATE TABLE IF NOT EXISTS probe_cache (
+    path      TEXT PRIMARY KEY,
+    size      INTEGER NOT NULL,
+    mtime     REAL NOT NULL,
+    info      TEXT NOT NULL,
+    probed_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS encode_stats (
+    post_id      TEXT,
+    input_class  TEXT,
+    preset       TEXT,
+    pixels       INTEGER,
+    duration     REAL,
+    threads      INTEGER,
+    wall_seconds REAL,
+    cpu_seconds  REAL,
+    peak_rss     INTEGER,
+    created_at   REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS subreddit_cursors (
+    subreddit        TEXT NOT NULL,
+    sort             TEXT NOT NULL,
+    last_fullname    TEXT,
+    last_created_utc REAL,
+    fetched_at       REAL NOT NULL,
+    PRIMARY KEY (subreddit, sort)
+);
+
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    job_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id    TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    account    TEXT NOT NULL,
+    due_at     REAL NOT NULL,
+    status     TEXT NOT NULL DEFAULT 'pending',
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    UNIQUE (post_id, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_due ON upload_jobs (status, due_at);
+
+CREATE TABLE IF NOT EXISTS manifest_cursors (
+    consumer    TEXT PRIMARY KEY,
+    byte_offset INTEGER NOT NULL,
+    updated_at  REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    account    TEXT PRIMARY KEY,
+    tokens     REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS work_queue (
+    task_id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage            TEXT NOT NULL,
+    post_id          TEXT NOT NULL,
+    payload          TEXT NOT NULL,
+    status           TEXT NOT NULL DEFAULT 'queued',
+    lease_owner      TEXT,
+    lease_expires_at REAL,
+    available_at     REAL NOT NULL,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    last_error       TEXT,
+    created_at       REAL NOT NULL,
+    updated_at       REAL NOT NULL,
+    UNIQUE (stage, post_id)
+);
+CREATE INDEX IF NOT EXISTS idx_work_queue_stage ON work_queue (stage, status, available_at);
+
+CREATE TABLE IF NOT EXISTS breakers (
+    upstream     TEXT PRIMARY KEY,
+    failures     INTEGER NOT NULL DEFAULT 0,
+    opened_until REAL NOT NULL DEFAULT 0,
+    last_error   TEXT,
+    updated_at   REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS dead_letters (
+    post_id    TEXT NOT NULL,
+    stage      TEXT NOT NULL,
+    attempts   INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at  REAL NOT NULL,
+    PRIMARY KEY (post_id, stage)
+);
+"""
+
+# Columns added after the first release, applied to databases created before them.
+ADDED_COLUMNS = {
+    "items": {
+        "duplicate_of": "TEXT",
+        "download_bytes": "INTEGER",
+        "download_seconds": "REAL",
+        "filter_preset": "TEXT",
+        "encode_profile": "TEXT",
+        "output_bytes": "INTEGER",
+        "output_kbps": "REAL",
+        "cover_path": "TEXT",
+        "reddit_score": "INTEGER",
+        "upvote_ratio": "REAL",
+        "num_comments": "INTEGER",
+        "created_utc": "REAL",
+        "rank_score": "REAL",
+        "rank_features": "TEXT",
+    },
+    "work_queue": {
+        "priority": "REAL NOT NULL DEFAULT 0",
+        "lease_token": "TEXT",
+    },
+    "media_hashes": {
+        "duration": "REAL",
+        "aspect": "REAL",
+    },
+}
+
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+# -------------------- Connection Handling --------------------
+def get_connection():
+    """Returns this thread's connection, creating the schema on first use."""
+    conn = getattr(_local, "conn", None)
+    # A forked worker process inherits the parent's thread-local; never share a connection across processes.
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+
+    is_new = not os.path.exists(STATE_DB)
+    conn = sqlite3.connect(STATE_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    with _init_lock:
+        if STATE_DB not in _initialized:
+            conn.executescript(SCHEMA)
+            _add_missing_columns(conn)
+            if is_new:
+                import_legacy_logs(conn)
+            _initialized.add(STATE_DB)
+
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+def _add_missing_columns(conn):
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+    conn.commit()
+
+def _write(sql, params=()):
+    conn = get_connection()
+    with conn:
+        return conn.execute(sql, params).rowcount
+
+# -------------------- Stage Transitions --------------------
+def add_discovered(post_id, subreddit, title, reddit_url):
+    """Registers a post. Returns False if it was already known."""
+    return _write(
+        "INSERT OR IGNORE INTO items (post_id, subreddit, title, reddit_url, state, discovered_at) "
+        "VALUES (?, ?, ?, ?, 'discovered', ?)",
+        (post_id, subreddit, title, reddit_url, time.time())
+    ) > 0
+
+def mark_downloaded(post_id, raw_path, download_bytes=None, download_seconds=None):
+    _write(
+        "UPDATE items SET state = 'downloaded', raw_path = ?, downloaded_at = ?, "
+        "download_bytes = ?, download_seconds = ? WHERE post_id = ?",
+        (raw_path, time.time(), download_bytes, download_seconds, post_id)
+    )
+
+def mark_formatted(post_id, output_path, filter_preset=None, encode_profile=None, output_bytes=None, output_kbps=None,
+                   cover_path=None):
+    _write(
+        "UPDATE items SET state = 'formatted', output_path = ?, formatted_at = ?, filter_preset = ?, "
+        "encode_profile = ?, output_bytes = ?, output_kbps = ?, cover_path = ? WHERE post_id = ?",
+        (output_path, time.time(), filter_preset, encode_profile, output_bytes, output_kbps, cover_path, post_id)
+    )
+
+def mark_uploaded(post_id, media_id):
+    _write(
+        "UPDATE items SET state = 'uploaded', media_id = ?, uploaded_at = ? WHERE post_id = ?",
+        (str(media_id), time.time(), post_id)
+    )
+
+def mark_commented(post_id):
+    _write(
+        "UPDATE items SET state = 'commented', commented_at = ? WHERE post_id = ?",
+        (time.time(), post_id)
+    )
+
+def mark_duplicate(post_id, duplicate_of):
+    _write(
+        "UPDATE items SET state = ?, duplicate_of = ? WHERE post_id = ?",
+        (DUPLICATE, duplicate_of, post_id)
+    )
+
+def mark_passed_over(post_id):
+    _write("UPDATE items SET state = ? WHERE post_id = ? AND state = 'downloaded'", (PASSED_OVER, post_id))
+
+# -------------------- Ranking --------------------
+def set_listing_signals(post_id, reddit_score, upvote_ratio, num_comments, created_utc):
+    _write(
+        "UPDATE items SET reddit_score = ?, upvote_ratio = ?, num_comments = ?, created_utc = ? WHERE post_id = ?",
+        (reddit_score, upvote_ratio, num_comments, created_utc, post_id)
+    )
+
+def set_rank(post_id, rank_score, rank_features):
+    _write("UPDATE items SET rank_score = ?, rank_features = ? WHERE post_id = ?", (rank_score, rank_features, post_id))
+
+# -------------------- Media Hashes --------------------
+def add_media_hash(post_id, content_hash, phash, duration=None, aspect=None):
+    _write(
+        "INSERT OR REPLACE INTO media_hashes (post_id, content_hash, phash, duration, aspect, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (post_id, content_hash, phash, duration, aspect, time.time())
+    )
+
+def has_media_hash(post_id):
+    return get_connection().execute("SELECT 1 FROM media_hashes WHERE post_id = ?", (post_id,)).fetchone() is not None
+
+def find_content_hash(content_hash, exclude_post_id=None):
+    """Returns the post ID that already owns this exact file, if any."""
+    row = get_connection().execute(
+        "SELECT post_id FROM media_hashes WHERE content_hash = ? AND post_id != ? LIMIT 1",
+        (content_hash, exclude_post_id or "")
+    ).fetchone()
+    return row[0] if row else None
+
+def all_perceptual_hashes():
+    return get_connection().execute(
+        "SELECT post_id, phash, duration, aspect FROM media_hashes WHERE phash IS NOT NULL ORDER BY rowid"
+    ).fetchall()
+
+# -------------------- Seen Posts --------------------
+def mark_seen(post_id, crosspost_parent_id=None):
+    """Remembers a downloaded post and the post it was crossposted from, if any."""
+    now = time.time()
+    conn = get_connection()
+    with conn:
+        for seen_id in filter(None, (post_id, crosspost_parent_id)):
+            conn.execute(
+                "INSERT OR IGNORE INTO seen_posts (post_id, source_id, seen_at) VALUES (?, ?, ?)",
+                (seen_id, post_id, now)
+            )
+
+def is_seen(*post_ids):
+    """True if any of the given IDs was already downloaded, directly or through a crosspost."""
+    post_ids = [p for p in post_ids if p]
+    if not post_ids:
+        return False
+    placeholders = ",".join("?" * len(post_ids))
+    row = get_connection().execute(
+        f"SELECT 1 FROM seen_posts WHERE post_id IN ({placeholders}) "
+        f"UNION ALL SELECT 1 FROM items WHERE post_id IN ({placeholders}) AND state != 'discovered' "
+        "LIMIT 1",
+        post_ids + post_ids
+    ).fetchone()
+    return row is not None
+
+# -------------------- Probe Cache --------------------
+def get_probe(path, size, mtime):
+    """Returns the cached ffprobe JSON for this exact file version, or None."""
+    row = get_connection().execute(
+        "SELECT info FROM probe_cache WHERE path = ? AND size = ? AND mtime = ?", (path, size, mtime)
+    ).fetchone()
+    return row[0] if row else None
+
+def put_probe(path, size, mtime, info):
+    _write(
+        "INSERT OR REPLACE INTO probe_cache (path, size, mtime, info, probed_at) VALUES (?, ?, ?, ?, ?)",
+        (path, size, mtime, info, time.time())
+    )
+
+# -------------------- Encode Stats --------------------
+def add_encode_stats(post_id, input_class, preset, pixels, duration, threads, wall_seconds, cpu_seconds, peak_rss):
+    _write(
+        "INSERT INTO encode_stats (post_id, input_class, preset, pixels, duration, threads, "
+        "wall_seconds, cpu_seconds, peak_rss, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (post_id, input_class, preset, pixels, duration, threads, wall_seconds, cpu_seconds, peak_rss, time.time())
+    )
+
+def recent_encode_stats(limit):
+    return get_connection().execute(
+        "SELECT * FROM encode_stats ORDER BY rowid DESC LIMIT ?", (limit,)
+    ).fetchall()
+
+# -------------------- Listing Cursors --------------------
+def get_cursor(subreddit, sort):
+    """Returns the high-water mark row for a subreddit listing, or None on first fetch."""
+    return get_connection().execute(
+        "SELECT * FROM subreddit_cursors WHERE subreddit = ? AND sort = ?", (subreddit, sort)
+    ).fetchone()
+
+def update_cursor(subreddit, sort, last_fullname, last_created_utc):
+    """Moves the high-water mark forward; an older or missing post never moves it back."""
+    _write(
+        "INSERT INTO subreddit_cursors (subreddit, sort, last_fullname, last_created_utc, fetched_at) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (subreddit, sort) DO UPDATE SET fetched_at = excluded.fetched_at, "
+        "last_fullname = CASE WHEN excluded.last_created_utc > IFNULL(last_created_utc, 0) "
+        "THEN excluded.last_fullname ELSE last_fullname END, "
+        "last_created_utc = MAX(IFNULL(last_created_utc, 0), IFNULL(excluded.last_created_utc, 0))",
+        (subreddit, sort, last_fullname, last_created_utc, time.time())
+    )
+
+# -------------------- Upload Schedule --------------------
+def add_upload_job(post_id, kind, account, due_at):
+    """Plans an 'upload' or 'comment' job. Returns False if the post already has one of that kind."""
+    return _write(
+        "INSERT OR IGNORE INTO upload_jobs (post_id, kind, account, due_at, created_at) VALUES (?, ?, ?, ?, ?)",
+        (post_id, kind, account, due_at, time.time())
+    ) > 0
+
+def last_planned_upload(account):
+    """Latest planned or finished upload time for the account, or None."""
+    row = get_connection().execute(
+        "SELECT MAX(due_at) FROM upload_jobs WHERE account = ? AND kind = 'upload' AND status != 'failed'", (account,)
+    ).fetchone()
+    return row[0]
+
+def due_upload_jobs(now, account=None):
+    sql = "SELECT * FROM upload_jobs WHERE status = 'pending' AND due_at <= ?"
+    params = [now]
+    if account:
+        sql += " AND account = ?"
+        params.append(account)
+    return get_connection().execute(sql + " ORDER BY due_at", params).fetchall()
+
+def next_upload_due(kind=None, account=None):
+    sql = "SELECT MIN(due_at) FROM upload_jobs WHERE status = 'pending'"
+    params = []
+    if kind:
+        sql += " AND kind = ?"
+        params.append(kind)
+    if account:
+        sql += " AND account = ?"
+        params.append(account)
+    return get_connection().execute(sql, params).fetchone()[0]
+
+def update_upload_job(job_id, status, due_at=None, error=None, attempted=True):
+    _write(
+        "UPDATE upload_jobs SET status = ?, due_at = IFNULL(?, due_at), last_error = ?, "
+        "attempts = attempts + ? WHERE job_id = ?",
+        (status, due_at, error, 1 if attempted else 0, job_id)
+    )
+
+def pending_uploads_by_rank(account):
+    """The account's pending upload jobs that have not failed yet, best-ranked clip first."""
+    return get_connection().execute(
+        "SELECT j.* FROM upload_jobs j JOIN items i ON i.post_id = j.post_id "
+        "WHERE j.account = ? AND j.kind = 'upload' AND j.status = 'pending' AND j.attempts = 0 "
+        "ORDER BY IFNULL(i.rank_score, 0) DESC, j.due_at",
+        (account,)
+    ).fetchall()
+
+def swap_upload_slots(job_a, job_b):
+    """Exchanges two jobs' planned times."""
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE upload_jobs SET due_at = ? WHERE job_id = ?", (job_b["due_at"], job_a["job_id"]))
+        conn.execute("UPDATE upload_jobs SET due_at = ? WHERE job_id = ?", (job_a["due_at"], job_b["job_id"]))
+
+def get_bucket(account):
+    return get_connection().execute("SELECT * FROM rate_buckets WHERE account = ?", (account,)).fetchone()
+
+def put_bucket(account, tokens, updated_at):
+    _write(
+        "INSERT OR REPLACE INTO rate_buckets (account, tokens, updated_at) VALUES (?, ?, ?)",
+        (account, tokens, updated_at)
+    )
+
+# -------------------- Manifest Cursors --------------------
+def get_manifest_cursor(consumer):
+    row = get_connection().execute(
+        "SELECT byte_offset FROM manifest_cursors WHERE consumer = ?", (consumer,)
+    ).fetchone()
+    return row[0] if row else None
+
+def set_manifest_cursor(consumer, byte_offset):
+    _write(
+        "INSERT OR REPLACE INTO manifest_cursors (consumer, byte_offset, updated_at) VALUES (?, ?, ?)",
+        (consumer, byte_offset, time.time())
+    )
+
+# -------------------- Work Queue --------------------
+def add_work(stage, post_id, payload, priority=0, status="queued"):
+    """Queues a task ('deferred' ones wait to be let in). Returns False if the post already has a task for this stage."""
+    now = time.time()
+    return _write(
+        "INSERT OR IGNORE INTO work_queue (stage, post_id, payload, status, priority, available_at, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (stage, post_id, payload, status, priority, now, now, now)
+    ) > 0
+
+def lease_work(stage, owner, lease_seconds, max_attempts, limit=1):
+    """
+    Atomically hands up to `limit` tasks to `owner`: queued ones that are due, and leased
+    ones whose holder stopped renewing. Leases that expired `max_attempts` times are given up.
+    Every lease gets a fresh `lease_token`; only its holder can renew or settle it, so a
+    thread whose lease expired cannot settle a task another thread of the same node now holds.
+    """
+    conn = get_connection()
+    now = time.time()
+    with conn:
+        # Takes the write lock up front, so two nodes can never lease the same row.
+        conn.execute("BEGIN IMMEDIATE")
+        expired = "stage = ? AND status = 'leased' AND lease_expires_at < ? AND attempts >= ?"
+        conn.execute(
+            "INSERT OR REPLACE INTO dead_letters (post_id, stage, attempts, last_error, failed_at) "
+            f"SELECT post_id, stage, attempts, 'lease expired after the last attempt', ? FROM work_queue WHERE {expired}",
+            (now, stage, now, max_attempts)
+        )
+        conn.execute(
+            "UPDATE work_queue SET status = 'failed', lease_owner = NULL, lease_token = NULL, updated_at = ?, "
+            f"last_error = 'lease expired after the last attempt' WHERE {expired}",
+            (now, stage, now, max_attempts)
+        )
+        ids = [row[0] for row in conn.execute(
+            "SELECT task_id FROM work_queue WHERE stage = ? AND "
+            "((status = 'queued' AND available_at <= ?) OR (status = 'leased' AND lease_expires_at < ?)) "
+            "ORDER BY priority DESC, available_at, task_id LIMIT ?",
+            (stage, now, now, limit)
+        )]
+        if not ids:
+            return []
+        conn.executemany(
+            "UPDATE work_queue SET status = 'leased', lease_owner = ?, lease_token = ?, lease_expires_at = ?, "
+            "attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+            [(owner, uuid.uuid4().hex, now + lease_seconds, now, task_id) for task_id in ids]
+        )
+        placeholders = ",".join("?" * len(ids))
+        return conn.execute(f"SELECT * FROM work_queue WHERE task_id IN ({placeholders}) ORDER BY task_id", ids).fetchall()
+
+def renew_leases(lease_tokens, lease_expires_at):
+    """Extends the leases with these tokens. Returns the tokens still held; the others were taken over after expiring."""
+    if not lease_tokens:
+        return set()
+    conn = get_connection()
+    placeholders = ",".join("?" * len(lease_tokens))
+    with conn:
+        conn.execute(
+            f"UPDATE work_queue SET lease_expires_at = ?, updated_at = ? "
+            f"WHERE lease_token IN ({placeholders}) AND status = 'leased'",
+            (lease_expires_at, time.time(), *lease_tokens)
+        )
+        return {row[0] for row in conn.execute(
+            f"SELECT lease_token FROM work_queue WHERE lease_token IN ({placeholders}) AND status = 'leased'",
+            tuple(lease_tokens)
+        )}
+
+def settle_work(task_id, lease_token, status, error=None, available_at=None, refund_attempt=False):
+    """Ends the lease with this token with a new status. Returns False if the lease had already passed to someone else."""
+    return _write(
+        "UPDATE work_queue SET status = ?, lease_owner = NULL, lease_token = NULL, lease_expires_at = NULL, last_error = ?, "
+        "available_at = IFNULL(?, available_at), attempts = attempts - ?, updated_at = ? "
+        "WHERE task_id = ? AND lease_token = ? AND status = 'leased'",
+        (status, error, available_at, 1 if refund_attempt else 0, time.time(), task_id, lease_token)
+    ) > 0
+
+def waiting_work(stage):
+    """Queued, deferred and leased tasks of a stage, joined with their items' subreddit and rank."""
+    return get_connection().execute(
+        "SELECT w.task_id, w.post_id, w.status, w.priority, i.subreddit, i.rank_score, i.rank_features, "
+        "i.reddit_score, i.upvote_ratio, i.num_comments, i.created_utc, i.downloaded_at, i.raw_path "
+        "FROM work_queue w JOIN items i ON i.post_id = w.post_id "
+        "WHERE w.stage = ? AND w.status IN ('queued', 'deferred', 'leased')",
+        (stage,)
+    ).fetchall()
+
+def set_work_status(task_ids, status):
+    """Moves waiting tasks between 'queued' and 'deferred' (or to 'done'); leased ones are never touched."""
+    if not task_ids:
+        return 0
+    placeholders = ",".join("?" * len(task_ids))
+    return _write(
+        f"UPDATE work_queue SET status = ?, updated_at = ? WHERE task_id IN ({placeholders}) "
+        f"AND status IN ('queued', 'deferred')",
+        (status, time.time(), *task_ids)
+    )
+
+def set_work_priority(task_id, priority):
+    _write("UPDATE work_queue SET priority = ? WHERE task_id = ?", (priority, task_id))
+
+def formatted_counts_since(since):
+    """{subreddit: clips formatted since `since`}, including those already posted."""
+    rows = get_connection().execute(
+        "SELECT subreddit, COUNT(*) FROM items WHERE formatted_at >= ? GROUP BY subreddit", (since,)
+    ).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+def work_counts(stage):
+    """{status: count} for one stage, with expired leases counted as queued."""
+    rows = get_connection().execute(
+        "SELECT CASE WHEN status = 'leased' AND lease_expires_at < ? THEN 'queued' ELSE status END, COUNT(*) "
+        "FROM work_queue WHERE stage = ? GROUP BY 1",
+        (time.time(), stage)
+    ).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+def ready_work_count(stage):
+    """Tasks of a stage that could be leased right now: queued and due, or leased with an expired lease."""
+    now = time.time()
+    return get_connection().execute(
+        "SELECT COUNT(*) FROM work_queue WHERE stage = ? AND "
+        "((status = 'queued' AND available_at <= ?) OR (status = 'leased' AND lease_expires_at < ?))",
+        (stage, now, now)
+    ).fetchone()[0]
+
+def requeue_work(stage, post_id):
+    """Gives a parked task a fresh set of attempts. Returns False if there is no such task."""
+    now = time.time()
+    return _write(
+        "UPDATE work_queue SET status = 'queued', attempts = 0, lease_owner = NULL, lease_token = NULL, lease_expires_at = NULL, "
+        "available_at = ?, updated_at = ? WHERE stage = ? AND post_id = ?",
+        (now, now, stage, post_id)
+    ) > 0
+
+def requeue_upload_job(post_id, kind):
+    return _write(
+        "UPDATE upload_jobs SET status = 'pending', attempts = 0, due_at = ? WHERE post_id = ? AND kind = ?",
+        (time.time(), post_id, kind)
+    ) > 0
+
+# -------------------- Breakers and Dead Letters --------------------
+def get_breaker(upstream):
+    return get_connection().execute("SELECT * FROM breakers WHERE upstream = ?", (upstream,)).fetchone()
+
+def put_breaker(upstream, failures, opened_until, last_error):
+    _write(
+        "INSERT OR REPLACE INTO breakers (upstream, failures, opened_until, last_error, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (upstream, failures, opened_until, last_error, time.time())
+    )
+
+def open_breakers():
+    return get_connection().execute("SELECT * FROM breakers WHERE opened_until > ?", (time.time(),)).fetchall()
+
+def add_dead_letter(post_id, stage, attempts, last_error):
+    _write(
+        "INSERT OR REPLACE INTO dead_letters (post_id, stage, attempts, last_error, failed_at) VALUES (?, ?, ?, ?, ?)",
+        (post_id, stage, attempts, last_error, time.time())
+    )
+
+def dead_letters(stage=None):
+    sql, params = "SELECT * FROM dead_letters", []
+    if stage:
+        sql += " WHERE stage = ?"
+        params.append(stage)
+    return get_connection().execute(sql + " ORDER BY failed_at", params).fetchall()
+
+def remove_dead_letter(post_id, stage):
+    _write("DELETE FROM dead_letters WHERE post_id = ? AND stage = ?", (post_id, stage))
+
+# -------------------- Queries --------------------
+def get_item(post_id):
+    return get_connection().execute("SELECT * FROM items WHERE post_id = ?", (post_id,)).fetchone()
+
+def items_by_path(column, paths):
+    """{path: row} for the items whose raw_path or output_path (`column`) is one of `paths`."""
+    if column not in ("raw_path", "output_path"):
+        raise ValueError(column)
+    found = {}
+    paths = list(paths)
+    # Stay under SQLite's bound-parameter limit.
+    for start in range(0, len(paths), 500):
+        chunk = paths[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for row in get_connection().execute(f"SELECT * FROM items WHERE {column} IN ({placeholders})", chunk):
+            found[row[column]] = row
+    return found
+
+def items_in_state(state, subreddit=None, limit=None):
+    """Returns only the rows currently sitting in `state`, oldest first."""
+    sql = "SELECT * FROM items WHERE state = ?"
+    params = [state]
+    if subreddit:
+        sql += " AND subreddit = ?"
+        params.append(subreddit)
+    sql += " ORDER BY rowid"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return get_connection().execute(sql, params).fetchall()
+
+def state_counts():
+    rows = get_connection().execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()
+    return {row[0]: row[1] for row in rows}
+
+# -------------------- Legacy CSV Import --------------------
+def _post_id_from_url(url):
+    match = re.search(r"/comments/([a-z0-9]+)", url or "")
+    return match.group(1) if match else None
+
+def _read_csv_rows(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [row for row in reader if row]
+
+def import_legacy_logs(conn):
+    """
+    Seeds a fresh database from video_log.csv, video_format_log.csv and upload_log.csv
+    so nothing that was already downloaded, formatted or uploaded gets redone.
+    """
+    if not os.path.exists(LEGACY_DOWNLOAD_LOG):
+        return
+    from slugify import slugify
+
+    now = time.time()
+    raw_to_post = {}
+    with conn:
+        for row in _read_csv_rows(LEGACY_DOWNLOAD_LOG):
+            if len(row) < 3:
+                continue
+            subreddit, title, url = row[0], row[1], row[2]
+            post_id = _post_id_from_url(url)
+            if not post_id:
+                continue
+            raw_path = os.path.join("downloaded_videos", slugify(subreddit), f"{slugify(title)[:100]}.mp4")
+            raw_to_post[raw_path] = post_id
+            conn.execute(
+                "INSERT OR IGNORE INTO items (post_id, subreddit, title, reddit_url, state, raw_path, discovered_at, downloaded_at) "
+                "VALUES (?, ?, ?, ?, 'downloaded', ?, ?, ?)",
+                (post_id, subreddit, title, url, raw_path, now, now)
+            )
+
+        output_to_post = {}
+        for row in _read_csv_rows(LEGACY_FORMAT_LOG):
+            post_id = raw_to_post.get(row[0])
+            if post_id and len(row) > 1:
+                output_to_post[row[1]] = post_id
+                conn.execute(
+                    "UPDATE items SET state = 'formatted', output_path = ?, formatted_at = ? WHERE post_id = ?",
+                    (row[1], now, post_id)
+                )
+
+        # The old uploader commented inline right after each upload.
+        for row in _read_csv_rows(LEGACY_UPLOAD_LOG):
+            post_id = output_to_post.get(row[1]) if len(row) > 1 else None
+            if post_id:
+                conn.execute(
+                    "UPDATE items SET state = 'commented', uploaded_at = ?, commented_at = ? WHERE post_id = ?",
+                    (now, now, post_id)
+                )
@@ -0,0 +1,119 @@
+# --- START OF FILE storage.py (Storage Budget Manager) ---
+
+import os
+import time
+import logging
+import threading
+import state_db
+import profiles
+
+# -------------------- Settings --------------------
+RAW_DIR = os.getenv("INPUT_VIDEO_DIR", "downloaded_videos")
+OUTPUT_DIR = os.getenv("OUTPUT_VIDEO_DIR", "ready_to_post")
+# Byte budget per directory; 0 means no limit.
+RAW_BUDGET_BYTES = int(float(os.getenv("RAW_BUDGET_MB", "0")) * 1024 * 1024)
+OUTPUT_BUDGET_BYTES = int(float(os.getenv("OUTPUT_BUDGET_MB", "0")) * 1024 * 1024)
+# Long-running stages check at most this often.
+STORAGE_CHECK_SECONDS = float(os.getenv("STORAGE_CHECK_SECONDS", "60"))
+
+UPLOADED_STATES = ("uploaded", "commented")
+
+_lock = threading.Lock()
+_totals = {"checked_at": 0.0, "reclaimed": 0}
+
+# -------------------- Eviction Policy --------------------
+def eviction_priority(item, is_raw):
+    """
+    0: the clip is already on Instagram, so both its files can go first.
+    1: a raw file that is no longer needed (its vertical output exists, or it was a duplicate or passed over).
+    None: still needed, never deleted.
+    """
+    if item is None:
+        return None
+    if item["state"] in UPLOADED_STATES:
+        return 0
+    if is_raw and item["state"] in (state_db.DUPLICATE, state_db.PASSED_OVER):
+        return 1
+    if is_raw and item["state"] == "formatted" and item["output_path"] and os.path.exists(item["output_path"]):
+        return 1
+    return None
+
+def list_files(root):
+    """[(path, size, last_used)] for every file under root; last_used is the later of access and modification time."""
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((path, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+    return files
+
+def _remove(path):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+# -------------------- Enforcement --------------------
+def enforce_budget(root, budget, is_raw):
+    """
+    Deletes evictable files under root, least recently used first within each priority,
+    until the directory fits its budget. State rows and media hashes are kept.
+    Returns (bytes reclaimed, bytes still used).
+    """
+    files = list_files(root)
+    used = sum(size for _, size, _ in files)
+    if not budget or used <= budget:
+        return 0, used
+
+    column = "raw_path" if is_raw else "output_path"
+    items = state_db.items_by_path(column, [path for path, _, _ in files])
+    candidates = sorted(
+        (priority, last_used, path)
+        for path, _, last_used in files
+        for priority in [eviction_priority(items.get(path), is_raw)]
+        if priority is not None
+    )
+
+    reclaimed = 0
+    for _, _, path in candidates:
+        if used - reclaimed <= budget:
+            break
+        reclaimed += _remove(path)
+        if not is_raw:
+            reclaimed += _remove(profiles.cover_path_for(path))
+    if used - reclaimed > budget:
+        logging.warning(f"{root} is still {(used - reclaimed - budget) / 1e6:.1f} MB over budget; nothing else is safe to delete.")
+    return reclaimed, used - reclaimed
+
+def enforce_budgets(stage=""):
+    """Brings every budgeted directory under its limit. Returns the total bytes reclaimed."""
+    with _lock:
+        _totals["checked_at"] = time.monotonic()
+        total = 0
+        for root, budget, is_raw in ((OUTPUT_DIR, OUTPUT_BUDGET_BYTES, False), (RAW_DIR, RAW_BUDGET_BYTES, True)):
+            if not budget or not os.path.isdir(root):
+                continue
+            reclaimed, used = enforce_budget(root, budget, is_raw)
+            total += reclaimed
+            if reclaimed:
+                msg = f"🧹 {stage + ': ' if stage else ''}reclaimed {reclaimed / 1e6:.1f} MB in '{root}' ({used / 1e6:.1f} of {budget / 1e6:.1f} MB used)."
+                print(msg)
+                logging.info(msg)
+        _totals["reclaimed"] += total
+        return total
+
+def reclaimed_total():
+    """Bytes reclaimed by this process so far."""
+    return _totals["reclaimed"]
+
+def maybe_enforce(stage=""):
+    """enforce_budgets(), at most once every STORAGE_CHECK_SECONDS; for calls before every item."""
+    if time.monotonic() - _totals["checked_at"] < STORAGE_CHECK_SECONDS:
+        return 0
+    return enforce_budgets(stage)
@@ -0,0 +1,93 @@
+# --- START OF FILE streaming.py (Download-to-Encode Streaming) ---
+
+import os
+import logging
+import downloader
+import profiles
+import scheduler
+import state_db
+import enhance_cli
+
+# -------------------- Settings --------------------
+# Protocols ffmpeg can read straight from the network as the bytes arrive.
+STREAMABLE_PROTOCOLS = ("http", "https", "m3u8", "m3u8_native")
+# yt_dlp reports codec tags (avc1.64001f); probe.py and profiles.py expect ffprobe's names.
+CODEC_NAMES = {"avc1": "h264", "avc3": "h264", "hev1": "hevc", "hvc1": "hevc", "vp09": "vp9", "mp4a": "aac"}
+
+# -------------------- Format Selection --------------------
+def _codec(name):
+    if not name or name == "none":
+        return None
+    base = name.split(".")[0].lower()
+    return CODEC_NAMES.get(base, base)
+
+def _streamable(f):
+    return f.get("protocol") in STREAMABLE_PROTOCOLS and f.get("url") and f.get("width") and f.get("height")
+
+def select_stream_format(formats):
+    """
+    One format that carries everything the clip needs, or None when audio and video
+    only come as separate DASH streams and have to be downloaded and merged first.
+    """
+    combined = [f for f in formats if f.get("vcodec") != "none" and f.get("acodec") != "none" and _streamable(f)]
+    if combined:
+        return downloader.pick_video(combined)
+    video_only = [f for f in formats if f.get("vcodec") != "none" and f.get("acodec") == "none"]
+    audio_only = [f for f in formats if f.get("acodec") != "none" and f.get("vcodec") == "none"]
+    if audio_only or not video_only:
+        return None
+    # A silent clip: the lone video stream is all there is.
+    candidates = [f for f in video_only if _streamable(f)]
+    return downloader.pick_video(candidates) if candidates else None
+
+def stream_info(fmt, duration):
+    """The probe.probe() summary, built from yt_dlp's metadata instead of a local file."""
+    return {
+        "width": int(fmt["width"]),
+        "height": int(fmt["height"]),
+        "rotation": 0,
+        "duration": float(duration or fmt.get("duration") or 0),
+        "vcodec": _codec(fmt.get("vcodec")),
+        # Unknown without decoding, which also keeps streamed sources off the stream-copy path.
+        "pix_fmt": None,
+        "acodec": _codec(fmt.get("acodec")),
+        "bit_rate": int((fmt.get("tbr") or 0) * 1000),
+    }
+
+# -------------------- Streaming Encode --------------------
+def stream_and_format(post_id, url, raw_path, preset=None, profile=None):
+    """
+    Encodes a post straight from its media URL into the vertical output, without writing
+    `raw_path`. Returns the output path, or None when the caller should fall back to the
+    download-then-format path (DASH merge needed, metadata incomplete, or the encode failed).
+    """
+    ydl, _ = downloader.get_downloader()
+    try:
+        meta = ydl.extract_info(url, download=False)
+    except Exception as e:
+        logging.warning(f"Could not resolve {url} for streaming: {e}")
+        return None
+    fmt = select_stream_format(meta.get("formats") or [meta])
+    if fmt is None:
+        return None
+
+    info = stream_info(fmt, meta.get("duration"))
+    output_path = enhance_cli.output_path_for(raw_path)
+    preset = preset or enhance_cli.preset_for(os.path.basename(os.path.dirname(raw_path)))
+    job = scheduler.make_job(post_id, fmt["url"], output_path, preset, info, profiles.resolve(profile))
+    cover_path = profiles.cover_path_for(output_path)
+
+    scheduler.acquire(job)
+    result = None
+    try:
+        result = enhance_cli.process_video(fmt["url"], output_path, preset, info, job["threads"], job["profile"], cover_path)
+    finally:
+        scheduler.release(job, result[2] if result else None)
+    if not result:
+        # process_video() has already removed its temp files; nothing was written under the real names.
+        return None
+
+    # Never had a raw file: the item goes from discovered straight through downloaded to formatted.
+    state_db.mark_downloaded(post_id, None, download_seconds=result[2]["wall_seconds"])
+    enhance_cli.record_formatted(post_id, output_path, preset, job["profile"], info)
+    return output_path
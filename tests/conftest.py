@@ -0,0 +1,31 @@
+# --- START OF FILE tests/conftest.py (Shared Test Fixtures) ---
+
+import os
+import sys
+import pytest
+
+# The pipeline is a set of flat modules in the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import state_db
+
+@pytest.fixture(autouse=True)
+def state_store(tmp_path, monkeypatch):
+    """Every test gets its own empty pipeline_state.db and runs in a scratch folder."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(state_db, "STATE_DB", str(tmp_path / "pipeline_state.db"))
+    state_db._local.conn = None
+    yield state_db
+    conn = getattr(state_db._local, "conn", None)
+    if conn is not None:
+        conn.close()
+    state_db._local.conn = None
+
+def add_item(post_id, subreddit="valorant", state=None, **columns):
+    """Inserts an item row the way reddit.py records a discovered post, then applies extra columns."""
+    state_db.add_discovered(post_id, subreddit, f"Clip {post_id}", f"https://www.reddit.com/r/{subreddit}/comments/{post_id}/")
+    if state:
+        columns["state"] = state
+    if columns:
+        assignments = ", ".join(f"{name} = ?" for name in columns)
+        state_db._write(f"UPDATE items SET {assignments} WHERE post_id = ?", (*columns.values(), post_id))
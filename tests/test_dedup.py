@@ -0,0 +1,64 @@
+# --- START OF FILE tests/test_dedup.py (Duplicate Clip Detection) ---
+
+import pytest
+
+np = pytest.importorskip("numpy")
+import dedup
+import state_db
+from conftest import add_item
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    monkeypatch.setattr(dedup, "_index", None)
+    monkeypatch.setattr(dedup, "PHASH_SAMPLES", 4)
+
+def phash(*frames):
+    return np.array(frames, dtype=np.uint64)
+
+BASE = phash(0x0F0F0F0F0F0F0F0F, 0x00FF00FF00FF00FF, 0x3333333333333333, 0x5555555555555555)
+
+def register(post_id, hashes, content=None, duration=30.0, aspect=16 / 9):
+    add_item(post_id, state="downloaded")
+    return dedup.register(post_id, f"{post_id}.mp4", (content or f"sha-{post_id}", hashes, duration, aspect))
+
+def test_exact_copy_is_a_duplicate():
+    assert register("a", BASE, content="same") is None
+    assert register("b", phash(1, 2, 3, 4), content="same") == "a"
+    assert state_db.get_item("b")["state"] == state_db.DUPLICATE
+
+def test_reencoded_copy_is_a_duplicate():
+    register("a", BASE)
+    # A few bits flipped in every frame, as after a re-encode.
+    assert register("b", BASE ^ np.uint64(0b111), duration=30.4) == "a"
+
+def test_different_length_is_not_a_duplicate():
+    register("a", BASE)
+    assert register("b", BASE, duration=36.0) is None
+
+def test_different_shape_is_not_a_duplicate():
+    register("a", BASE, aspect=1920 / 1080)
+    assert register("b", BASE, aspect=720 / 720) is None
+    assert register("c", BASE, aspect=1280 / 720) == "a"
+
+def test_one_far_frame_is_not_a_duplicate():
+    register("a", BASE)
+    far = BASE.copy()
+    far[0] ^= np.uint64(0xFFFF)  # 16 bits in one frame: total is low, but the frame is not close.
+    assert register("b", far) is None
+
+def test_legacy_hashes_without_duration_or_shape_never_match_perceptually():
+    state_db.add_media_hash("old", "sha-old", BASE.tobytes())
+    assert register("b", BASE) is None
+
+def test_index_is_rebuilt_from_the_state_store(monkeypatch):
+    register("a", BASE)
+    monkeypatch.setattr(dedup, "_index", None)
+    assert register("b", BASE ^ np.uint64(1)) == "a"
+
+def test_drop_duplicates_keeps_preset_tasks_and_catches_batch_duplicates(monkeypatch):
+    hashes = {"a.mp4": ("sha-a", BASE, 30.0, 16 / 9), "b.mp4": ("sha-b", BASE, 30.0, 16 / 9)}
+    monkeypatch.setattr(dedup, "compute_hashes", lambda path: hashes[path])
+    for post_id in ("a", "b"):
+        add_item(post_id, state="downloaded")
+    tasks = [("a", "a.mp4", "a_vertical.mp4", "fast"), ("b", "b.mp4", "b_vertical.mp4", "fast")]
+    assert dedup.drop_duplicates(tasks) == tasks[:1]
@@ -0,0 +1,54 @@
+# --- START OF FILE tests/test_enhance_cli.py (Format Task Leasing) ---
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("numpy")
+pytest.importorskip("psutil")
+import scheduler
+import state_db
+import work_queue
+from conftest import add_item
+
+DURATIONS = {"a": 10.0, "b": 80.0, "c": 30.0, "d": 55.0, "e": 5.0, "f": 20.0}
+
+@pytest.fixture
+def enhance_cli(state_store, monkeypatch, tmp_path):
+    """enhance_cli.py with six downloaded clips queued, probing stubbed to known durations."""
+    import enhance_cli
+    for post_id in DURATIONS:
+        raw = tmp_path / "downloaded_videos" / "valorant" / f"{post_id}.mp4"
+        raw.parent.mkdir(parents=True, exist_ok=True)
+        raw.write_bytes(b"")
+        add_item(post_id, state="downloaded", raw_path=str(raw))
+        work_queue.enqueue(work_queue.FORMAT, post_id, {"raw_path": str(raw)})
+
+    def prepare_jobs(tasks, profile=None):
+        return scheduler.order_longest_first([
+            {"post_id": post_id, "input_path": path, "info": {"duration": DURATIONS[post_id]}}
+            for post_id, path, _, _ in tasks
+        ])
+    monkeypatch.setattr(enhance_cli, "prepare_jobs", prepare_jobs)
+    return enhance_cli
+
+def test_longest_clips_of_the_window_are_kept(enhance_cli, monkeypatch):
+    monkeypatch.setattr(enhance_cli, "FORMAT_LEASE_WINDOW", 3)
+    jobs, leased = enhance_cli.lease_format_jobs(2)
+    assert [job["post_id"] for job in jobs] == ["b", "d"]
+    assert leased == 2
+    counts = state_db.work_counts(work_queue.FORMAT)
+    assert counts == {"leased": 2, "queued": 4}
+    # The clips handed back did not use up an attempt.
+    assert {task["attempts"] for task in work_queue.lease(work_queue.FORMAT, 10)} == {1}
+
+def test_window_of_one_leases_only_free_slots(enhance_cli, monkeypatch):
+    monkeypatch.setattr(enhance_cli, "FORMAT_LEASE_WINDOW", 1)
+    jobs, leased = enhance_cli.lease_format_jobs(2)
+    assert ([job["post_id"] for job in jobs], leased) == (["b", "a"], 2)
+
+def test_tasks_without_a_raw_file_are_settled_not_kept(enhance_cli, tmp_path):
+    (tmp_path / "downloaded_videos" / "valorant" / "b.mp4").unlink()
+    jobs, leased = enhance_cli.lease_format_jobs(1)
+    assert [job["post_id"] for job in jobs] == ["d"]
+    assert leased == 2  # 'd' kept, 'b' dead-lettered; the rest went back.
+    assert [row["post_id"] for row in state_db.dead_letters(work_queue.FORMAT)] == ["b"]
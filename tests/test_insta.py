@@ -0,0 +1,40 @@
+# --- START OF FILE tests/test_insta.py (Account Routing and Upload Planning) ---
+
+import pytest
+
+pytest.importorskip("dotenv")
+import ig_accounts
+import state_db
+from conftest import add_item
+
+@pytest.fixture
+def insta(state_store, monkeypatch):
+    """insta.py, imported inside the scratch folder so its upload.log lands there."""
+    import insta
+    monkeypatch.setattr(ig_accounts, "DEFAULT_ACCOUNT", "main")
+    monkeypatch.setattr(ig_accounts, "ACCOUNTS", {"main": "pw", "apexclips": "pw", "fpsdaily": None})
+    monkeypatch.setattr(ig_accounts, "ROUTES", {"apexlegends": "apexclips", "valorant": "fpsdaily"})
+    monkeypatch.setattr(ig_accounts, "_clients", {"main": object(), "apexclips": object()})
+    monkeypatch.setattr(insta, "_rerouted", set())
+    return insta
+
+def test_routed_subreddits_post_as_their_account(insta):
+    assert insta.account_for("ApexLegends") == "apexclips"
+    assert insta.account_for("somethingelse") == "main"
+
+def test_route_to_an_account_without_a_client_falls_back_to_the_main_account(insta):
+    assert insta.account_for("valorant") == "main"
+
+def test_nothing_is_planned_when_no_account_for_it_is_ready(insta, monkeypatch):
+    monkeypatch.setattr(ig_accounts, "_clients", {"apexclips": object()})
+    add_item("v1", "valorant", state="formatted")
+    add_item("a1", "apexlegends", state="formatted")
+    assert insta.account_for("valorant") is None
+    assert insta.schedule_uploads([state_db.get_item("v1"), state_db.get_item("a1")]) == 1
+    jobs = state_db.due_upload_jobs(float("inf"))
+    assert [(job["post_id"], job["account"]) for job in jobs] == [("a1", "apexclips")]
+
+def test_planned_slots_follow_the_fallback(insta):
+    add_item("v1", "valorant", state="formatted")
+    assert insta.schedule_uploads([state_db.get_item("v1")]) == 1
+    assert [job["account"] for job in state_db.due_upload_jobs(float("inf"))] == ["main"]
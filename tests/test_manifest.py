@@ -0,0 +1,62 @@
+# --- START OF FILE tests/test_manifest.py (Ready-to-Post Manifest) ---
+
+import pytest
+import manifest
+
+@pytest.fixture(autouse=True)
+def manifest_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest, "MANIFEST_PATH", str(tmp_path / "ready" / "manifest.jsonl"))
+
+def publish(post_id):
+    manifest.publish(post_id, "valorant", f"Clip {post_id}", f"ready/{post_id}_vertical.mp4")
+
+def read(consumer="insta"):
+    entries, offset = manifest.read_new(consumer)
+    return [entry["post_id"] for entry in entries], offset
+
+def test_consumer_without_a_cursor_gets_none():
+    publish("a")
+    assert manifest.read_new("insta") is None
+
+def test_entries_are_read_once_the_cursor_advances():
+    manifest.advance("insta", 0)
+    publish("a")
+    publish("b")
+    post_ids, offset = read()
+    assert post_ids == ["a", "b"]
+    # Not advanced: the same entries come back.
+    assert read() == (post_ids, offset)
+
+    manifest.advance("insta", offset)
+    publish("c")
+    assert read()[0] == ["c"]
+
+def test_each_consumer_has_its_own_cursor():
+    manifest.advance("insta", 0)
+    manifest.advance("other", 0)
+    publish("a")
+    manifest.advance("insta", read("insta")[1])
+    assert read("insta")[0] == []
+    assert read("other")[0] == ["a"]
+
+def test_partial_line_waits_for_the_next_read():
+    manifest.advance("insta", 0)
+    publish("a")
+    with open(manifest.MANIFEST_PATH, "a", encoding="utf-8") as f:
+        f.write('{"post_id": "b", ')
+    post_ids, offset = read()
+    assert post_ids == ["a"]
+    manifest.advance("insta", offset)
+    with open(manifest.MANIFEST_PATH, "a", encoding="utf-8") as f:
+        f.write('"subreddit": "valorant"}\n')
+    assert read()[0] == ["b"]
+
+def test_replaced_manifest_is_read_from_the_start():
+    manifest.advance("insta", 0)
+    publish("a")
+    publish("b")
+    manifest.advance("insta", read()[1])
+    with open(manifest.MANIFEST_PATH, "w", encoding="utf-8"):
+        pass
+    publish("c")
+    assert read()[0] == ["c"]
@@ -0,0 +1,51 @@
+# --- START OF FILE tests/test_outputs.py (Atomic Output Files) ---
+
+import os
+import time
+import outputs
+
+def touch(path, age=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x")
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    return path
+
+def test_temp_paths_keep_the_extension_last():
+    assert outputs.temp_path("ready/a/foo_vertical.mp4") == "ready/a/foo_vertical.tmp.mp4"
+    assert outputs.is_temp("foo_vertical.tmp.jpg")
+    assert not outputs.is_temp("foo_vertical.mp4")
+
+def test_old_temp_video_and_cover_go_together(tmp_path):
+    video = touch(tmp_path / "sub" / "a_vertical.tmp.mp4", age=600)
+    cover = touch(tmp_path / "sub" / "a_vertical.tmp.jpg", age=600)
+    finished = touch(tmp_path / "sub" / "b_vertical.mp4", age=600)
+    assert outputs.clean_orphans(str(tmp_path), max_age=300) == 2
+    assert not video.exists() and not cover.exists() and finished.exists()
+
+def test_old_cover_of_a_live_encode_is_kept(tmp_path):
+    # The cover is written once near the start; the video is still being written.
+    video = touch(tmp_path / "a_vertical.tmp.mp4", age=1)
+    cover = touch(tmp_path / "a_vertical.tmp.jpg", age=600)
+    assert outputs.clean_orphans(str(tmp_path), max_age=300) == 0
+    assert video.exists() and cover.exists()
+
+def test_cover_without_a_video_is_judged_on_its_own(tmp_path):
+    touch(tmp_path / "a_vertical.tmp.jpg", age=600)
+    touch(tmp_path / "b_vertical.tmp.jpg", age=1)
+    assert outputs.clean_orphans(str(tmp_path), max_age=300) == 1
+    assert os.listdir(tmp_path) == ["b_vertical.tmp.jpg"]
+
+def test_segment_folders_are_aged_by_their_newest_piece(tmp_path):
+    live = tmp_path / "a_vertical.segments"
+    touch(live / "part000.mp4", age=600)
+    touch(live / "part001.mp4", age=1)
+    os.utime(live, (time.time() - 600, time.time() - 600))
+    dead = tmp_path / "b_vertical.segments"
+    touch(dead / "part000.mp4", age=600)
+    os.utime(dead, (time.time() - 600, time.time() - 600))
+    assert outputs.clean_orphans(str(tmp_path), max_age=300) == 1
+    assert live.exists() and not dead.exists()
+
+def test_missing_output_dir_is_fine(tmp_path):
+    assert outputs.clean_orphans(str(tmp_path / "nothing")) == 0
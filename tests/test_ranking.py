@@ -0,0 +1,104 @@
+# --- START OF FILE tests/test_ranking.py (Ranking Gate) ---
+
+import time
+import pytest
+import ranking
+import state_db
+import work_queue
+from conftest import add_item
+
+@pytest.fixture(autouse=True)
+def capped(monkeypatch):
+    monkeypatch.setattr(ranking, "RANK_TOP_N", 2)
+    monkeypatch.setattr(ranking, "_last_gate", {"at": None, "result": (0, 0)})
+    monkeypatch.setattr(ranking, "_streams", {})
+
+def downloaded(post_id, reddit_score, subreddit="valorant", raw_path=None, **columns):
+    """A downloaded clip waiting for the gate. No raw file by default, as on a node that did not download it."""
+    add_item(post_id, subreddit, state="downloaded", raw_path=raw_path or f"/elsewhere/{post_id}.mp4",
+             downloaded_at=time.time(), reddit_score=reddit_score, upvote_ratio=0.95, num_comments=10,
+             created_utc=time.time() - 3600, **columns)
+    work_queue.enqueue(work_queue.FORMAT, post_id, {"raw_path": f"/elsewhere/{post_id}.mp4"}, status=ranking.admission_status())
+
+def statuses():
+    return {row["post_id"]: row["status"] for row in state_db.waiting_work("format")}
+
+def test_new_tasks_wait_for_the_gate_only_when_capped(monkeypatch):
+    assert ranking.admission_status() == "deferred"
+    monkeypatch.setattr(ranking, "RANK_TOP_N", 0)
+    assert ranking.admission_status() == "queued"
+
+def test_unanalyzed_clips_are_ranked_by_reddit_signal():
+    for post_id, score in [("low", 3), ("top", 5000), ("mid", 200), ("none", 0)]:
+        downloaded(post_id, score)
+    assert ranking.rank_and_gate(force=True) == (2, 2)
+    assert statuses() == {"top": "queued", "mid": "queued", "low": "deferred", "none": "deferred"}
+    priorities = {row["post_id"]: row["priority"] for row in state_db.waiting_work("format")}
+    assert priorities["top"] > priorities["mid"] > priorities["low"] > priorities["none"] > 0
+
+def test_cap_is_per_subreddit_and_counts_formatted_and_leased():
+    downloaded("v1", 100)
+    downloaded("v2", 50)
+    downloaded("a1", 10, subreddit="apexlegends")
+    add_item("done", state="formatted", formatted_at=time.time())
+    assert ranking.rank_and_gate(force=True) == (2, 1)
+    assert statuses() == {"v1": "queued", "v2": "deferred", "a1": "queued"}
+
+    work_queue.lease(work_queue.FORMAT, 2)  # v1 and a1 are now being encoded.
+    assert ranking.rank_and_gate(force=True) == (0, 1)
+
+def test_uncapped_gate_lets_everything_in(monkeypatch):
+    downloaded("a", 1)
+    downloaded("b", 2)
+    monkeypatch.setattr(ranking, "RANK_TOP_N", 0)
+    assert ranking.rank_and_gate(force=True) == (2, 0)
+    assert set(statuses().values()) == {"queued"}
+
+def test_stale_clips_below_the_cut_are_passed_over(monkeypatch):
+    monkeypatch.setattr(ranking, "RANK_TOP_N", 1)
+    downloaded("best", 100)
+    downloaded("old", 1)
+    state_db._write("UPDATE items SET downloaded_at = ? WHERE post_id = 'old'", (time.time() - (ranking.RANK_STALE_HOURS + 1) * 3600,))
+    ranking.rank_and_gate(force=True)
+    assert statuses() == {"best": "queued"}
+    assert state_db.get_item("old")["state"] == state_db.PASSED_OVER
+
+def test_gate_reuses_a_recent_pass_unless_forced():
+    downloaded("a", 1)
+    assert ranking.rank_and_gate(force=True) == (1, 0)
+    downloaded("b", 2)
+    downloaded("c", 3)
+    assert ranking.rank_and_gate() == (1, 0)
+    assert ranking.rank_and_gate(force=True) == (2, 1)
+
+def test_small_score_changes_are_not_written(monkeypatch):
+    downloaded("a", 100)
+    ranking.rank_and_gate(force=True)
+    writes = []
+    monkeypatch.setattr(state_db, "set_work_priority", lambda task_id, priority: writes.append(task_id))
+    ranking.rank_and_gate(force=True)
+    assert writes == []
+    state_db._write("UPDATE items SET reddit_score = 100000 WHERE post_id = 'a'")
+    ranking.rank_and_gate(force=True)
+    assert len(writes) == 1
+
+def test_unreadable_clip_keeps_half_its_reddit_signal(monkeypatch, tmp_path):
+    raw = tmp_path / "gone.mp4"
+    raw.write_bytes(b"")
+    downloaded("gone", 100, raw_path=str(raw))
+
+    def evicted(path, info=None):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(ranking, "analyze", evicted)
+    ranking.rank_and_gate(force=True)
+    item = state_db.get_item("gone")
+    assert item["rank_score"] == pytest.approx(ranking.reddit_signal(item) * 0.5, rel=1e-3)
+
+def test_stream_slots_share_the_cap():
+    downloaded("v1", 100)
+    ranking.rank_and_gate(force=True)
+    assert ranking.claim_stream_slot("valorant")
+    assert not ranking.claim_stream_slot("valorant")
+    ranking.release_stream_slot("valorant")
+    assert ranking.claim_stream_slot("valorant")
+    assert ranking.claim_stream_slot("apexlegends")
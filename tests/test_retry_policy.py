@@ -0,0 +1,99 @@
+# --- START OF FILE tests/test_retry_policy.py (Retries, Circuit Breakers and Dead Letters) ---
+
+import pytest
+import retry_policy
+import state_db
+import work_queue
+
+# Stand-ins named like the praw, yt_dlp and instagrapi errors; classify() matches by class name.
+class TooManyRequests(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429")
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after}, "status_code": 429})()
+
+class Redirect(Exception):
+    pass
+
+class DownloadError(Exception):
+    pass
+
+def test_classify_by_name_status_and_message():
+    assert retry_policy.classify(TooManyRequests("12")) == (retry_policy.RATE_LIMITED, 12.0)
+    assert retry_policy.classify(Redirect("/subreddits/search"))[0] == retry_policy.PERMANENT
+    assert retry_policy.classify(TimeoutError("read timed out"))[0] == retry_policy.TRANSIENT
+    assert retry_policy.classify(DownloadError("HTTP Error 503: Service Unavailable"))[0] == retry_policy.TRANSIENT
+    assert retry_policy.classify(DownloadError("HTTP Error 404: Not Found"))[0] == retry_policy.PERMANENT
+    assert retry_policy.classify(DownloadError("HTTP Error 408: Request Timeout"))[0] != retry_policy.PERMANENT
+    assert retry_policy.classify(ValueError("ffmpeg exited with 1")) == (retry_policy.FAILED, None)
+    assert retry_policy.classify("raw file missing") == (retry_policy.FAILED, None)
+
+def test_wrapped_errors_are_classified_by_their_cause():
+    error = DownloadError("ERROR: unable to download video data")
+    error.exc_info = (TooManyRequests, TooManyRequests("30"), None)
+    assert retry_policy.classify(error) == (retry_policy.RATE_LIMITED, 30.0)
+
+def test_backoff_grows_with_jitter_and_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(retry_policy, "RETRY_BASE_SECONDS", 10)
+    monkeypatch.setattr(retry_policy, "RETRY_MAX_SECONDS", 60)
+    for attempt, ceiling in [(1, 10), (2, 20), (3, 40), (6, 60)]:
+        delay = retry_policy.backoff_seconds(attempt)
+        assert ceiling / 2 <= delay <= ceiling
+    assert retry_policy.backoff_seconds(1, retry_after=500) == 500
+
+def test_breaker_opens_after_threshold_and_closes_on_success(monkeypatch):
+    monkeypatch.setattr(retry_policy, "BREAKER_THRESHOLD", 3)
+    for _ in range(2):
+        retry_policy.record_failure(retry_policy.MEDIA, TimeoutError())
+    assert retry_policy.breaker_wait(retry_policy.MEDIA) == 0
+    retry_policy.record_failure(retry_policy.MEDIA, TimeoutError())
+    assert retry_policy.breaker_wait(retry_policy.MEDIA) > 0
+    retry_policy.record_success(retry_policy.MEDIA)
+    assert retry_policy.breaker_wait(retry_policy.MEDIA) == 0
+
+def test_permanent_and_failed_errors_do_not_count_against_the_upstream():
+    retry_policy.record_failure(retry_policy.MEDIA, Redirect())
+    retry_policy.record_failure(retry_policy.MEDIA, ValueError())
+    assert state_db.get_breaker(retry_policy.MEDIA)["failures"] == 0
+
+def test_rate_limit_opens_the_breaker_for_retry_after():
+    retry_policy.record_failure(retry_policy.REDDIT, TooManyRequests("90"))
+    assert 85 < retry_policy.breaker_wait(retry_policy.REDDIT) <= 90
+
+def test_call_retries_transient_errors_and_gives_up_on_permanent_ones(monkeypatch):
+    monkeypatch.setattr(retry_policy.time, "sleep", lambda seconds: None)
+    outcomes = [TimeoutError(), TimeoutError(), "listing"]
+
+    def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    assert retry_policy.call(retry_policy.REDDIT, flaky) == "listing"
+
+    calls = []
+    def missing():
+        calls.append(1)
+        raise Redirect()
+    with pytest.raises(Redirect):
+        retry_policy.call(retry_policy.REDDIT, missing)
+    assert len(calls) == 1
+
+def test_call_raises_breaker_open_instead_of_waiting_long(monkeypatch):
+    monkeypatch.setattr(retry_policy, "BREAKER_MAX_WAIT_SECONDS", 10)
+    retry_policy.record_failure(retry_policy.REDDIT, TooManyRequests("600"))
+    with pytest.raises(retry_policy.BreakerOpen):
+        retry_policy.call(retry_policy.REDDIT, lambda: "listing")
+
+def test_rate_limited_tasks_keep_their_attempts_and_dead_letters_can_be_requeued():
+    work_queue.enqueue(work_queue.DOWNLOAD, "a", {})
+    task = work_queue.lease(work_queue.DOWNLOAD)[0]
+    work_queue.fail(task, TooManyRequests("60"))
+    state_db._write("UPDATE work_queue SET available_at = 0")
+    task = work_queue.lease(work_queue.DOWNLOAD)[0]
+    assert task["attempts"] == 1
+
+    work_queue.fail(task, Redirect())
+    assert [row["post_id"] for row in state_db.dead_letters()] == ["a"]
+    assert retry_policy.requeue("a", work_queue.DOWNLOAD)
+    assert state_db.dead_letters() == []
+    assert work_queue.lease(work_queue.DOWNLOAD)[0]["attempts"] == 1
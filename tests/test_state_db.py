@@ -0,0 +1,18 @@
+# --- START OF FILE tests/test_state_db.py (State Store) ---
+
+import state_db
+
+def test_listing_cursor_only_moves_forward():
+    assert state_db.get_cursor("valorant", "new") is None
+    state_db.update_cursor("valorant", "new", "t3_b", 200.0)
+    state_db.update_cursor("valorant", "new", "t3_a", 100.0)
+    state_db.update_cursor("valorant", "new", None, None)
+    cursor = state_db.get_cursor("valorant", "new")
+    assert (cursor["last_fullname"], cursor["last_created_utc"]) == ("t3_b", 200.0)
+    assert state_db.get_cursor("valorant", "top") is None
+
+def test_ranked_listing_cursor_records_the_fetch_time():
+    state_db.update_cursor("valorant", "top", None, None)
+    first = state_db.get_cursor("valorant", "top")["fetched_at"]
+    state_db.update_cursor("valorant", "top", "t3_c", 300.0)
+    assert state_db.get_cursor("valorant", "top")["fetched_at"] >= first
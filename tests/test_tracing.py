@@ -0,0 +1,51 @@
+# --- START OF FILE tests/test_tracing.py (Per-Item Tracing and Stage Metrics) ---
+
+import json
+import pytest
+import tracing
+
+@pytest.fixture(autouse=True)
+def trace_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_DIR", str(tmp_path / "traces"))
+    monkeypatch.setattr(tracing, "RUN_ID", "first")
+    monkeypatch.setattr(tracing, "_metrics", {})
+    monkeypatch.setattr(tracing, "_realtime", {})
+    monkeypatch.setattr(tracing, "_subreddits", {})
+    monkeypatch.setattr(tracing, "_state", {"started": False, "metrics_written_at": 0.0, "runs": 0})
+
+def item_count(path):
+    lines = [line for line in open(path) if line.startswith("reels_stage_items_total")]
+    return sum(int(line.rsplit(" ", 1)[1]) for line in lines)
+
+def test_spans_and_metrics_are_written_per_run():
+    assert tracing.start_run() == "first"
+    tracing.record("download", "a", 2.0, subreddit="valorant", bytes=1000)
+    with tracing.span("encode", "a", "valorant", media_seconds=30.0) as span:
+        span["status"] = "error"
+    tracing.write_metrics()
+
+    spans = [json.loads(line) for line in open(tracing.spans_path())]
+    assert [(s["stage"], s["status"], s["run_id"]) for s in spans] == [("download", "ok", "first"), ("encode", "error", "first")]
+    metrics = open(tracing.metrics_path()).read()
+    assert 'reels_stage_bytes_total{stage="download",subreddit="valorant",status="ok"} 1000' in metrics
+
+def test_every_daemon_run_gets_its_own_files_and_counters():
+    tracing.start_run()
+    tracing.record("download", "a", 1.0, subreddit="valorant")
+    tracing.record("download", "b", 1.0, subreddit="valorant")
+    first_metrics = tracing.metrics_path()
+
+    second = tracing.start_run()
+    assert second != "first"
+    tracing.record("download", "c", 1.0, subreddit="valorant")
+    tracing.write_metrics()
+
+    assert item_count(first_metrics) == 2
+    assert item_count(tracing.metrics_path()) == 1
+    assert [json.loads(line)["post_id"] for line in open(tracing.spans_path())] == ["c"]
+
+def test_disabled_tracing_writes_nothing(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "TRACING", False)
+    tracing.record("download", "a", 1.0, subreddit="valorant")
+    tracing.write_metrics()
+    assert not (tmp_path / "traces").exists()
@@ -0,0 +1,73 @@
+# --- START OF FILE tests/test_upload_schedule.py (Persistent Upload Schedule) ---
+
+import time
+import pytest
+import state_db
+import upload_schedule
+from conftest import add_item
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A frozen time.time() the test moves forward by hand."""
+    now = {"t": 1_700_000_000.0}
+    monkeypatch.setattr(time, "time", lambda: now["t"])
+    return now
+
+@pytest.fixture(autouse=True)
+def pacing(monkeypatch):
+    monkeypatch.setattr(upload_schedule, "MIN_GAP_MINUTES", 10)
+    monkeypatch.setattr(upload_schedule, "MAX_GAP_MINUTES", 10)
+    monkeypatch.setattr(upload_schedule, "UPLOAD_BURST", 2.0)
+    monkeypatch.setattr(upload_schedule, "UPLOAD_REFILL_MINUTES", 10.0)
+    monkeypatch.setattr(upload_schedule, "MAX_ATTEMPTS", 3)
+
+def test_slots_follow_the_accounts_last_one(clock):
+    start = clock["t"]
+    assert upload_schedule.plan_upload("a", "main") == start
+    assert upload_schedule.plan_upload("b", "main") == start + 600
+    assert upload_schedule.plan_upload("c", "other") == start
+    assert upload_schedule.plan_upload("a", "main") is None
+
+def test_token_bucket_allows_a_burst_then_refills(clock):
+    assert upload_schedule.take_token("main") == 0
+    assert upload_schedule.take_token("main") == 0
+    assert upload_schedule.take_token("main") == pytest.approx(600)
+    clock["t"] += 300
+    assert upload_schedule.take_token("main") == pytest.approx(300)
+    clock["t"] += 300
+    assert upload_schedule.take_token("main") == 0
+    # Each account has its own bucket.
+    assert upload_schedule.take_token("other") == 0
+
+def test_bucket_never_holds_more_than_the_burst(clock):
+    upload_schedule.take_token("main")
+    clock["t"] += 10 * 3600
+    assert [upload_schedule.take_token("main") for _ in range(2)] == [0, 0]
+    assert upload_schedule.take_token("main") > 0
+
+def test_due_slot_goes_to_the_best_ranked_clip(clock):
+    add_item("weak", rank_score=0.2)
+    add_item("strong", rank_score=0.9)
+    upload_schedule.plan_upload("weak", "main")
+    upload_schedule.plan_upload("strong", "main")
+    due = upload_schedule.due_jobs("main")
+    assert [job["post_id"] for job in due] == ["weak"]
+    assert upload_schedule.best_for_slot(due[0])["post_id"] == "strong"
+    assert [job["post_id"] for job in upload_schedule.due_jobs("main")] == ["strong"]
+
+def test_failed_jobs_back_off_then_dead_letter(clock):
+    upload_schedule.plan_upload("a", "main")
+    for attempt in (1, 2):
+        job = upload_schedule.due_jobs("main")[0]
+        assert upload_schedule.retry_or_fail(job, "upload failed")
+        assert upload_schedule.due_jobs("main") == []
+        clock["t"] += upload_schedule.RETRY_MINUTES * 60 * 2 ** attempt
+    assert not upload_schedule.retry_or_fail(upload_schedule.due_jobs("main")[0], "upload failed")
+    assert [row["post_id"] for row in state_db.dead_letters("upload")] == ["a"]
+
+def test_postponed_jobs_keep_their_attempts(clock):
+    upload_schedule.plan_upload("a", "main")
+    upload_schedule.postpone(upload_schedule.due_jobs("main")[0], 60)
+    assert upload_schedule.seconds_until_next(account="main") == 60
+    clock["t"] += 60
+    assert upload_schedule.due_jobs("main")[0]["attempts"] == 0
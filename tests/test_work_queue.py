@@ -0,0 +1,85 @@
+# --- START OF FILE tests/test_work_queue.py (Work Queue Leases) ---
+
+import time
+import state_db
+import work_queue
+
+def _expire(task):
+    state_db._write("UPDATE work_queue SET lease_expires_at = ? WHERE task_id = ?", (time.time() - 1, task["task_id"]))
+
+def test_lease_hands_out_each_task_once():
+    work_queue.enqueue(work_queue.FORMAT, "a", {"raw_path": "a.mp4"})
+    work_queue.enqueue(work_queue.FORMAT, "b", {"raw_path": "b.mp4"})
+    first = work_queue.lease(work_queue.FORMAT, 1)
+    second = work_queue.lease(work_queue.FORMAT, 5)
+    assert [t["post_id"] for t in first + second] == ["a", "b"]
+    assert work_queue.lease(work_queue.FORMAT, 5) == []
+
+def test_enqueue_is_once_per_stage_and_post():
+    assert work_queue.enqueue(work_queue.FORMAT, "a", {})
+    assert not work_queue.enqueue(work_queue.FORMAT, "a", {})
+    assert work_queue.enqueue(work_queue.DOWNLOAD, "a", {})
+
+def test_higher_priority_is_leased_first():
+    work_queue.enqueue(work_queue.FORMAT, "low", {}, priority=0.1)
+    work_queue.enqueue(work_queue.FORMAT, "high", {}, priority=0.9)
+    assert work_queue.lease(work_queue.FORMAT, 1)[0]["post_id"] == "high"
+
+def test_deferred_tasks_are_not_leased():
+    work_queue.enqueue(work_queue.FORMAT, "a", {}, status="deferred")
+    assert work_queue.lease(work_queue.FORMAT, 1) == []
+
+def test_expired_lease_is_taken_over_and_stale_holder_cannot_settle():
+    work_queue.enqueue(work_queue.FORMAT, "a", {})
+    stale = work_queue.lease(work_queue.FORMAT)[0]
+    _expire(stale)
+    # Same process, so the same NODE_ID: only the token tells the two leases apart.
+    fresh = work_queue.lease(work_queue.FORMAT)[0]
+    assert fresh["task_id"] == stale["task_id"] and fresh["lease_token"] != stale["lease_token"]
+
+    work_queue.complete(stale)
+    assert state_db.work_counts(work_queue.FORMAT) == {"leased": 1}
+    assert fresh["lease_token"] in work_queue._held
+
+    work_queue.complete(fresh)
+    assert state_db.work_counts(work_queue.FORMAT) == {"done": 1}
+
+def test_renew_only_extends_current_leases():
+    work_queue.enqueue(work_queue.FORMAT, "a", {})
+    stale = work_queue.lease(work_queue.FORMAT)[0]
+    _expire(stale)
+    fresh = work_queue.lease(work_queue.FORMAT)[0]
+    held = state_db.renew_leases([stale["lease_token"], fresh["lease_token"]], time.time() + 60)
+    assert held == {fresh["lease_token"]}
+
+def test_fail_retries_with_backoff_then_dead_letters(monkeypatch):
+    monkeypatch.setattr(work_queue, "WORK_MAX_ATTEMPTS", 2)
+    work_queue.enqueue(work_queue.FORMAT, "a", {})
+    task = work_queue.lease(work_queue.FORMAT)[0]
+    work_queue.fail(task, "ffmpeg exited with 1")
+    # Backed off: queued, but not leasable yet.
+    assert state_db.work_counts(work_queue.FORMAT) == {"queued": 1}
+    assert work_queue.lease(work_queue.FORMAT) == []
+
+    state_db._write("UPDATE work_queue SET available_at = 0")
+    task = work_queue.lease(work_queue.FORMAT)[0]
+    assert task["attempts"] == 2
+    work_queue.fail(task, "ffmpeg exited with 1")
+    assert state_db.work_counts(work_queue.FORMAT) == {"failed": 1}
+    assert [row["post_id"] for row in state_db.dead_letters(work_queue.FORMAT)] == ["a"]
+
+def test_release_refunds_the_attempt():
+    work_queue.enqueue(work_queue.FORMAT, "a", {})
+    work_queue.release(work_queue.lease(work_queue.FORMAT)[0])
+    assert work_queue.lease(work_queue.FORMAT)[0]["attempts"] == 1
+
+def test_ready_skips_backed_off_and_held_tasks():
+    for post_id in ("a", "b", "c"):
+        work_queue.enqueue(work_queue.FORMAT, post_id, {})
+    work_queue.enqueue(work_queue.FORMAT, "d", {}, status="deferred")
+    held, failing = work_queue.lease(work_queue.FORMAT, 2)
+    work_queue.fail(failing, "ffmpeg exited with 1")
+    assert work_queue.counts(work_queue.FORMAT)["queued"] == 2
+    assert work_queue.ready(work_queue.FORMAT) == 1
+    _expire(held)
+    assert work_queue.ready(work_queue.FORMAT) == 2
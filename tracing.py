@@ -0,0 +1,149 @@
+# --- START OF FILE tracing.py (Per-Item Tracing and Stage Metrics) ---
+
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+import state_db
+
+# -------------------- Settings --------------------
+TRACING = os.getenv("TRACING", "true").lower() == "true"
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# One JSON-lines span file and one Prometheus text file per run.
+RUN_ID = os.getenv("RUN_ID") or time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+# The metrics file is rewritten at most this often while a run is going, and once more at exit.
+METRICS_WRITE_SECONDS = 10
+
+_lock = threading.Lock()
+_metrics = {}
+_realtime = {}
+_subreddits = {}
+_state = {"started": False, "metrics_written_at": 0.0, "runs": 0}
+
+def spans_path():
+    return os.path.join(TRACE_DIR, f"run-{RUN_ID}.jsonl")
+
+def metrics_path():
+    return os.path.join(TRACE_DIR, f"run-{RUN_ID}.prom")
+
+def start_run():
+    """
+    Starts a new run: the first keeps the process's RUN_ID, later ones (--daemon) get a new ID
+    and start their metrics from zero, after the previous run's file is written a last time.
+    Returns the run ID.
+    """
+    global RUN_ID
+    write_metrics()
+    with _lock:
+        _state["runs"] += 1
+        if _state["runs"] > 1:
+            RUN_ID = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}-{_state['runs']}"
+        _metrics.clear()
+        _realtime.clear()
+        _state["metrics_written_at"] = 0.0
+        return RUN_ID
+
+# -------------------- Spans --------------------
+def _subreddit_of(post_id):
+    if post_id not in _subreddits:
+        item = state_db.get_item(post_id)
+        _subreddits[post_id] = item["subreddit"] if item else None
+    return _subreddits[post_id]
+
+def record(stage, post_id=None, seconds=0.0, subreddit=None, status="ok", started_at=None, **attrs):
+    """
+    Records one finished span. Numeric `bytes` and `media_seconds` attributes also feed
+    the per-stage byte counters and the realtime factor in the metrics file.
+    """
+    if not TRACING:
+        return
+    subreddit = subreddit or (_subreddit_of(post_id) if post_id else None)
+    span = {
+        "run_id": RUN_ID,
+        "post_id": post_id,
+        "stage": stage,
+        "subreddit": subreddit,
+        "status": status,
+        "started_at": started_at if started_at is not None else time.time() - seconds,
+        "seconds": round(seconds, 4),
+        **attrs,
+    }
+    line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        if not _state["started"]:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            atexit.register(write_metrics)
+            _state["started"] = True
+        with open(spans_path(), "a", encoding="utf-8") as f:
+            f.write(line)
+
+        key = (stage, subreddit or "", status)
+        totals = _metrics.setdefault(key, {"count": 0, "seconds": 0.0, "bytes": 0})
+        totals["count"] += 1
+        totals["seconds"] += seconds
+        totals["bytes"] += int(attrs.get("bytes") or 0)
+        if attrs.get("media_seconds") and seconds > 0:
+            realtime = _realtime.setdefault((stage, subreddit or ""), {"media_seconds": 0.0, "wall_seconds": 0.0})
+            realtime["media_seconds"] += attrs["media_seconds"]
+            realtime["wall_seconds"] += seconds
+        due = time.monotonic() - _state["metrics_written_at"] >= METRICS_WRITE_SECONDS
+    if due:
+        write_metrics()
+
+@contextmanager
+def span(stage, post_id=None, subreddit=None, **attrs):
+    """
+    Times the block as one span. The yielded dict can be filled in with more attributes,
+    and its 'status' set to 'error' when the block reports failure without raising.
+    """
+    started_at, t0 = time.time(), time.monotonic()
+    attrs.setdefault("status", "ok")
+    try:
+        yield attrs
+    except Exception:
+        attrs["status"] = "error"
+        raise
+    finally:
+        record(stage, post_id, time.monotonic() - t0, subreddit=subreddit, started_at=started_at, **attrs)
+
+# -------------------- Metrics Export --------------------
+def _labels(**labels):
+    return ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in labels.items())
+
+def write_metrics():
+    """Writes this run's per-stage, per-subreddit totals in the Prometheus text format."""
+    with _lock:
+        if not _state["started"]:
+            return
+        _state["metrics_written_at"] = time.monotonic()
+        lines = [
+            "# HELP reels_stage_items_total Spans recorded per stage, subreddit and status.",
+            "# TYPE reels_stage_items_total counter",
+        ]
+        lines += [f"reels_stage_items_total{{{_labels(stage=stage, subreddit=sub, status=status)}}} {m['count']}"
+                  for (stage, sub, status), m in sorted(_metrics.items())]
+        lines += [
+            "# HELP reels_stage_seconds_total Wall-clock seconds spent per stage and subreddit.",
+            "# TYPE reels_stage_seconds_total counter",
+        ]
+        lines += [f"reels_stage_seconds_total{{{_labels(stage=stage, subreddit=sub, status=status)}}} {m['seconds']:.3f}"
+                  for (stage, sub, status), m in sorted(_metrics.items())]
+        lines += [
+            "# HELP reels_stage_bytes_total Bytes moved per stage and subreddit.",
+            "# TYPE reels_stage_bytes_total counter",
+        ]
+        lines += [f"reels_stage_bytes_total{{{_labels(stage=stage, subreddit=sub, status=status)}}} {m['bytes']}"
+                  for (stage, sub, status), m in sorted(_metrics.items()) if m["bytes"]]
+        lines += [
+            "# HELP reels_stage_realtime_factor Seconds of video handled per wall-clock second.",
+            "# TYPE reels_stage_realtime_factor gauge",
+        ]
+        lines += [f"reels_stage_realtime_factor{{{_labels(stage=stage, subreddit=sub)}}} {r['media_seconds'] / r['wall_seconds']:.3f}"
+                  for (stage, sub), r in sorted(_realtime.items()) if r["wall_seconds"]]
+
+        path = metrics_path()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
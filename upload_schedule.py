@@ -0,0 +1,132 @@
+# --- START OF FILE upload_schedule.py (Persistent Upload Schedule) ---
+
+import os
+import time
+import random
+import threading
+from collections import defaultdict
+import state_db
+import retry_policy
+
+# -------------------- Settings --------------------
+# Posts for one account are planned this far apart.
+MIN_GAP_MINUTES = int(os.getenv("UPLOAD_MIN_GAP_MINUTES", "10"))
+MAX_GAP_MINUTES = int(os.getenv("UPLOAD_MAX_GAP_MINUTES", "15"))
+# Token bucket per account: at most UPLOAD_BURST posts back to back, refilled one every UPLOAD_REFILL_MINUTES.
+# It holds even when a backlog of planned times is already overdue, e.g. after the machine was off.
+UPLOAD_BURST = float(os.getenv("UPLOAD_BURST", "1"))
+UPLOAD_REFILL_MINUTES = float(os.getenv("UPLOAD_REFILL_MINUTES", str(MIN_GAP_MINUTES)))
+# The hashtag comment follows its upload after a short, human-looking pause.
+COMMENT_DELAY_SECONDS = (5, 15)
+MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "3"))
+# First retry delay; later ones back off exponentially (see retry_policy.py).
+RETRY_MINUTES = int(os.getenv("UPLOAD_RETRY_MINUTES", "15"))
+DEFAULT_ACCOUNT = os.getenv("INSTAGRAM_USERNAME") or "default"
+
+UPLOAD = "upload"
+COMMENT = "comment"
+
+# Set whenever a job is planned for the account, so its sleeping worker can pick it up.
+_wakeups = defaultdict(threading.Event)
+_lock = threading.Lock()
+
+# -------------------- Planning --------------------
+def plan_upload(post_id, account=None):
+    """
+    Gives the post a slot after the account's last planned one. Never blocks.
+    Returns the planned time, or None if the post is already scheduled.
+    """
+    account = account or DEFAULT_ACCOUNT
+    with _lock:
+        last = state_db.last_planned_upload(account)
+        gap = random.randint(MIN_GAP_MINUTES * 60, MAX_GAP_MINUTES * 60)
+        due_at = max(time.time(), last + gap if last else 0)
+        if not state_db.add_upload_job(post_id, UPLOAD, account, due_at):
+            return None
+    _wakeups[account].set()
+    return due_at
+
+def plan_comment(post_id, account=None):
+    account = account or DEFAULT_ACCOUNT
+    due_at = time.time() + random.randint(*COMMENT_DELAY_SECONDS)
+    state_db.add_upload_job(post_id, COMMENT, account, due_at)
+    _wakeups[account].set()
+    return due_at
+
+# -------------------- Rate Limit --------------------
+def take_token(account):
+    """Spends one upload token. Returns 0 on success, else the seconds until a token is available."""
+    refill_seconds = UPLOAD_REFILL_MINUTES * 60
+    with _lock:
+        now = time.time()
+        bucket = state_db.get_bucket(account)
+        tokens = UPLOAD_BURST if bucket is None else bucket["tokens"]
+        if bucket is not None:
+            tokens = min(UPLOAD_BURST, tokens + (now - bucket["updated_at"]) / refill_seconds)
+        if tokens < 1:
+            state_db.put_bucket(account, tokens, now)
+            return (1 - tokens) * refill_seconds
+        state_db.put_bucket(account, tokens - 1, now)
+        return 0
+
+# -------------------- Job Bookkeeping --------------------
+def due_jobs(account=None):
+    return state_db.due_upload_jobs(time.time(), account)
+
+def seconds_until_next(kind=None, account=None):
+    """Seconds until the next pending job (0 if one is overdue), or None if nothing is pending."""
+    due_at = state_db.next_upload_due(kind, account)
+    return None if due_at is None else max(0.0, due_at - time.time())
+
+def best_for_slot(job):
+    """
+    Gives a due upload slot to the account's best-ranked clip still waiting, which swaps planned
+    times with the due job. Returns the job to run now. Jobs waiting on a retry keep their slot.
+    """
+    if job["kind"] != UPLOAD or job["attempts"]:
+        return job
+    ranked = state_db.pending_uploads_by_rank(job["account"])
+    if not ranked or ranked[0]["job_id"] == job["job_id"]:
+        return job
+    state_db.swap_upload_slots(job, ranked[0])
+    return ranked[0]
+
+def complete(job):
+    state_db.update_upload_job(job["job_id"], "done")
+
+def postpone(job, seconds):
+    """Moves a job back without counting it as an attempt (used when the rate limit says wait)."""
+    state_db.update_upload_job(job["job_id"], "pending", due_at=time.time() + seconds, attempted=False)
+
+def retry_or_fail(job, error, retry_after=None):
+    """
+    Retries a failed job after a backoff delay (at least `retry_after` seconds), or moves it to
+    the dead-letter table after MAX_ATTEMPTS. Returns True if it will be retried.
+    """
+    attempts = job["attempts"] + 1
+    if attempts >= MAX_ATTEMPTS:
+        state_db.update_upload_job(job["job_id"], "failed", error=str(error))
+        retry_policy.dead_letter(job["post_id"], job["kind"], attempts, error)
+        return False
+    delay = retry_policy.backoff_seconds(attempts, retry_after, base=RETRY_MINUTES * 60)
+    state_db.update_upload_job(job["job_id"], "pending", due_at=time.time() + delay, error=str(error))
+    return True
+
+def wake(account=None):
+    """Interrupts wait_for_next() for one account, or for all of them, e.g. after asking the workers to stop."""
+    for event in ([_wakeups[account]] if account else list(_wakeups.values())):
+        event.set()
+
+def wait_for_next(account=None, max_seconds=None):
+    """
+    Sleeps until the account's next job is due, a new job is planned for it or wake() is called.
+    With nothing pending it sleeps until something is planned.
+    """
+    timeout = seconds_until_next(account=account)
+    if max_seconds is not None:
+        timeout = max_seconds if timeout is None else min(timeout, max_seconds)
+    if timeout == 0:
+        return
+    event = _wakeups[account or DEFAULT_ACCOUNT]
+    event.wait(timeout=timeout)
+    event.clear()
@@ -0,0 +1,82 @@
+# --- START OF FILE watcher.py (Download Folder Watcher) ---
+
+import os
+import re
+import time
+
+# inotify is optional: without it (or off Linux) watch mode falls back to polling the state store.
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+# -------------------- Settings --------------------
+# A burst of events has to go quiet for this long before the downloads are picked up.
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+# How often the state store is checked anyway, and the only check when inotify is unavailable.
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", "30"))
+
+# yt_dlp's in-progress names: foo.mp4.part, foo.mp4.ytdl, and the foo.f137.mp4 / foo.temp.mp4 pieces of a merge.
+_PARTIAL_NAME = re.compile(r"(\.part|\.ytdl|\.f\d+\.\w+|\.temp\.\w+)$")
+
+def is_complete_download(name):
+    return name.endswith(".mp4") and not _PARTIAL_NAME.search(name)
+
+# -------------------- inotify --------------------
+def open_watch(root):
+    """Watches `root` and its subreddit folders. Returns None when inotify is not available."""
+    if INotify is None or not os.path.isdir(root):
+        return None
+    try:
+        inotify = INotify()
+    except OSError:
+        return None
+    watch = {"inotify": inotify, "dirs": {}}
+    for dirpath, _, _ in os.walk(root):
+        _add_dir(watch, dirpath)
+    return watch
+
+def _add_dir(watch, path):
+    mask = inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.CREATE
+    watch["dirs"][watch["inotify"].add_watch(path, mask)] = path
+
+def wait_for_downloads(watch, timeout):
+    """
+    Waits up to `timeout` seconds for inotify events. Returns True if a finished download
+    (written and closed, or renamed into place from a .part file) showed up.
+    """
+    found = False
+    for event in watch["inotify"].read(timeout=int(timeout * 1000)):
+        parent = watch["dirs"].get(event.wd)
+        if parent is None:
+            continue
+        if event.mask & inotify_flags.ISDIR:
+            # A new subreddit folder: watch it too.
+            if event.mask & inotify_flags.CREATE:
+                _add_dir(watch, os.path.join(parent, event.name))
+            continue
+        if event.mask & (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO) and is_complete_download(event.name):
+            found = True
+    return found
+
+def close_watch(watch):
+    if watch:
+        watch["inotify"].close()
+
+# -------------------- Debounce --------------------
+def make_trigger():
+    return {"last_event": None, "last_scan": 0.0}
+
+def note_event(trigger):
+    trigger["last_event"] = time.monotonic()
+
+def scan_due(trigger):
+    """True once events have been quiet for the debounce period, or when the periodic poll is due."""
+    now = time.monotonic()
+    if trigger["last_event"] is not None and now - trigger["last_event"] >= WATCH_DEBOUNCE_SECONDS:
+        return True
+    return now - trigger["last_scan"] >= WATCH_POLL_SECONDS
+
+def scanned(trigger):
+    trigger["last_event"] = None
+    trigger["last_scan"] = time.monotonic()
@@ -0,0 +1,124 @@
+# --- START OF FILE work_queue.py (Shared Lease-Based Work Queue) ---
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import state_db
+import retry_policy
+
+# -------------------- Settings --------------------
+# Every node that shares the state store (STATE_DB on a shared volume) sees the same queue.
+NODE_ID = os.getenv("NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# A leased task becomes visible to other nodes again if its lease is not renewed for this long.
+WORK_LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "300"))
+# Leases held by this process are renewed this often while their work runs.
+HEARTBEAT_SECONDS = WORK_LEASE_SECONDS / 3
+# A task that failed (or whose node died) this many times is parked as 'failed' and dead-lettered.
+# Retry delays follow retry_policy.py's backoff.
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+# How often idle workers look for new tasks.
+WORK_POLL_SECONDS = float(os.getenv("WORK_POLL_SECONDS", "5"))
+
+# Stages
+DOWNLOAD = "download"
+FORMAT = "format"
+
+# Lease token -> task ID of every lease this process holds.
+_held = {}
+_held_lock = threading.Lock()
+_heartbeat = {"thread": None}
+
+# -------------------- Queue Operations --------------------
+def enqueue(stage, post_id, payload, priority=0, status="queued"):
+    """
+    Queues one post for a stage; higher priorities are leased first. A 'deferred' task is not
+    leased until something sets it to 'queued'. Returns False if it was queued for that stage before.
+    """
+    return state_db.add_work(stage, post_id, json.dumps(payload, ensure_ascii=False), priority, status)
+
+def lease(stage, limit=1):
+    """
+    Takes up to `limit` tasks for this node: {'task_id', 'stage', 'post_id', 'attempts', 'payload',
+    'lease_token'} each. The leases are renewed in the background until the task is completed,
+    failed or released; settling checks the token, not just the node.
+    """
+    rows = state_db.lease_work(stage, NODE_ID, WORK_LEASE_SECONDS, WORK_MAX_ATTEMPTS, limit)
+    tasks = [{"task_id": row["task_id"], "stage": row["stage"], "post_id": row["post_id"],
+              "attempts": row["attempts"], "payload": json.loads(row["payload"]),
+              "lease_token": row["lease_token"]} for row in rows]
+    if tasks:
+        with _held_lock:
+            _held.update((task["lease_token"], task["task_id"]) for task in tasks)
+        _start_heartbeat()
+    return tasks
+
+def _settle(task, status, error=None, available_at=None, refund_attempt=False):
+    with _held_lock:
+        _held.pop(task["lease_token"], None)
+    if not state_db.settle_work(task["task_id"], task["lease_token"], status, error, available_at, refund_attempt):
+        logging.warning(f"Lease on {task['post_id']} was lost before it finished; another worker has taken it over.")
+
+def complete(task):
+    _settle(task, "done")
+
+def fail(task, error, retry=True):
+    """
+    Puts the task back after a backoff delay, or parks it as 'failed' in the dead-letter table
+    once it is out of attempts or the error says retrying cannot help. Rate-limited tasks wait
+    at least the server's Retry-After and do not use up an attempt.
+    """
+    kind, retry_after = retry_policy.classify(error)
+    if kind == retry_policy.RATE_LIMITED:
+        delay = retry_policy.backoff_seconds(task["attempts"], retry_after)
+        _settle(task, "queued", str(error), available_at=time.time() + delay, refund_attempt=True)
+    elif retry and kind != retry_policy.PERMANENT and task["attempts"] < WORK_MAX_ATTEMPTS:
+        delay = retry_policy.backoff_seconds(task["attempts"], retry_after)
+        _settle(task, "queued", str(error), available_at=time.time() + delay)
+    else:
+        _settle(task, "failed", str(error))
+        retry_policy.dead_letter(task["post_id"], task["stage"], task["attempts"], error)
+
+def release(task):
+    """Hands an untouched task back right away, without using up an attempt (used on shutdown)."""
+    _settle(task, "queued", available_at=time.time(), refund_attempt=True)
+
+def outstanding(stage):
+    """Tasks still queued or being worked on by any node."""
+    counts = state_db.work_counts(stage)
+    return counts.get("queued", 0) + counts.get("leased", 0)
+
+def ready(stage):
+    """Tasks any node could lease right now; ones backing off after a failure are not counted."""
+    return state_db.ready_work_count(stage)
+
+def counts(stage):
+    return state_db.work_counts(stage)
+
+# -------------------- Heartbeats --------------------
+def _start_heartbeat():
+    with _held_lock:
+        if _heartbeat["thread"] is None:
+            _heartbeat["thread"] = threading.Thread(target=_renew_forever, name="LeaseHeartbeat", daemon=True)
+            _heartbeat["thread"].start()
+
+def _renew_forever():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        with _held_lock:
+            held = dict(_held)
+        if not held:
+            continue
+        try:
+            still_held = state_db.renew_leases(list(held), time.time() + WORK_LEASE_SECONDS)
+        except Exception as e:
+            logging.warning(f"Could not renew work leases: {e}")
+            continue
+        lost = set(held) - still_held
+        if lost:
+            with _held_lock:
+                for token in lost:
+                    _held.pop(token, None)
+            logging.warning(f"Lost the lease on tasks {sorted(held[token] for token in lost)}; they expired before they could be renewed.")